@@ -1,13 +1,17 @@
 from django.contrib import admin
-from shop.models import Category, Product, ProductCategory, TopCategory, Cart, CartItem, Order, OrderItem, ShippingAddress
+from shop.models import Category, Product, ProductCategory, TopCategory, ProductSales, DailyProductSales, DailyCategorySales, Cart, CartItem, Order, OrderItem, OutboxMessage, ShippingAddress
 
 
 admin.site.register(Category)
 admin.site.register(Product)
 admin.site.register(ProductCategory)
 admin.site.register(TopCategory)
+admin.site.register(ProductSales)
+admin.site.register(DailyProductSales)
+admin.site.register(DailyCategorySales)
 admin.site.register(Cart)
 admin.site.register(CartItem)
 admin.site.register(Order)
 admin.site.register(OrderItem)
+admin.site.register(OutboxMessage)
 admin.site.register(ShippingAddress)
\ No newline at end of file
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from shop import signals  # noqa: F401
+        from shop.metrics import install_query_wrapper
+
+        connection_created.connect(install_query_wrapper)
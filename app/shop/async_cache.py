@@ -0,0 +1,237 @@
+import asyncio
+import time
+import weakref
+from django.conf import settings
+from django.core.cache import cache
+from redis import asyncio as aioredis
+from shop import metrics
+from shop.cache import (FRESH, STALE, GENERATION_KEY, LOCK_KEY, LOCK_POLL_INTERVAL, TAG_KEY, is_entry, local_cache,
+                        _make_entry, _new_version)
+from shop.utils import get_redis
+
+
+# Async counterparts of shop.cache for the async views. Entries, tags and
+# locks are shared with the sync code, so both stacks read and invalidate
+# the same keys.
+
+class AsyncRedisCache:
+    """
+    The subset of Django's async cache API used here, on a redis.asyncio
+    client. Keys and values go through django-redis' own key function and
+    serializer so they are interchangeable with the sync cache.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.client = cache.client
+
+    def _key(self, key):
+        return self.client.make_key(key)
+
+    async def aget(self, key, default=None):
+        value = await self.redis.get(self._key(key))
+        return default if value is None else self.client.decode(value)
+
+    async def aget_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = await self.redis.mget([self._key(key) for key in keys])
+        return {key: self.client.decode(value) for key, value in zip(keys, values) if value is not None}
+
+    @staticmethod
+    def _px(timeout):
+        return int(timeout * 1000) if timeout is not None else None
+
+    async def aset(self, key, value, timeout):
+        await self.redis.set(self._key(key), self.client.encode(value), px=self._px(timeout))
+
+    async def aset_many(self, data, timeout):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in data.items():
+            pipe.set(self._key(key), self.client.encode(value), px=self._px(timeout))
+        await pipe.execute()
+
+    async def aadd(self, key, value, timeout):
+        return bool(await self.redis.set(self._key(key), self.client.encode(value), nx=True,
+                                         px=self._px(timeout)))
+
+    async def aadd_many(self, data, timeout):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in data.items():
+            pipe.set(self._key(key), self.client.encode(value), nx=True, px=self._px(timeout))
+        await pipe.execute()
+
+    async def adelete(self, key):
+        await self.redis.delete(self._key(key))
+
+
+# redis.asyncio connections belong to the event loop that opened them
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_cache():
+    """
+    Async client for the default cache: a native redis.asyncio client when
+    the cache is redis, otherwise Django's own async cache methods, which
+    run the sync backend in a thread.
+    """
+    if get_redis() is None:
+        return cache
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncRedisCache(aioredis.from_url(settings.CACHES["default"]["LOCATION"]))
+    return client
+
+
+def get_async_redis():
+    acache = get_async_cache()
+    return acache.redis if isinstance(acache, AsyncRedisCache) else None
+
+
+@metrics.timed("cache")
+async def atag_versions(tags):
+    acache = get_async_cache()
+    keys = {TAG_KEY.format(tag): tag for tag in tags}
+    found = await acache.aget_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        created = {key: _new_version() for key in missing}
+        if isinstance(acache, AsyncRedisCache):
+            await acache.aadd_many(created, timeout=None)
+        else:
+            for key, version in created.items():
+                await acache.aadd(key, version, timeout=None)
+        found.update(await acache.aget_many(missing))
+    return {keys[key]: version for key, version in found.items()}
+
+
+async def _aentry_state(entry):
+    if not is_entry(entry):
+        return None
+    versions = entry["tags"]
+    if versions:
+        current = await get_async_cache().aget_many([TAG_KEY.format(tag) for tag in versions])
+        for tag, version in versions.items():
+            if current.get(TAG_KEY.format(tag)) != version:
+                return None
+    return FRESH if time.time() < entry["fresh_until"] else STALE
+
+
+async def _alocal_generation():
+    if local_cache.generation_expired():
+        return local_cache.set_generation(await get_async_cache().aget(GENERATION_KEY))
+    return local_cache.generation()
+
+
+async def _alocal_get(key):
+    item = local_cache.lookup(key)
+    if item is None:
+        return None
+    current = await _alocal_generation()
+    if item[1] != current and not local_cache.revalidate(key, item, current, await _aentry_state(item[2])):
+        return None
+    local_cache.hits += 1
+    return item[2]
+
+
+@metrics.timed("cache")
+async def aget_many_entries(keys, local=False):
+    found = {}
+    if local:
+        for key in keys:
+            entry = await _alocal_get(key)
+            if entry is not None and time.time() < entry["fresh_until"]:
+                found[key] = entry
+    remaining = [key for key in keys if key not in found]
+    if remaining:
+        acache = get_async_cache()
+        generation = await _alocal_generation() if local else None
+        entries = {key: entry for key, entry in (await acache.aget_many(remaining)).items() if is_entry(entry)}
+        tag_keys = {TAG_KEY.format(tag) for entry in entries.values() for tag in entry["tags"]}
+        current = await acache.aget_many(tag_keys) if tag_keys else {}
+        for key, entry in entries.items():
+            if all(current.get(TAG_KEY.format(tag)) == version for tag, version in entry["tags"].items()):
+                found[key] = entry
+                if local and time.time() < entry["fresh_until"]:
+                    local_cache.set(key, entry, generation)
+    metrics.cache_hits(len(found))
+    metrics.cache_misses(len(keys) - len(found))
+    return found
+
+
+@metrics.timed("cache")
+async def aset_many_cached(items, timeout, local=False):
+    generation = await _alocal_generation() if local else None
+    entries = {key: _make_entry(data, timeout, versions) for key, (data, versions) in items.items()}
+    if entries:
+        await get_async_cache().aset_many(entries, timeout=timeout)
+    if local:
+        for key, entry in entries.items():
+            local_cache.set(key, entry, generation)
+    return entries
+
+
+async def _abuild(key, build, timeout, soft_ttl, local, compress):
+    metrics.cache_misses()
+    generation = await _alocal_generation() if local else None
+    built = await build()
+    if built is None:
+        return None
+    data, versions = built
+    entry = _make_entry(data, timeout, versions, soft_ttl, compress)
+    await get_async_cache().aset(key, entry, timeout=timeout)
+    if local:
+        local_cache.set(key, entry, generation)
+    return entry
+
+
+@metrics.timed("cache")
+async def aget_or_set_entry(key, build, timeout, soft_ttl=None, local=False, compress=False):
+    """
+    Async get_or_set_entry: ``build`` is a coroutine function and waiting
+    for another worker's rebuild yields to the event loop.
+    """
+    if local:
+        entry = await _alocal_get(key)
+        if entry is not None and time.time() < entry["fresh_until"]:
+            metrics.cache_hits()
+            return entry
+
+    acache = get_async_cache()
+    generation = await _alocal_generation() if local else None
+    entry = await acache.aget(key)
+    state = await _aentry_state(entry)
+    if state == FRESH:
+        if local:
+            local_cache.set(key, entry, generation)
+        metrics.cache_hits()
+        return entry
+
+    token = _new_version()
+    if not await acache.aadd(LOCK_KEY.format(key), token, timeout=settings.CACHE_LOCK_TIMEOUT):
+        if state == STALE:
+            metrics.cache_hits()
+            return entry
+        deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            entry = await acache.aget(key)
+            if await _aentry_state(entry):
+                metrics.cache_hits()
+                return entry
+            if await acache.aget(LOCK_KEY.format(key)) is None:
+                break
+        return await _abuild(key, build, timeout, soft_ttl, local, compress)
+
+    try:
+        return await _abuild(key, build, timeout, soft_ttl, local, compress)
+    finally:
+        if await acache.aget(LOCK_KEY.format(key)) == token:
+            await acache.adelete(LOCK_KEY.format(key))
+
+
+async def aget_or_set(key, build, timeout, soft_ttl=None, local=False):
+    entry = await aget_or_set_entry(key, build, timeout, soft_ttl, local)
+    return entry["data"] if entry is not None else None
@@ -0,0 +1,108 @@
+from functools import wraps
+from django.conf import settings
+from django.http import HttpResponseNotAllowed
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from shop.async_cache import aget_or_set, aget_or_set_entry, atag_versions
+from shop.cache import CATALOG_TAG, CATEGORIES_TAG, category_tag, product_tag
+from shop.cart import aserialize_cart
+from shop.catalog import CATEGORIES_KEY, PRODUCT_KEY, render_product
+from shop.models import Category, Product, ShippingAddress
+from shop.pagination import akeyset_paginate, get_page_size
+from shop.serializers import CategorySerializer, ProductSerializer, ShippingAddressSerializer
+from shop.utils import cached_json_response, json_response, render_json
+from shop.views import product_listing
+
+
+# Native async versions of the hot read endpoints, routed instead of the
+# sync ones when ASYNC_READ_VIEWS is set and served by an ASGI worker. They
+# share cache keys, tags and response bodies with shop.views.
+
+def require_GET(view):
+    # django.views.decorators.http only handles async views from Django 5.0
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "GET":
+            return HttpResponseNotAllowed(["GET"])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def error_response(detail, status_code=status.HTTP_400_BAD_REQUEST):
+    return json_response(render_json(detail), status=status_code)
+
+
+@require_GET
+async def get_categories(request):
+    async def build():
+        versions = await atag_versions([CATALOG_TAG, CATEGORIES_TAG])
+        categories = [category async for category in Category.objects.all()]
+        return render_json(CategorySerializer(categories, many=True).data), versions
+
+    entry = await aget_or_set_entry(CATEGORIES_KEY, build, timeout=settings.CATALOG_CACHE_TTL, local=True,
+                                    compress=True)
+    return cached_json_response(request, entry)
+
+
+@require_GET
+async def get_products(request, slug):
+    try:
+        products, ordering, cache_key, error = product_listing(request, slug)
+    except ValidationError as e:
+        return error_response(e.detail)
+    if error:
+        return error_response({"error": error})
+
+    async def build():
+        versions = await atag_versions([CATALOG_TAG, category_tag(slug)])
+        page, next_cursor = await akeyset_paginate(
+            products, ordering, cursor=request.GET.get("cursor"), limit=get_page_size(request))
+        serializer = ProductSerializer(page, many=True)
+        return render_json({"results": serializer.data, "next_cursor": next_cursor}), versions
+
+    try:
+        entry = await aget_or_set_entry(cache_key, build, timeout=settings.CATALOG_CACHE_TTL, local=True,
+                                        compress=True)
+    except ValidationError as e:
+        return error_response(e.detail)
+    return cached_json_response(request, entry)
+
+
+@require_GET
+async def product_detail(request, slug):
+    async def build():
+        product_id = await Product.objects.filter(slug=slug).values_list("id", flat=True).afirst()
+        if product_id is None:
+            return None
+        versions = await atag_versions([CATALOG_TAG, product_tag(product_id)])
+        product = await Product.objects.filter(id=product_id).prefetch_related("category").afirst()
+        if not product:
+            return None
+        return render_product(product), versions
+
+    entry = await aget_or_set_entry(PRODUCT_KEY.format(slug), build, timeout=settings.CATALOG_CACHE_TTL,
+                                    local=True, compress=True)
+    if entry is None:
+        return error_response({"error": "Product not found"}, status.HTTP_404_NOT_FOUND)
+    return cached_json_response(request, entry)
+
+
+@require_GET
+async def get_cart_list(request):
+    user_id = request.GET.get("user_id", None)
+    return json_response(render_json(await aserialize_cart(user_id)))
+
+
+@require_GET
+async def get_address_list(request):
+    user_id = request.GET.get("user_id", None)
+
+    async def build():
+        address_list = [address async for address in ShippingAddress.objects.filter(
+            user_id=user_id).order_by("created_at")]
+        serializer = ShippingAddressSerializer(address_list, many=True)
+        for addr in serializer.data:
+            addr["is_selected"] = True if addr["is_default"] else False
+        return render_json(serializer.data), None
+
+    return json_response(await aget_or_set(f"address:{user_id}", build, timeout=settings.CACHE_TTL))
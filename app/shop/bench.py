@@ -0,0 +1,25 @@
+import math
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Throughput and latency percentiles (in milliseconds) for one run of
+    ``len(latencies)`` requests taking ``elapsed`` seconds in total.
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
@@ -0,0 +1,383 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from shop import metrics
+from shop.cdn import purge_tags
+from shop.compression import compress_variants
+from shop.utils import get_redis
+
+
+# Entries are stored as {"tags": {tag: version}, "data": ..., "fresh_until": ts}.
+# An entry is only valid while every tag still has the version it was written
+# with, so bumping one tag version invalidates all dependent entries at once.
+# Past fresh_until (the soft TTL) a valid entry is stale: one request
+# refreshes it while the others keep being served the stale copy.
+# Rendered bodies also carry an ETag, and the ones served as they are
+# (compress=True) their compressed variants.
+TAG_KEY = "tag:{}"
+LOCK_KEY = "lock:{}"
+GENERATION_KEY = "cache:generation"
+CATALOG_TAG = "catalog"
+CATEGORIES_TAG = "categories"
+
+SOFT_TTL_RATIO = 0.8
+LOCK_POLL_INTERVAL = 0.02
+
+FRESH = "fresh"
+STALE = "stale"
+
+
+def product_tag(product_id):
+    return f"product:{product_id}"
+
+
+def category_tag(slug):
+    return f"category:{slug}"
+
+
+def orders_tag(user_id):
+    return f"orders:{user_id}"
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+class LocalCache:
+    """
+    Bounded, thread-safe LRU of cache entries kept in worker memory.
+
+    Entries remember the cache generation they were last validated against.
+    Every tag invalidation bumps the shared generation; once a worker notices
+    (it re-reads the generation at most every LOCAL_CACHE_CHECK_INTERVAL
+    seconds) its entries have their tags re-checked against the shared cache
+    on next use, so unaffected entries survive and affected ones are dropped.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(entry):
+        data = entry["data"]
+        size = len(data) if isinstance(data, (str, bytes)) else 0
+        return size + sum(len(variant) for variant in entry.get("encodings", {}).values())
+
+    def generation(self):
+        if self.generation_expired():
+            self.set_generation(cache.get(GENERATION_KEY))
+        return self._generation
+
+    def generation_expired(self):
+        return time.monotonic() - self._generation_checked > settings.LOCAL_CACHE_CHECK_INTERVAL
+
+    def set_generation(self, generation):
+        self._generation = generation
+        self._generation_checked = time.monotonic()
+        return generation
+
+    def expire_generation(self):
+        self._generation_checked = 0
+
+    def get(self, key):
+        item = self.lookup(key)
+        if item is None:
+            return None
+        current = self.generation()
+        if item[1] != current and not self.revalidate(key, item, current, _entry_state(item[2])):
+            return None
+        self.hits += 1
+        return item[2]
+
+    def lookup(self, key):
+        # (expires_at, generation, entry) for a live key, without validation
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] < time.monotonic():
+                self._pop(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            return item
+
+    def revalidate(self, key, item, current, state):
+        # Records the outcome of re-checking an entry from an older generation
+        self.revalidations += 1
+        if not state:
+            self.delete(key)
+            self.misses += 1
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (item[0], current, item[2])
+        return True
+
+    def set(self, key, entry, generation):
+        size = self._size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, generation, entry)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= self._size(item[2])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+        }
+
+
+local_cache = LocalCache(settings.LOCAL_CACHE_MAX_ENTRIES, settings.LOCAL_CACHE_MAX_BYTES,
+                         settings.LOCAL_CACHE_TTL)
+
+
+@metrics.timed("cache")
+def tag_versions(tags):
+    """
+    Current versions of ``tags``, creating the ones that do not exist yet.
+    Read them before loading the data to be cached so an invalidation
+    racing with the load leaves the entry already stale.
+    """
+    keys = {TAG_KEY.format(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # Only add: overwriting a version invalidate_tags() just bumped would
+        # revive the entries it invalidated. Re-read to get the winners.
+        _add_many({key: _new_version() for key in missing})
+        found.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in found.items()}
+
+
+def _add_many(data):
+    redis = get_redis()
+    if redis is None:
+        for key, value in data.items():
+            cache.add(key, value, timeout=None)
+        return
+    # Pipelined SET NX through django-redis' key function and serializer
+    pipe = redis.pipeline(transaction=False)
+    for key, value in data.items():
+        pipe.set(cache.client.make_key(key), cache.client.encode(value), nx=True)
+    pipe.execute()
+
+
+@metrics.timed("cache")
+def invalidate_tags(*tags):
+    if tags:
+        versions = {TAG_KEY.format(tag): _new_version() for tag in tags}
+        versions[GENERATION_KEY] = _new_version()
+        cache.set_many(versions, timeout=None)
+        local_cache.expire_generation()
+        purge_tags(tags)
+
+
+def is_entry(value):
+    # Keys written before tagged entries existed (e.g. product:<slug> as a
+    # JSON string) may still be cached; they count as misses
+    return isinstance(value, dict) and "tags" in value
+
+
+def _entry_state(entry):
+    if not is_entry(entry):
+        return None
+    versions = entry["tags"]
+    if versions:
+        current = cache.get_many([TAG_KEY.format(tag) for tag in versions])
+        for tag, version in versions.items():
+            if current.get(TAG_KEY.format(tag)) != version:
+                return None
+    return FRESH if time.time() < entry["fresh_until"] else STALE
+
+
+@metrics.timed("cache")
+def get_cached(key):
+    entry = cache.get(key)
+    if _entry_state(entry):
+        metrics.cache_hits()
+        return entry["data"]
+    metrics.cache_misses()
+    return None
+
+
+def _make_entry(data, timeout, versions=None, soft_ttl=None, compress=False):
+    if soft_ttl is None:
+        soft_ttl = timeout * SOFT_TTL_RATIO if timeout is not None else float("inf")
+    entry = {"tags": versions or {}, "data": data, "fresh_until": time.time() + soft_ttl}
+    if isinstance(data, bytes):
+        # Strong validator for conditional requests, computed once per fill
+        entry["etag"] = '"{}"'.format(hashlib.blake2b(data, digest_size=16).hexdigest())
+        if compress:
+            entry["encodings"] = compress_variants(data)
+    return entry
+
+
+@metrics.timed("cache")
+def set_cached(key, data, timeout, versions=None, soft_ttl=None, compress=False):
+    entry = _make_entry(data, timeout, versions, soft_ttl, compress)
+    cache.set(key, entry, timeout=timeout)
+    return entry
+
+
+@metrics.timed("cache")
+def get_many_entries(keys, local=False):
+    """
+    Valid (fresh or stale) entries for ``keys`` with one get_many for the
+    entries and one for all of their tag versions, whatever the key count.
+    """
+    found = {}
+    if local:
+        for key in keys:
+            entry = local_cache.get(key)
+            if entry is not None and time.time() < entry["fresh_until"]:
+                found[key] = entry
+    remaining = [key for key in keys if key not in found]
+    if remaining:
+        generation = local_cache.generation() if local else None
+        entries = {key: entry for key, entry in cache.get_many(remaining).items() if is_entry(entry)}
+        tag_keys = {TAG_KEY.format(tag) for entry in entries.values() for tag in entry["tags"]}
+        current = cache.get_many(tag_keys) if tag_keys else {}
+        for key, entry in entries.items():
+            if all(current.get(TAG_KEY.format(tag)) == version for tag, version in entry["tags"].items()):
+                found[key] = entry
+                if local and time.time() < entry["fresh_until"]:
+                    local_cache.set(key, entry, generation)
+    metrics.cache_hits(len(found))
+    metrics.cache_misses(len(keys) - len(found))
+    return found
+
+
+@metrics.timed("cache")
+def set_many_cached(items, timeout, local=False):
+    """
+    Stores ``items``, a mapping of key to (data, tag versions), in one
+    set_many and returns the new entries by key.
+    """
+    generation = local_cache.generation() if local else None
+    entries = {key: _make_entry(data, timeout, versions) for key, (data, versions) in items.items()}
+    if entries:
+        cache.set_many(entries, timeout=timeout)
+    if local:
+        for key, entry in entries.items():
+            local_cache.set(key, entry, generation)
+    return entries
+
+
+def _acquire(key):
+    token = _new_version()
+    if cache.add(LOCK_KEY.format(key), token, timeout=settings.CACHE_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release(key, token):
+    lock_key = LOCK_KEY.format(key)
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _build(key, build, timeout, soft_ttl, local, compress):
+    metrics.cache_misses()
+    generation = local_cache.generation() if local else None
+    built = build()
+    if built is None:
+        return None
+    data, versions = built
+    entry = set_cached(key, data, timeout, versions, soft_ttl, compress)
+    if local:
+        local_cache.set(key, entry, generation)
+    return entry
+
+
+@metrics.timed("cache")
+def get_or_set_entry(key, build, timeout, soft_ttl=None, local=False, compress=False):
+    """
+    Returns the cache entry for ``key``, calling ``build`` to produce it on a
+    miss. ``build`` returns a (data, tag versions) pair, or None when there
+    is nothing to cache. Only the request holding a short lock rebuilds a
+    missing or stale entry; concurrent requests serve the stale copy or wait
+    up to CACHE_LOCK_WAIT seconds for the rebuilt one. With ``local`` fresh
+    entries are also kept in this worker's LocalCache and served from there
+    without a network round trip. ``compress`` stores precompressed variants
+    of the body for entries served with cached_json_response().
+    """
+    if local:
+        entry = local_cache.get(key)
+        if entry is not None and time.time() < entry["fresh_until"]:
+            metrics.cache_hits()
+            return entry
+
+    generation = local_cache.generation() if local else None
+    entry = cache.get(key)
+    state = _entry_state(entry)
+    if state == FRESH:
+        if local:
+            local_cache.set(key, entry, generation)
+        metrics.cache_hits()
+        return entry
+
+    token = _acquire(key)
+    if token is None:
+        if state == STALE:
+            metrics.cache_hits()
+            return entry
+        deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = cache.get(key)
+            if _entry_state(entry):
+                metrics.cache_hits()
+                return entry
+            if cache.get(LOCK_KEY.format(key)) is None:
+                # The holder finished without caching anything (e.g. a 404)
+                break
+        return _build(key, build, timeout, soft_ttl, local, compress)
+
+    try:
+        return _build(key, build, timeout, soft_ttl, local, compress)
+    finally:
+        _release(key, token)
+
+
+def get_or_set(key, build, timeout, soft_ttl=None, local=False):
+    entry = get_or_set_entry(key, build, timeout, soft_ttl, local)
+    return entry["data"] if entry is not None else None
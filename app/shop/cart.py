@@ -0,0 +1,227 @@
+import json
+from django.conf import settings
+from django.core.cache import cache
+from shop import metrics
+from shop.async_cache import get_async_redis
+from shop.catalog import aget_product_entries, get_product_entries
+from shop.models import CartItem
+from shop.serializers import CartProductSerializer
+from shop.utils import get_redis
+
+
+# A cart is cached as a redis hash of product_id -> {id, cart, quantity,
+# is_selected, added_at}, so a mutation rewrites one field instead of the
+# whole cart. Product data is not duplicated per cart; it is hydrated from
+# the shared product cache on read.
+CART_KEY = "cart_items:{}"
+LOADED_FIELD = "_loaded"
+
+
+def _encode(item):
+    return json.dumps(item, separators=(",", ":"), default=str)
+
+
+def _decode(fields):
+    if not fields:
+        return None
+    return {int(field): json.loads(value) for field, value in fields.items()
+            if field.decode() != LOADED_FIELD}
+
+
+def _hash(items):
+    return {LOADED_FIELD: 1, **{product_id: _encode(item) for product_id, item in items.items()}}
+
+
+class RedisCartStore:
+    def __init__(self, redis):
+        self.redis = redis
+
+    def _hset_if_loaded(self, key, mapping):
+        # Writing into a cart that is not cached (or just expired) would
+        # leave a partial hash hiding the rest of the cart, so drop it again
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.hexists(key, LOADED_FIELD)
+        _, loaded = pipe.execute()
+        if not loaded:
+            self.redis.delete(key)
+
+    def load(self, user_id):
+        return _decode(self.redis.hgetall(CART_KEY.format(user_id)))
+
+    def fill(self, user_id, items):
+        key = CART_KEY.format(user_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping=_hash(items))
+        pipe.expire(key, settings.CACHE_TTL)
+        pipe.execute()
+
+    def put(self, user_id, product_id, item):
+        self._hset_if_loaded(CART_KEY.format(user_id), {product_id: _encode(item)})
+
+    def patch(self, user_id, product_ids, fields):
+        key = CART_KEY.format(user_id)
+        values = self.redis.hmget(key, product_ids)
+        updates = {}
+        for product_id, value in zip(product_ids, values):
+            if value is not None:
+                updates[product_id] = _encode({**json.loads(value), **fields})
+        if updates:
+            self._hset_if_loaded(key, updates)
+
+    def delete(self, user_id, product_ids):
+        if product_ids:
+            self.redis.hdel(CART_KEY.format(user_id), *product_ids)
+
+    def invalidate(self, user_id):
+        self.redis.delete(CART_KEY.format(user_id))
+
+
+class CacheCartStore:
+    # Same interface on top of the Django cache for non-redis backends,
+    # rewriting the whole mapping on every change
+
+    def load(self, user_id):
+        return cache.get(CART_KEY.format(user_id))
+
+    def fill(self, user_id, items):
+        cache.set(CART_KEY.format(user_id), items, timeout=settings.CACHE_TTL)
+
+    def _update(self, user_id, change):
+        items = self.load(user_id)
+        if items is not None:
+            change(items)
+            self.fill(user_id, items)
+
+    def put(self, user_id, product_id, item):
+        self._update(user_id, lambda items: items.__setitem__(product_id, item))
+
+    def patch(self, user_id, product_ids, fields):
+        def change(items):
+            for product_id in product_ids:
+                if product_id in items:
+                    items[product_id] = {**items[product_id], **fields}
+        self._update(user_id, change)
+
+    def delete(self, user_id, product_ids):
+        def change(items):
+            for product_id in product_ids:
+                items.pop(product_id, None)
+        self._update(user_id, change)
+
+    def invalidate(self, user_id):
+        cache.delete(CART_KEY.format(user_id))
+
+
+def get_cart_store():
+    redis = get_redis()
+    return RedisCartStore(redis) if redis is not None else CacheCartStore()
+
+
+# Read side of the stores for the async views; writes stay synchronous
+
+class AsyncRedisCartStore:
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def load(self, user_id):
+        return _decode(await self.redis.hgetall(CART_KEY.format(user_id)))
+
+    async def fill(self, user_id, items):
+        key = CART_KEY.format(user_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping=_hash(items))
+        pipe.expire(key, settings.CACHE_TTL)
+        await pipe.execute()
+
+
+class AsyncCacheCartStore:
+    async def load(self, user_id):
+        return await cache.aget(CART_KEY.format(user_id))
+
+    async def fill(self, user_id, items):
+        await cache.aset(CART_KEY.format(user_id), items, timeout=settings.CACHE_TTL)
+
+
+def get_async_cart_store():
+    redis = get_async_redis()
+    return AsyncRedisCartStore(redis) if redis is not None else AsyncCacheCartStore()
+
+
+def cart_item(obj):
+    return {
+        "id": obj.id,
+        "cart": obj.cart_id,
+        "quantity": obj.quantity,
+        "is_selected": obj.is_selected,
+        "added_at": obj.created_at.isoformat(),
+    }
+
+
+def _cart_rows(user_id):
+    return CartItem.objects.filter(cart__user_id=user_id) \
+        .only("id", "cart", "product", "quantity", "is_selected", "created_at")
+
+
+def load_cart(user_id, store=None):
+    store = store or get_cart_store()
+    with metrics.timer("cache"):
+        items = store.load(user_id)
+    if items is None:
+        metrics.cache_misses()
+        items = {row.product_id: cart_item(row) for row in _cart_rows(user_id)}
+        with metrics.timer("cache"):
+            store.fill(user_id, items)
+    else:
+        metrics.cache_hits()
+    return items
+
+
+async def aload_cart(user_id, store=None):
+    store = store or get_async_cart_store()
+    with metrics.timer("cache"):
+        items = await store.load(user_id)
+    if items is None:
+        metrics.cache_misses()
+        items = {row.product_id: cart_item(row) async for row in _cart_rows(user_id)}
+        with metrics.timer("cache"):
+            await store.fill(user_id, items)
+    else:
+        metrics.cache_hits()
+    return items
+
+
+def _cart_list(items, entries):
+    products = {}
+    for entry in entries:
+        product = json.loads(entry["data"])
+        products[product["id"]] = {field: product[field] for field in CartProductSerializer.Meta.fields}
+
+    cart_list = []
+    for product_id, item in sorted(items.items(), key=lambda pair: pair[1]["added_at"]):
+        if product_id in products:
+            cart_list.append({
+                "id": item["id"],
+                "cart": item["cart"],
+                "product": products[product_id],
+                "quantity": item["quantity"],
+                "is_selected": item["is_selected"],
+            })
+    return cart_list
+
+
+def serialize_cart(user_id, store=None):
+    """
+    Cart lines for ``user_id`` in the order they were added, each with the
+    slim CartProductSerializer projection of its product taken from the
+    shared product cache.
+    """
+    items = load_cart(user_id, store)
+    return _cart_list(items, get_product_entries(ids=list(items)))
+
+
+async def aserialize_cart(user_id, store=None):
+    items = await aload_cart(user_id, store)
+    return _cart_list(items, await aget_product_entries(ids=list(items)))
@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.core.cache import cache
+from shop.async_cache import aget_many_entries, aset_many_cached, atag_versions, get_async_cache
+from shop.cache import (CATALOG_TAG, CATEGORIES_TAG, get_many_entries, get_or_set_entry, product_tag,
+                        set_many_cached, tag_versions)
+from shop.models import Category, Product
+from shop.serializers import CategorySerializer, ProductSerializer
+from shop.utils import render_json
+
+
+CATEGORIES_KEY = "categories"
+PRODUCT_KEY = "product:{}"
+PRODUCT_SLUG_KEY = "product_slug:{}"
+
+
+def get_categories_entry():
+    def build():
+        versions = tag_versions([CATALOG_TAG, CATEGORIES_TAG])
+        serializer = CategorySerializer(Category.objects.all(), many=True)
+        return render_json(serializer.data), versions
+
+    return get_or_set_entry(CATEGORIES_KEY, build, timeout=settings.CATALOG_CACHE_TTL, local=True, compress=True)
+
+
+def render_product(product):
+    product_data = ProductSerializer(product).data
+    if product_data["description"]:
+        product_data["description"] = product_data["description"] if isinstance(product_data["description"], list) else [product_data["description"]]
+    return render_json(product_data)
+
+
+def _alias_keys(ids):
+    return [PRODUCT_SLUG_KEY.format(product_id) for product_id in ids]
+
+
+def _resolve_aliases(ids, aliases):
+    return {product_id: aliases[PRODUCT_SLUG_KEY.format(product_id)] for product_id in ids
+            if PRODUCT_SLUG_KEY.format(product_id) in aliases}
+
+
+def _entry_keys(slugs, slug_for_id):
+    keys = {PRODUCT_KEY.format(slug) for slug in slugs}
+    keys.update(PRODUCT_KEY.format(slug) for slug in slug_for_id.values())
+    return list(keys)
+
+
+def _missing(slugs, ids, slug_for_id, entries):
+    missing_slugs = [slug for slug in slugs if PRODUCT_KEY.format(slug) not in entries]
+    # An alias may be left over from a slug that changed or got reused
+    missing_ids = [product_id for product_id in ids
+                   if product_tag(product_id) not in entries.get(
+                       PRODUCT_KEY.format(slug_for_id.get(product_id)), {"tags": {}})["tags"]]
+    return missing_slugs, missing_ids
+
+
+def _ids_for_slugs(slugs):
+    return Product.objects.filter(slug__in=slugs).values_list("id", flat=True)
+
+
+def _product_items(products, versions):
+    return {
+        PRODUCT_KEY.format(product.slug): (
+            render_product(product),
+            {CATALOG_TAG: versions[CATALOG_TAG], product_tag(product.id): versions[product_tag(product.id)]}
+        )
+        for product in products
+    }
+
+
+def _product_aliases(products):
+    return {PRODUCT_SLUG_KEY.format(product.id): product.slug for product in products}
+
+
+def _product_tags(product_ids):
+    return [CATALOG_TAG] + [product_tag(product_id) for product_id in product_ids]
+
+
+def _load_products(product_ids):
+    return Product.objects.filter(id__in=product_ids).prefetch_related("category")
+
+
+def _ordered(slugs, ids, slug_for_id, entries):
+    ordered = []
+    seen = set()
+    requested = [PRODUCT_KEY.format(slug) for slug in slugs] + \
+        [PRODUCT_KEY.format(slug_for_id[product_id]) for product_id in ids if product_id in slug_for_id]
+    for key in requested:
+        if key in entries and key not in seen:
+            seen.add(key)
+            ordered.append(entries[key])
+    return ordered
+
+
+def cache_products(product_ids):
+    """
+    Loads the products with ``product_ids`` (two queries) and renders them
+    into the product cache with two pipelined writes. Tag versions are read
+    before the load, so an edit racing with it leaves the entries stale.
+    Returns the loaded products and their new entries by key.
+    """
+    versions = tag_versions(_product_tags(product_ids))
+    products = list(_load_products(product_ids))
+    entries = set_many_cached(_product_items(products, versions), timeout=settings.CATALOG_CACHE_TTL, local=True)
+    cache.set_many(_product_aliases(products), timeout=settings.CATALOG_CACHE_TTL)
+    return products, entries
+
+
+def get_product_entries(slugs=(), ids=()):
+    """
+    Cache entries of the products with the given slugs and ids, in request
+    order and without the ones that do not exist. Cached products cost two
+    multi-gets (plus one for the id -> slug aliases); all misses are loaded
+    with a single query (plus one to resolve missed slugs to ids) and
+    written back with one set_many.
+    """
+    slug_for_id = _resolve_aliases(ids, cache.get_many(_alias_keys(ids))) if ids else {}
+    entries = get_many_entries(_entry_keys(slugs, slug_for_id), local=True)
+
+    missing_slugs, missing_ids = _missing(slugs, ids, slug_for_id, entries)
+    if missing_slugs:
+        missing_ids += list(_ids_for_slugs(missing_slugs))
+    if missing_ids:
+        products, new_entries = cache_products(set(missing_ids))
+        entries.update(new_entries)
+        slug_for_id.update({product.id: product.slug for product in products})
+
+    return _ordered(slugs, ids, slug_for_id, entries)
+
+
+async def aget_product_entries(slugs=(), ids=()):
+    acache = get_async_cache()
+    slug_for_id = _resolve_aliases(ids, await acache.aget_many(_alias_keys(ids))) if ids else {}
+    entries = await aget_many_entries(_entry_keys(slugs, slug_for_id), local=True)
+
+    missing_slugs, missing_ids = _missing(slugs, ids, slug_for_id, entries)
+    if missing_slugs:
+        missing_ids += [product_id async for product_id in _ids_for_slugs(missing_slugs)]
+    if missing_ids:
+        missing_ids = set(missing_ids)
+        versions = await atag_versions(_product_tags(missing_ids))
+        products = [product async for product in _load_products(missing_ids)]
+        entries.update(await aset_many_cached(_product_items(products, versions),
+                                              timeout=settings.CATALOG_CACHE_TTL, local=True))
+        await acache.aset_many(_product_aliases(products), timeout=settings.CATALOG_CACHE_TTL)
+        slug_for_id.update({product.id: product.slug for product in products})
+
+    return _ordered(slugs, ids, slug_for_id, entries)
@@ -0,0 +1,42 @@
+import logging
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Catalog responses carry their cache tags as Surrogate-Key. When they may
+# be kept by a CDN (CATALOG_SURROGATE_CONTROL), invalidating a tag must also
+# purge the CDN's copies, or they outlive the invalidation.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cdn-purge")
+        return _executor
+
+
+def _purge(tags):
+    # Fastly style batch purge: one POST with space separated surrogate keys
+    request = urllib.request.Request(settings.CDN_PURGE_URL, method="POST",
+                                     headers={"Surrogate-Key": " ".join(tags)})
+    if settings.CDN_PURGE_TOKEN:
+        request.add_header("Fastly-Key", settings.CDN_PURGE_TOKEN)
+    try:
+        with urllib.request.urlopen(request, timeout=settings.CDN_PURGE_TIMEOUT):
+            pass
+    except Exception:
+        logger.exception("Purging surrogate keys %s failed", " ".join(tags))
+
+
+def purge_tags(tags):
+    """Purges responses tagged with any of ``tags`` from the CDN, off the calling thread."""
+    if settings.CDN_PURGE_URL and tags:
+        _get_executor().submit(_purge, sorted(tags))
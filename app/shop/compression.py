@@ -0,0 +1,104 @@
+import gzip
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.regex_helper import _lazy_re_compile
+from shop import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Preferred first when the client accepts several with the same q-value
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml", "image/svg+xml")
+
+_accept_re = _lazy_re_compile(r"\s*([^\s;,]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?")
+
+
+def compress(data, encoding, precompressed=False):
+    """
+    Cached bodies are compressed once, so they get the slower, smaller
+    settings; responses compressed per request get the faster ones.
+    """
+    if encoding == "br":
+        quality = settings.BROTLI_CACHED_QUALITY if precompressed else settings.BROTLI_QUALITY
+        return brotli.compress(data, quality=quality)
+    level = settings.GZIP_CACHED_LEVEL if precompressed else settings.GZIP_LEVEL
+    # mtime=0 keeps the output, and so the ETag of a variant, stable
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_variants(data):
+    """Every supported encoding of ``data`` that is worth sending instead of it."""
+    if len(data) < settings.COMPRESSION_MIN_SIZE:
+        return {}
+    variants = {}
+    for encoding in ENCODINGS:
+        compressed = compress(data, encoding, precompressed=True)
+        if len(compressed) < len(data):
+            variants[encoding] = compressed
+    return variants
+
+
+def accepted_encodings(request):
+    accepted = {}
+    for match in _accept_re.finditer(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+        try:
+            accepted[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+    return accepted
+
+
+def choose_encoding(request, available):
+    """The client's most preferred of ``available`` encodings, or None for identity."""
+    accepted = accepted_encodings(request)
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compressible(response):
+    content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+    return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses of at least COMPRESSION_MIN_SIZE bytes with brotli
+    (when installed) or gzip, as negotiated with Accept-Encoding. Responses
+    that are already encoded, like precompressed cached catalog bodies, are
+    passed through.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header("Content-Encoding") or not _compressible(response):
+            return response
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = choose_encoding(request, ENCODINGS)
+        if encoding is None:
+            return response
+        with metrics.timer("serialize"):
+            compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        # The ETag was computed from the uncompressed body
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
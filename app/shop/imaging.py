@@ -0,0 +1,48 @@
+import io
+from PIL import Image, ImageOps
+
+
+# Pure Pillow code run in the rendition worker processes: bytes in, bytes
+# out, no Django models or storage, so it is cheap to import in a fresh
+# (spawned) process.
+
+SOURCE_FORMATS = {"JPEG": "jpeg", "PNG": "png"}
+
+
+def _prepared(image, fmt):
+    if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def _encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == "WEBP":
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    elif fmt == "JPEG":
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, fmt, optimize=True)
+    return buffer.getvalue()
+
+
+def render_renditions(data, widths, quality):
+    """
+    Resizes an encoded image to each of ``widths`` (never upscaling) and
+    encodes every size in the source format (JPEG unless it was PNG) and as
+    WebP. Returns ``[(width, format, bytes)]`` with lowercase format names.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source_format = source.format if source.format in SOURCE_FORMATS else "JPEG"
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    sizes = sorted({min(width, image.width) for width in widths})
+    renditions = []
+    for width in sizes:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        renditions.append((width, SOURCE_FORMATS[source_format],
+                           _encode(_prepared(resized, source_format), source_format, quality)))
+        renditions.append((width, "webp", _encode(resized, "WEBP", quality)))
+    return renditions
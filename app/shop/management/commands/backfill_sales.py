@@ -0,0 +1,42 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from shop.models import OrderItem, ProductSales, DailyProductSales, DailyCategorySales, TopCategory
+from shop.sales import apply_sales, discard_pending_sales
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the sales counters from the full order history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        # Orders up to now are counted from history, so anything still
+        # buffered would be counted twice
+        discard_pending_sales()
+        cutoff = timezone.now()
+        with transaction.atomic():
+            ProductSales.objects.all().delete()
+            DailyProductSales.objects.all().delete()
+            DailyCategorySales.objects.all().delete()
+            TopCategory.objects.update(total_purchases=0)
+
+        items = OrderItem.objects.filter(order__created_at__lt=cutoff) \
+            .values_list("product_id", "quantity", "order__created_at") \
+            .order_by("pk")
+        deltas = defaultdict(int)
+        processed = 0
+        for product_id, quantity, created_at in items.iterator(chunk_size=batch_size):
+            deltas[(product_id, timezone.localtime(created_at).date())] += quantity
+            processed += 1
+            if processed % batch_size == 0:
+                apply_sales(deltas)
+                deltas.clear()
+                self.stdout.write("Processed {} order items".format(processed))
+        apply_sales(deltas)
+
+        self.stdout.write(self.style.SUCCESS("Backfilled sales from {} order items".format(processed)))
@@ -0,0 +1,288 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client, override_settings
+from shop import search
+from shop.bench import summarize
+from shop.models import Category, Order, Product, ShippingAddress
+from shop.urls import urlpatterns
+from shop.views import PRODUCT_SORTS
+
+
+QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class Scenarios:
+    """
+    One request per route of shop/urls.py, built from the data already in
+    the database (see generate_catalog). Each call returns
+    ``(method, path, data)`` for the n-th request of that route.
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.categories = list(Category.objects.order_by("id").values_list("slug", flat=True)[:50])
+        self.products = list(Product.objects.order_by("id").values_list("id", "slug", "name")[:1000])
+        self.users = list(ShippingAddress.objects.order_by("user_id").values_list("user_id", flat=True)
+                          .distinct()[:1000])
+        self.addresses = list(ShippingAddress.objects.order_by("id").values("id", "user_id")[:1000])
+        if not (self.categories and self.products and self.users):
+            raise CommandError("No catalog data, run generate_catalog first")
+        self.buyers = list(Order.objects.order_by("user_id").values_list("user_id", flat=True)
+                           .distinct()[:1000]) or self.users
+
+    def product(self):
+        return self.rng.choice(self.products)
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def health_check(self, n):
+        return "get", "/health_check/", None
+
+    def metrics(self, n):
+        return "get", "/metrics", None
+
+    def get_categories(self, n):
+        return "get", "/categories/", None
+
+    def get_top_categories(self, n):
+        return "get", "/top_categories/", None
+
+    def get_products(self, n):
+        sort = list(PRODUCT_SORTS)[n % len(PRODUCT_SORTS)]
+        return "get", "/products/{}/?limit=20&sort={}".format(self.rng.choice(self.categories), sort), None
+
+    def product_detail(self, n):
+        return "get", "/product/{}/".format(self.product()[1]), None
+
+    def product_batch(self, n):
+        ids = ",".join(str(self.product()[0]) for _ in range(20))
+        return "get", "/product_batch/?ids={}".format(ids), None
+
+    def search_products(self, n):
+        return "get", "/search/?q={}".format(self.product()[2].split()[1]), None
+
+    def autocomplete_products(self, n):
+        return "get", "/search/autocomplete/?q={}".format(self.product()[2][:3]), None
+
+    def get_cart_list(self, n):
+        return "get", "/cart/?user_id={}".format(self.user()), None
+
+    def add_cart_item(self, n):
+        return "post", "/cart/add/", {"user_id": self.user(),
+                                      "cart_item": {"product_id": self.product()[0], "quantity": 1}}
+
+    def merge_cart(self, n):
+        items = [{"product": {"id": self.product()[0]}, "quantity": 2, "is_selected": True} for _ in range(5)]
+        return "post", "/cart/merge/", {"user_id": self.user(), "cart_items": items}
+
+    def update_cart_item(self, n):
+        return "patch", "/cart/update/", {"user_id": self.user(),
+                                          "cart_item": {"product_id": self.product()[0], "quantity": 3}}
+
+    def delete_cart_item(self, n):
+        return "delete", "/cart/delete/?user_id={}&product_ids={}".format(self.user(), self.product()[0]), None
+
+    def place_order(self, n):
+        items = [{"product_id": self.product()[0], "quantity": 1} for _ in range(3)]
+        return "post", "/order/place/", {
+            "user_id": self.user(), "email": "",
+            "order": {"shipping_address": "1 Main Street", "payment_method": "cod"},
+            "order_items": items,
+        }
+
+    def get_order_history(self, n):
+        return "get", "/order/history/?user_id={}&limit=10".format(self.rng.choice(self.buyers)), None
+
+    def get_address_list(self, n):
+        return "get", "/address/?user_id={}".format(self.user()), None
+
+    def add_address(self, n):
+        return "post", "/address/add/", {"user_id": self.user(), "new_address": {
+            "full_name": "Bench User", "mobile_number": "9000000000", "pin_code": "560001",
+            "address1": "1 Main Street", "address2": "Block 1", "city": "City", "state": "State"}}
+
+    def edit_address(self, n):
+        address = self.rng.choice(self.addresses)
+        return "patch", "/address/edit/", {"user_id": address["user_id"], "updated_address": {
+            "id": address["id"], "city": "City {}".format(n % 10), "is_selected": True}}
+
+
+def route_names():
+    return [pattern.name for pattern in urlpatterns if pattern.name]
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks every route in-process against the configured database and cache: throughput, "
+            "p50/p95/p99 latency and queries per request, optionally compared with a stored baseline. "
+            "Run with CACHE_BACKEND=locmem to benchmark without a redis server")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--route", action="append", dest="routes",
+                            help="Route name to run, may be repeated. Defaults to all routes")
+        parser.add_argument("--skip-writes", action="store_true", help="Only run GET routes")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--requests", type=int, default=500, help="Requests per route")
+        parser.add_argument("--warmup", type=int, default=50)
+        parser.add_argument("--async", action="store_true", dest="use_async",
+                            help="Drive the routes with the async test client on one event loop")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--baseline", help="JSON file with results of an earlier run to compare against")
+        parser.add_argument("--save-baseline", help="Write this run's results to a JSON file")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="Allowed relative slowdown before a route counts as a regression")
+
+    def run_threads(self, scenario, total, concurrency):
+        counter = itertools.count()
+        latencies, queries = [], []
+        errors = [0]
+        lock = threading.Lock()
+
+        def worker():
+            client = Client(raise_request_exception=False)
+            local_latencies, local_queries, local_errors = [], [], 0
+            try:
+                while (n := next(counter)) < total:
+                    method, path, data = scenario(n)
+                    start = time.perf_counter()
+                    response = getattr(client, method)(path, data, content_type="application/json") \
+                        if data is not None else getattr(client, method)(path)
+                    local_latencies.append(time.perf_counter() - start)
+                    local_queries.append(self.query_count(response))
+                    local_errors += response.status_code >= 400
+            finally:
+                connections.close_all()
+            with lock:
+                latencies.extend(local_latencies)
+                queries.extend(local_queries)
+                errors[0] += local_errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        return summarize(latencies, time.perf_counter() - start, errors[0]), queries
+
+    def run_async(self, scenario, total, concurrency):
+        counter = itertools.count()
+        latencies, queries = [], []
+        errors = [0]
+
+        async def worker():
+            client = AsyncClient(raise_request_exception=False)
+            while (n := next(counter)) < total:
+                method, path, data = scenario(n)
+                start = time.perf_counter()
+                response = await getattr(client, method)(path, data, content_type="application/json") \
+                    if data is not None else await getattr(client, method)(path)
+                latencies.append(time.perf_counter() - start)
+                queries.append(self.query_count(response))
+                errors[0] += response.status_code >= 400
+
+        async def main():
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        return summarize(latencies, time.perf_counter() - start, errors[0]), queries
+
+    @staticmethod
+    def query_count(response):
+        # Counted by MetricsMiddleware, which sees queries on every thread
+        match = QUERIES_RE.search(response.get("Server-Timing", ""))
+        return int(match.group(1)) if match else 0
+
+    def environment(self, options):
+        return {
+            "database": connection.vendor,
+            "cache": settings.CACHES["default"]["BACKEND"].rsplit(".", 1)[-1],
+            "concurrency": options["concurrency"],
+            "async": options["use_async"],
+        }
+
+    def run_routes(self, scenarios, names, options):
+        run = self.run_async if options["use_async"] else self.run_threads
+        concurrency = options["concurrency"]
+        results = {}
+        for name in names:
+            scenario = getattr(scenarios, name)
+            if options["warmup"]:
+                run(scenario, options["warmup"], min(concurrency, options["warmup"]))
+            result, queries = run(scenario, options["requests"], concurrency)
+            result["queries"] = sum(queries) / len(queries) if queries else 0.0
+            result["max_queries"] = max(queries, default=0)
+            results[name] = result
+            self.stdout.write("{:<24} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7}".format(
+                name, result["rps"], result["p50"], result["p95"], result["p99"], result["queries"],
+                result["errors"]))
+        return results
+
+    def handle(self, *args, **options):
+        scenarios = Scenarios(options["seed"])
+        names = route_names()
+        uncovered = [name for name in names if not hasattr(scenarios, name)]
+        if uncovered:
+            raise CommandError("No benchmark scenario for: {}".format(", ".join(uncovered)))
+        if options["routes"]:
+            unknown = set(options["routes"]) - set(names)
+            if unknown:
+                raise CommandError("Unknown routes: {}".format(", ".join(sorted(unknown))))
+            names = [name for name in names if name in options["routes"]]
+        if options["skip_writes"]:
+            names = [name for name in names if getattr(scenarios, name)(0)[0] == "get"]
+
+        # Like start.sh, have the search index ready before serving searches
+        search.load_index()
+        # Sampled, slow and 4xx request log lines would drown the report
+        for logger in ("shop.metrics", "django.request"):
+            logging.getLogger(logger).setLevel(logging.ERROR)
+        self.stdout.write("{:<24} {:>9} {:>8} {:>8} {:>8} {:>8} {:>7}".format(
+            "route", "req/s", "p50 ms", "p95 ms", "p99 ms", "queries", "errors"))
+        # The test client sends Host: testserver, which the test runner would allow
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            results = self.run_routes(scenarios, names, options)
+
+        report = {"environment": self.environment(options), "routes": results}
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write("Saved baseline to {}".format(options["save_baseline"]))
+        if options["baseline"]:
+            self.compare(report, options["baseline"], options["tolerance"])
+
+    def compare(self, report, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline.get("environment") != report["environment"]:
+            self.stdout.write(self.style.WARNING("Baseline was recorded with {}, this run uses {}".format(
+                baseline.get("environment"), report["environment"])))
+
+        regressions = []
+        self.stdout.write("{:<24} {:>12} {:>12} {:>12}".format("route", "req/s", "p95", "queries"))
+        for name, result in report["routes"].items():
+            before = baseline["routes"].get(name)
+            if before is None:
+                continue
+            rps_change = result["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+            p95_change = result["p95"] / before["p95"] - 1 if before["p95"] else 0.0
+            self.stdout.write("{:<24} {:>+11.1%} {:>+11.1%} {:>5.1f} -> {:<5.1f}".format(
+                name, rps_change, p95_change, before["queries"], result["queries"]))
+            # Query counts are deterministic, timings are allowed some noise
+            if result["max_queries"] > before["max_queries"]:
+                regressions.append("{}: up to {} queries, was {}".format(
+                    name, result["max_queries"], before["max_queries"]))
+            if rps_change < -tolerance or p95_change > tolerance:
+                regressions.append("{}: {:+.1%} req/s, {:+.1%} p95".format(name, rps_change, p95_change))
+        if regressions:
+            raise CommandError("Regressions against {}:\n  {}".format(path, "\n  ".join(regressions)))
+        self.stdout.write(self.style.SUCCESS("No regressions against {}".format(path)))
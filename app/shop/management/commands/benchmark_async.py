@@ -0,0 +1,83 @@
+import http.client
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from shop.bench import summarize
+from shop.models import Category, Product, ShippingAddress
+
+
+class Command(BaseCommand):
+    help = ("Compares throughput and tail latency of the read endpoints on a sync (WSGI) and an "
+            "async (ASGI, ASYNC_READ_VIEWS) deployment of the same database and cache")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sync-url", default="http://localhost:8000")
+        parser.add_argument("--async-url", default="http://localhost:8001")
+        parser.add_argument("--path", action="append", dest="paths",
+                            help="Path to request, may be repeated. Defaults to the async read endpoints")
+        parser.add_argument("--concurrency", type=int, default=200)
+        parser.add_argument("--requests", type=int, default=10000, help="Requests per path and server")
+        parser.add_argument("--warmup", type=int, default=200)
+
+    def default_paths(self):
+        category = Category.objects.order_by("id").first()
+        product = Product.objects.order_by("id").first()
+        address = ShippingAddress.objects.order_by("id").first()
+        if category is None or product is None:
+            raise CommandError("No catalog data, pass --path")
+        user_id = address.user_id if address else 1
+        return ["/categories/", f"/products/{category.slug}/", f"/product/{product.slug}/",
+                f"/cart/?user_id={user_id}", f"/address/?user_id={user_id}"]
+
+    def run(self, base_url, path, total, concurrency):
+        url = urlsplit(base_url)
+        counter = itertools.count()
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def worker():
+            # One keep-alive connection per client, like a browser or proxy
+            connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            local_latencies = []
+            local_errors = 0
+            while next(counter) < total:
+                start = time.perf_counter()
+                try:
+                    connection.request("GET", url.path.rstrip("/") + path)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        local_errors += 1
+                except (OSError, http.client.HTTPException):
+                    local_errors += 1
+                    connection.close()
+                local_latencies.append(time.perf_counter() - start)
+            connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                errors[0] += local_errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+        return summarize(latencies, time.perf_counter() - start, errors[0])
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or self.default_paths()
+        concurrency = options["concurrency"]
+        servers = [("sync", options["sync_url"]), ("async", options["async_url"])]
+
+        self.stdout.write("{:<40} {:<6} {:>9} {:>8} {:>8} {:>8} {:>7}".format(
+            "path", "server", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"))
+        for path in paths:
+            for name, base_url in servers:
+                if options["warmup"]:
+                    self.run(base_url, path, options["warmup"], min(concurrency, options["warmup"]))
+                result = self.run(base_url, path, options["requests"], concurrency)
+                self.stdout.write("{:<40} {:<6} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7}".format(
+                    path, name, result["rps"], result["p50"], result["p95"], result["p99"], result["errors"]))
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from shop.search import SearchIndex
+
+
+class Command(BaseCommand):
+    help = "Builds the product search index file loaded by workers at startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default=settings.SEARCH_INDEX_PATH,
+                            help="Index file path, defaults to SEARCH_INDEX_PATH")
+
+    def handle(self, *args, **options):
+        if not options["output"]:
+            raise CommandError("Pass --output or set SEARCH_INDEX_PATH")
+        index = SearchIndex.build()
+        index.save(options["output"])
+        self.stdout.write(self.style.SUCCESS("Indexed {} products into {}".format(
+            len(index.documents), options["output"])))
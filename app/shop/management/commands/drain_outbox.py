@@ -0,0 +1,40 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from shop.outbox import drain
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Delivers pending outbox notifications through their transports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep running and poll for new messages every INTERVAL seconds")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="Maximum number of sends in flight")
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        transports = {}
+        while True:
+            try:
+                # Keep draining until no message is due, then wait
+                while True:
+                    sent, failed = drain(options["batch_size"], options["concurrency"], transports)
+                    if not sent and not failed:
+                        break
+                    self.stdout.write("Sent {}, failed {}".format(sent, failed))
+            except Exception:
+                if not interval:
+                    raise
+                # Claimed messages are leased, so they are retried once the lease runs out
+                logger.exception("Draining the outbox failed")
+                close_old_connections()
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,34 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from shop.sales import flush_sales
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Folds buffered purchase counts into product and category sales counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep running and flush every INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        while True:
+            try:
+                units = flush_sales()
+            except Exception:
+                if not interval:
+                    raise
+                # The buffered batches stay in redis and are retried next time
+                logger.exception("Flushing sales failed")
+                close_old_connections()
+            else:
+                if units:
+                    self.stdout.write("Flushed {} units".format(units))
+            if not interval:
+                break
+            time.sleep(interval)
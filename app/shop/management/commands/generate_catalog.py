@@ -0,0 +1,179 @@
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from shop import search
+from shop.cache import CATALOG_TAG, CATEGORIES_TAG, invalidate_tags
+from shop.models import (Category, Product, ProductCategory, Cart, CartItem, Order, OrderItem, ShippingAddress)
+from shop.snapshots import rebuild_top_categories
+
+
+SLUG_PREFIX = "gen-"
+ADJECTIVES = ["classic", "compact", "premium", "wireless", "organic", "smart", "portable", "vintage",
+              "ultra", "eco", "deluxe", "slim", "rugged", "handmade", "pro", "mini"]
+NOUNS = ["headphones", "backpack", "kettle", "lamp", "sneakers", "watch", "blender", "jacket", "speaker",
+         "notebook", "camera", "bottle", "keyboard", "chair", "mug", "charger", "tent", "sunglasses"]
+CATEGORY_NAMES = ["electronics", "fashion", "home", "kitchen", "sports", "books", "beauty", "toys",
+                  "garden", "office", "outdoors", "grocery", "health", "automotive", "music", "pets"]
+SELLERS = ["acme", "globex", "initech", "umbrella", "stark", "wayne", "wonka", "hooli"]
+PAYMENT_METHODS = ["cod", "card", "upi", "netbanking"]
+
+
+class Command(BaseCommand):
+    help = ("Generates a reproducible synthetic dataset (categories, products, links, carts, orders, "
+            "addresses) for load tests and benchmarks")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--cart-items", type=int, default=5, help="Average cart lines per user")
+        parser.add_argument("--orders", type=int, default=5, help="Average orders per user")
+        parser.add_argument("--order-items", type=int, default=3, help="Average lines per order")
+        parser.add_argument("--first-user-id", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--clear", action="store_true",
+                            help="Delete previously generated data first")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        users = range(options["first_user_id"], options["first_user_id"] + options["users"])
+
+        if options["clear"]:
+            self.clear(users)
+
+        categories = self.create_categories(options["categories"])
+        products = self.create_products(options["products"], categories)
+        self.create_addresses(users)
+        self.create_carts(users, products, options["cart_items"])
+        self.create_orders(users, products, options["orders"], options["order_items"])
+
+        # Rows were bulk inserted without model signals, so refresh what
+        # the signals would have
+        call_command("backfill_sales", stdout=self.stdout)
+        invalidate_tags(CATALOG_TAG, CATEGORIES_TAG)
+        search.invalidate_index()
+        rebuild_top_categories()
+        self.stdout.write(self.style.SUCCESS("Generated {} categories, {} products and data for {} users".format(
+            len(categories), len(products), len(users))))
+
+    def clear(self, users):
+        with transaction.atomic():
+            Order.objects.filter(user_id__in=users).delete()
+            Cart.objects.filter(user_id__in=users).delete()
+            ShippingAddress.objects.filter(user_id__in=users).delete()
+            Product.objects.filter(slug__startswith=SLUG_PREFIX).delete()
+            Category.objects.filter(slug__startswith=SLUG_PREFIX).delete()
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_categories(self, count):
+        # Numbered after the ones generated before, like products, so runs
+        # without --clear add to the dataset
+        start = Category.objects.filter(slug__startswith=SLUG_PREFIX).count()
+        categories = []
+        for i in range(start, start + count):
+            name = "{} {}".format(CATEGORY_NAMES[i % len(CATEGORY_NAMES)], i // len(CATEGORY_NAMES) + 1)
+            categories.append(Category(name=name.title(), slug="{}category-{}".format(SLUG_PREFIX, i),
+                                       image="categories/{}.jpg".format(i % 16)))
+        self.bulk_create(Category, categories)
+        return list(Category.objects.filter(slug__startswith=SLUG_PREFIX).order_by("id"))
+
+    def description(self, name):
+        # Same shapes as the real catalog: a string, bullet points or an
+        # object of bullet lists
+        shape = self.rng.random()
+        if shape < 0.3:
+            return "The {} you have been looking for.".format(name)
+        bullets = ["{} {}".format(self.rng.choice(ADJECTIVES).title(), self.rng.choice(NOUNS))
+                   for _ in range(self.rng.randint(2, 6))]
+        if shape < 0.8:
+            return bullets
+        return {"highlights": bullets, "specifications": {"weight": "{} g".format(self.rng.randint(50, 5000)),
+                                                          "warranty": "{} year".format(self.rng.randint(1, 3))}}
+
+    def create_products(self, count, categories):
+        start = Product.objects.filter(slug__startswith=SLUG_PREFIX).count()
+        for offset in range(0, count, self.batch_size):
+            products = []
+            for i in range(start + offset, start + min(offset + self.batch_size, count)):
+                name = "{} {} {}".format(self.rng.choice(ADJECTIVES), self.rng.choice(NOUNS), i).title()
+                products.append(Product(
+                    name=name, slug="{}product-{}".format(SLUG_PREFIX, i), description=self.description(name),
+                    price=Decimal(self.rng.randint(99, 99999)) / 100,
+                    rating=Decimal(self.rng.randint(10, 50)) / 10,
+                    fast_delivery=self.rng.random() < 0.4, in_stock=self.rng.random() < 0.9,
+                    quantity=self.rng.randint(0, 500), seller=self.rng.choice(SELLERS),
+                    image="products/{}.jpg".format(i % 64),
+                ))
+            self.bulk_create(Product, products)
+
+        products = list(Product.objects.filter(slug__startswith=SLUG_PREFIX).only("id", "price").order_by("id"))
+        links = []
+        for product in products:
+            # Skewed so a few categories are much larger than the rest
+            for category in {self.rng.choices(categories, weights=range(len(categories), 0, -1))[0]
+                             for _ in range(self.rng.randint(1, 3))}:
+                links.append(ProductCategory(product=product, category=category))
+        ProductCategory.objects.bulk_create(links, batch_size=self.batch_size, ignore_conflicts=True)
+        return products
+
+    def popular(self, products):
+        # Zipf-like popularity: low indexes are picked far more often
+        return products[min(int(self.rng.paretovariate(1.2)) - 1, len(products) - 1)]
+
+    def create_addresses(self, users):
+        addresses = []
+        for user_id in users:
+            for i in range(self.rng.randint(1, 3)):
+                addresses.append(ShippingAddress(
+                    user_id=user_id, full_name="User {}".format(user_id),
+                    mobile_number="9{:09d}".format(user_id % 10 ** 9), pin_code="{:06d}".format(self.rng.randint(100000, 999999)),
+                    address1="{} Main Street".format(self.rng.randint(1, 999)), address2="Block {}".format(i + 1),
+                    city="City {}".format(user_id % 50), state="State {}".format(user_id % 10), is_default=i == 0,
+                ))
+        self.bulk_create(ShippingAddress, addresses)
+
+    def create_carts(self, users, products, average_items):
+        # Users who already have a cart keep it and get more lines
+        Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in users], batch_size=self.batch_size,
+                                 ignore_conflicts=True)
+        items = []
+        for cart in Cart.objects.filter(user_id__in=users).only("id"):
+            picked = {self.popular(products).id for _ in range(self.rng.randint(0, 2 * average_items))}
+            items += [CartItem(cart=cart, product_id=product_id, quantity=self.rng.randint(1, 3),
+                               is_selected=self.rng.random() < 0.8) for product_id in picked]
+        CartItem.objects.bulk_create(items, batch_size=self.batch_size, ignore_conflicts=True)
+
+    def create_orders(self, users, products, average_orders, average_items):
+        now = timezone.now()
+        orders, items = [], []
+        for user_id in users:
+            for _ in range(self.rng.randint(0, 2 * average_orders)):
+                # Random ids: seeded ones would collide with an earlier run's orders
+                order = Order(order_id=uuid.uuid4(), user_id=user_id,
+                              total_amount=0, shipping_address="{} Main Street".format(user_id),
+                              payment_method=self.rng.choice(PAYMENT_METHODS))
+                lines = {}
+                for _ in range(self.rng.randint(1, 2 * average_items)):
+                    product = self.popular(products)
+                    lines.setdefault(product.id, OrderItem(order=order, product_id=product.id, price=product.price,
+                                                           quantity=self.rng.randint(1, 3)))
+                order.total_amount = sum(item.price * item.quantity for item in lines.values())
+                # Spread over the last year; auto_now_add is overridden below
+                order.placed_at = now - timedelta(seconds=self.rng.randint(0, 365 * 86400))
+                orders.append(order)
+                items += lines.values()
+
+        self.bulk_create(Order, orders)
+        for order in orders:
+            order.created_at = order.placed_at
+        Order.objects.bulk_update(orders, ["created_at"], batch_size=self.batch_size)
+        self.bulk_create(OrderItem, items)
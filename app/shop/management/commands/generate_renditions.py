@@ -0,0 +1,71 @@
+from collections import deque
+from django.core.management.base import BaseCommand
+from shop.cache import CATALOG_TAG, CATEGORIES_TAG, invalidate_tags
+from shop.imaging import render_renditions
+from shop.models import Category, Product
+from shop.renditions import get_executor, needs_renditions, render_args, store
+from shop.snapshots import rebuild_top_categories
+
+
+MODELS = {"product": Product, "category": Category}
+
+
+class Command(BaseCommand):
+    help = "Generates resized and WebP renditions of product and category images"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", choices=sorted(MODELS), action="append", dest="models",
+                            help="Defaults to both")
+        parser.add_argument("--force", action="store_true",
+                            help="Regenerate images that already have renditions")
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        total = 0
+        for name in options["models"] or sorted(MODELS):
+            count = self.process(MODELS[name], options["force"], options["batch_size"])
+            self.stdout.write("Generated renditions for {} {} images".format(count, name))
+            total += count
+
+        if total:
+            # bulk_update() bypassed the signals that invalidate cached bodies
+            invalidate_tags(CATALOG_TAG, CATEGORIES_TAG)
+            rebuild_top_categories()
+
+    def process(self, model, force, batch_size):
+        executor = get_executor()
+        pending = deque()
+        done = []
+        count = 0
+
+        def finish(instance, rendered):
+            nonlocal count
+            try:
+                instance.image_renditions = store(instance, rendered.result() if executor else rendered)
+            except Exception as e:
+                self.stderr.write("{} {}: {}".format(model.__name__, instance.pk, e))
+                return
+            done.append(instance)
+            count += 1
+            if len(done) >= batch_size:
+                model.objects.bulk_update(done, ["image_renditions"])
+                done.clear()
+
+        for instance in model.objects.exclude(image="").only("id", "image", "image_renditions").iterator():
+            if not force and not needs_renditions(instance):
+                continue
+            try:
+                args = render_args(instance)
+                # Keep the pool busy while bounding the images held in memory
+                rendered = executor.submit(render_renditions, *args) if executor else render_renditions(*args)
+            except Exception as e:
+                self.stderr.write("{} {}: {}".format(model.__name__, instance.pk, e))
+                continue
+            pending.append((instance, rendered))
+            if len(pending) > batch_size:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+        if done:
+            model.objects.bulk_update(done, ["image_renditions"])
+        return count
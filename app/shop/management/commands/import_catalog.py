@@ -0,0 +1,211 @@
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from shop import search
+from shop.cache import category_tag, invalidate_tags, product_tag
+from shop.catalog import cache_products
+from shop.models import Category, Product, ProductCategory
+from shop.snapshots import rebuild_top_categories
+from shop.utils import parse_bool
+
+
+REQUIRED_FIELDS = ("name", "price", "rating", "seller")
+OPTIONAL_FIELDS = ("description", "fast_delivery", "in_stock", "quantity", "image")
+BOOLEAN_FIELDS = ("fast_delivery", "in_stock")
+CATEGORY_SEPARATOR = "|"
+MAX_REPORTED_ERRORS = 20
+
+
+def open_text(path):
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def file_format(path, fmt):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    raise CommandError("Cannot tell the format of {}, pass --format".format(path))
+
+
+def read_rows(f, fmt):
+    """Yields ``(line_number, row dict)`` one at a time."""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            # Empty cells count as missing, so they keep the stored value
+            yield reader.line_num, {key: value for key, value in row.items() if key and value != ""}
+    else:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, ValueError("invalid JSON: {}".format(e))
+
+
+def parse_description(value):
+    # CSV cells carry JSON lists/objects as text; anything else is plain text
+    if isinstance(value, str) and value[:1] in ("[", "{"):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_categories(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(CATEGORY_SEPARATOR)
+    return [slug.strip() for slug in value if slug and slug.strip()]
+
+
+def parse_row(row):
+    """Returns ``(slug, model field values, category slugs)`` or raises ValueError."""
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("expected an object")
+    missing = [name for name in ("slug",) + REQUIRED_FIELDS if row.get(name) in (None, "")]
+    if missing:
+        raise ValueError("missing {}".format(", ".join(missing)))
+
+    values = {}
+    try:
+        slug = Product._meta.get_field("slug").clean(row["slug"], None)
+        for name in REQUIRED_FIELDS + OPTIONAL_FIELDS:
+            if name not in row:
+                continue
+            value = row[name]
+            if name in BOOLEAN_FIELDS:
+                value = parse_bool(value)
+            elif name == "description":
+                value = parse_description(value)
+            values[name] = Product._meta.get_field(name).clean(value, None)
+    except ValidationError as e:
+        raise ValueError("; ".join(e.messages))
+    return slug, values, parse_categories(row.get("categories"))
+
+
+class Command(BaseCommand):
+    help = ("Imports products from CSV or JSONL files (optionally gzipped, - for stdin) in batches, "
+            "upserting by slug and linking categories by slug")
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+")
+        parser.add_argument("--format", choices=["csv", "jsonl"])
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--create-categories", action="store_true",
+                            help="Create categories that do not exist instead of skipping the link")
+        parser.add_argument("--warm", action="store_true",
+                            help="Write the imported products to the cache instead of only invalidating them")
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.create_categories = options["create_categories"]
+        self.warm = options["warm"]
+        self.category_ids = {}
+        self.imported = 0
+        self.errors = 0
+        self.unknown_categories = set()
+        self.started = time.monotonic()
+
+        for path in options["paths"]:
+            fmt = file_format(path, options["format"])
+            with open_text(path) as f:
+                rows = read_rows(f, fmt)
+                while True:
+                    batch = list(islice(rows, self.batch_size))
+                    if not batch:
+                        break
+                    self.import_batch(path, batch)
+
+        if self.imported:
+            search.invalidate_index()
+            rebuild_top_categories()
+        if self.unknown_categories:
+            self.stderr.write("Skipped links to {} unknown categories: {}".format(
+                len(self.unknown_categories), ", ".join(sorted(self.unknown_categories)[:MAX_REPORTED_ERRORS])))
+        self.stdout.write(self.style.SUCCESS("Imported {} products in {:.1f}s, {} rows rejected".format(
+            self.imported, time.monotonic() - self.started, self.errors)))
+
+    def error(self, path, line_number, message):
+        self.errors += 1
+        if self.errors <= MAX_REPORTED_ERRORS:
+            self.stderr.write("{}:{}: {}".format(path, line_number, message))
+
+    def import_batch(self, path, batch):
+        # Later rows for the same slug win
+        products = {}
+        for line_number, row in batch:
+            try:
+                slug, values, categories = parse_row(row)
+            except ValueError as e:
+                self.error(path, line_number, e)
+                continue
+            products[slug] = (values, categories)
+        if not products:
+            return
+
+        with transaction.atomic():
+            self.upsert(products)
+            ids = dict(Product.objects.filter(slug__in=products).values_list("slug", "id"))
+            self.link_categories(products, ids)
+        self.refresh_cache(list(ids.values()))
+
+        self.imported += len(ids)
+        elapsed = time.monotonic() - self.started
+        self.stdout.write("{} products imported ({:.0f}/s)".format(self.imported, self.imported / elapsed))
+
+    def upsert(self, products):
+        # Rows only overwrite the columns they have, so they are written in
+        # groups with the same set of columns
+        groups = {}
+        for slug, (values, _) in products.items():
+            groups.setdefault(tuple(sorted(values)), []).append(Product(slug=slug, **values))
+        for fields, objects in groups.items():
+            Product.objects.bulk_create(objects, update_conflicts=True, unique_fields=["slug"],
+                                        update_fields=list(fields))
+
+    def resolve_categories(self, slugs):
+        unresolved = set(slugs) - set(self.category_ids)
+        if unresolved and self.create_categories:
+            Category.objects.bulk_create([Category(name=slug.replace("-", " ").title(), slug=slug)
+                                          for slug in unresolved], ignore_conflicts=True)
+        if unresolved:
+            self.category_ids.update(Category.objects.filter(slug__in=unresolved).values_list("slug", "id"))
+            self.unknown_categories.update(unresolved - set(self.category_ids))
+
+    def link_categories(self, products, ids):
+        self.resolve_categories({slug for _, categories in products.values() for slug in categories})
+        links = [ProductCategory(product_id=ids[slug], category_id=self.category_ids[category])
+                 for slug, (_, categories) in products.items()
+                 for category in categories if category in self.category_ids]
+        ProductCategory.objects.bulk_create(links, batch_size=self.batch_size, ignore_conflicts=True)
+
+    def refresh_cache(self, product_ids):
+        # Runs once the batch has committed. Listings of every category the
+        # products are in embed them, so those tags are bumped together with
+        # the products' own, in the same write
+        category_slugs = ProductCategory.objects.filter(product_id__in=product_ids) \
+            .values_list("category__slug", flat=True).distinct()
+        invalidate_tags(*[product_tag(product_id) for product_id in product_ids],
+                        *[category_tag(slug) for slug in category_slugs])
+        if self.warm:
+            cache_products(product_ids)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from shop.snapshots import rebuild_top_categories
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the cached top categories block served on the home page"
+
+    def handle(self, *args, **options):
+        category_list = rebuild_top_categories()
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt top categories snapshot ({} categories)".format(len(category_list))))
@@ -0,0 +1,67 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from shop.cache import get_many_entries
+from shop.catalog import PRODUCT_KEY, cache_products, get_categories_entry
+from shop.models import Product
+from shop.snapshots import get_top_categories_entry
+
+
+class Command(BaseCommand):
+    help = ("Fills the catalog caches after a deploy or cache flush: categories, top categories and the "
+            "best selling product details, most popular first")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=settings.WARM_CACHE_PRODUCTS,
+                            help="Number of product details to warm")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--rate", type=float, default=settings.WARM_CACHE_RATE,
+                            help="Most products rendered per second, 0 for no limit")
+        parser.add_argument("--time-limit", type=float, default=0,
+                            help="Stop after this many seconds, 0 for no limit")
+        parser.add_argument("--force", action="store_true", help="Rewrite entries that are already cached")
+
+    def handle(self, *args, **options):
+        self.started = time.monotonic()
+        self.deadline = self.started + options["time_limit"] if options["time_limit"] else None
+        get_categories_entry()
+        get_top_categories_entry()
+        self.stdout.write("Warmed categories and top categories")
+
+        warmed, cached = 0, 0
+        try:
+            for batch in self.popular_products(options["products"], options["batch_size"]):
+                if self.deadline and time.monotonic() > self.deadline:
+                    self.stdout.write("Time limit reached")
+                    break
+                batch_started = time.monotonic()
+                if not options["force"]:
+                    fresh = get_many_entries([PRODUCT_KEY.format(slug) for slug in batch.values()])
+                    cached += len(fresh)
+                    batch = {product_id: slug for product_id, slug in batch.items()
+                             if PRODUCT_KEY.format(slug) not in fresh}
+                if batch:
+                    cache_products(list(batch))
+                    warmed += len(batch)
+                    self.throttle(len(batch), batch_started, options["rate"])
+                self.stdout.write("{} products warmed, {} already cached ({:.1f}s)".format(
+                    warmed, cached, time.monotonic() - self.started))
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted")
+        self.stdout.write(self.style.SUCCESS("Warmed {} of the top {} products ({} already cached) in {:.1f}s".format(
+            warmed, options["products"], cached, time.monotonic() - self.started)))
+
+    def popular_products(self, limit, batch_size):
+        # Best sellers first; products that never sold follow by rating
+        ranked = list(Product.objects.order_by(F("sales__total_purchases").desc(nulls_last=True), "-rating", "-id")
+                      .values_list("id", "slug")[:limit])
+        for start in range(0, len(ranked), batch_size):
+            yield dict(ranked[start:start + batch_size])
+
+    @staticmethod
+    def throttle(count, started, rate):
+        if rate:
+            remaining = count / rate - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
@@ -0,0 +1,405 @@
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import pickle
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+
+logger = logging.getLogger(__name__)
+
+# Per-request measurements live in a context variable, so they follow the
+# request into sync_to_async threads and across awaits in async views.
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+PHASES = ("db", "cache", "serialize")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.durations = defaultdict(float)
+        self._stack = []
+
+    @contextmanager
+    def timer(self, phase):
+        # Phases do not overlap: entering one pauses the enclosing one, so
+        # e.g. queries run while building a cache entry count as db only
+        now = time.perf_counter()
+        if self._stack:
+            outer, since = self._stack[-1]
+            self.durations[outer] += now - since
+        self._stack.append([phase, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            _, since = self._stack.pop()
+            self.durations[phase] += now - since
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+
+def timer(phase):
+    metrics = _current.get()
+    return metrics.timer(phase) if metrics is not None else nullcontext()
+
+
+def timed(phase):
+    """Decorator counting the time spent in a (sync or async) function as ``phase``."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(phase):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_hits(count=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_hits += count
+
+
+def cache_misses(count=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_misses += count
+
+
+def query_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    metrics.queries += 1
+    with metrics.timer("db"):
+        return execute(sql, params, many, context)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    # connection_created fires on every (re)connect of the same wrapper
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timer("serialize"):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts, total, count):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+
+class Registry:
+    """
+    Per-process aggregates by endpoint, exposed in Prometheus text format.
+    Every gunicorn worker keeps its own and, with METRICS_DIR set, publishes
+    snapshots of it there, so a scrape of any worker reports the sum.
+    """
+    COUNTERS = ("requests", "cache_hits", "cache_misses")
+    HISTOGRAMS = ("latency", "phases", "queries")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.cache_hits = defaultdict(int)
+        self.cache_misses = defaultdict(int)
+        self.latency = {}
+        self.phases = {}
+        self.queries = {}
+
+    def _histogram(self, table, key, buckets):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(buckets)
+        return histogram
+
+    def observe(self, endpoint, method, status, metrics, total):
+        with self._lock:
+            self.requests[(endpoint, method, str(status))] += 1
+            self.cache_hits[endpoint] += metrics.cache_hits
+            self.cache_misses[endpoint] += metrics.cache_misses
+            self._histogram(self.latency, endpoint, LATENCY_BUCKETS).observe(total)
+            self._histogram(self.queries, endpoint, QUERY_BUCKETS).observe(metrics.queries)
+            for phase in PHASES:
+                self._histogram(self.phases, (endpoint, phase), LATENCY_BUCKETS).observe(metrics.durations[phase])
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {name: dict(getattr(self, name)) for name in self.COUNTERS}
+            for name in self.HISTOGRAMS:
+                snapshot[name] = {key: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                                  for key, histogram in getattr(self, name).items()}
+        return snapshot
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name in self.COUNTERS:
+                for key, value in snapshot[name].items():
+                    getattr(self, name)[key] += value
+            for name in self.HISTOGRAMS:
+                for key, (buckets, counts, total, count) in snapshot[name].items():
+                    self._histogram(getattr(self, name), key, buckets).merge(counts, total, count)
+
+    @staticmethod
+    def _labels(**labels):
+        return "{" + ",".join('{}="{}"'.format(name, value) for name, value in labels.items()) + "}"
+
+    def _histogram_lines(self, name, labels, histogram):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(name, self._labels(**labels, le=bound), cumulative))
+        lines.append("{}_bucket{} {}".format(name, self._labels(**labels, le="+Inf"), histogram.count))
+        lines.append("{}_sum{} {}".format(name, self._labels(**labels), histogram.sum))
+        lines.append("{}_count{} {}".format(name, self._labels(**labels), histogram.count))
+        return lines
+
+    def render(self):
+        with self._lock:
+            lines = ["# TYPE shop_requests_total counter"]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append("shop_requests_total{} {}".format(
+                    self._labels(endpoint=endpoint, method=method, status=status), count))
+            lines.append("# TYPE shop_cache_hits_total counter")
+            for endpoint, count in sorted(self.cache_hits.items()):
+                lines.append("shop_cache_hits_total{} {}".format(self._labels(endpoint=endpoint), count))
+            lines.append("# TYPE shop_cache_misses_total counter")
+            for endpoint, count in sorted(self.cache_misses.items()):
+                lines.append("shop_cache_misses_total{} {}".format(self._labels(endpoint=endpoint), count))
+            lines.append("# TYPE shop_request_duration_seconds histogram")
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines += self._histogram_lines("shop_request_duration_seconds", {"endpoint": endpoint}, histogram)
+            lines.append("# TYPE shop_request_phase_seconds histogram")
+            for (endpoint, phase), histogram in sorted(self.phases.items()):
+                lines += self._histogram_lines("shop_request_phase_seconds",
+                                               {"endpoint": endpoint, "phase": phase}, histogram)
+            lines.append("# TYPE shop_request_queries histogram")
+            for endpoint, histogram in sorted(self.queries.items()):
+                lines += self._histogram_lines("shop_request_queries", {"endpoint": endpoint}, histogram)
+        return lines
+
+
+registry = Registry()
+
+
+def _gauges():
+    # (name, labels, value) samples of this process
+    from shop.cache import local_cache
+
+    samples = [("shop_local_cache", {"stat": name}, value) for name, value in local_cache.stats().items()]
+    if any(db["ENGINE"].endswith("postgresql_pool") for db in settings.DATABASES.values()):
+        from shop_surfer_data.db_backends.postgresql_pool.base import pool_stats
+
+        for alias, stats in pool_stats().items():
+            samples += [("shop_db_pool", {"alias": alias, "stat": name}, value) for name, value in stats.items()]
+    return samples
+
+
+# Multi-process mode: each worker writes a snapshot of its registry and
+# gauges to its own file in METRICS_DIR, at most every METRICS_FLUSH_INTERVAL
+# seconds and whenever it serves a scrape. Files of exited workers are kept
+# so the summed counters never go backwards; start.sh empties the directory
+# when the container starts.
+
+_snapshot_file = None
+_snapshot_pid = None
+_last_flush = 0
+_flush_lock = threading.Lock()
+
+
+def _snapshot_path():
+    global _snapshot_file, _snapshot_pid
+    if _snapshot_pid != os.getpid():
+        # pids get reused, so a restarted worker must not overwrite an old file
+        _snapshot_pid = os.getpid()
+        _snapshot_file = "{}-{}.pickle".format(_snapshot_pid, uuid.uuid4().hex[:8])
+    return os.path.join(settings.METRICS_DIR, _snapshot_file)
+
+
+def flush_snapshot(force=False):
+    global _last_flush
+    if not settings.METRICS_DIR or not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        if force or time.monotonic() - _last_flush > settings.METRICS_FLUSH_INTERVAL:
+            path = _snapshot_path()
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump({"pid": os.getpid(), "registry": registry.snapshot(), "gauges": _gauges()}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+            _last_flush = time.monotonic()
+    except OSError:
+        logger.exception("Writing the metrics snapshot failed")
+    finally:
+        _flush_lock.release()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """
+    The registry to report and {worker pid: gauge samples}: this process's
+    own, or the sum over every worker's snapshot in multi-process mode.
+    Gauges are only reported for workers that are still running.
+    """
+    if not settings.METRICS_DIR:
+        return registry, {None: _gauges()}
+    flush_snapshot(force=True)
+    total = Registry()
+    gauges = {}
+    for name in sorted(os.listdir(settings.METRICS_DIR)):
+        if not name.endswith(".pickle"):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name), "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            continue
+        total.merge(snapshot["registry"])
+        if _alive(snapshot["pid"]):
+            gauges[snapshot["pid"]] = snapshot["gauges"]
+    return total, gauges
+
+
+def _gauge_lines(gauges):
+    by_name = defaultdict(list)
+    for worker, samples in gauges.items():
+        for name, labels, value in samples:
+            if worker is not None:
+                labels = {**labels, "worker": worker}
+            by_name[name].append("{}{} {}".format(name, Registry._labels(**labels), value))
+    lines = []
+    for name, samples in by_name.items():
+        lines.append("# TYPE {} gauge".format(name))
+        lines += samples
+    return lines
+
+
+def metrics_view(request):
+    total, gauges = collect()
+    body = "\n".join(total.render() + _gauge_lines(gauges)) + "\n"
+    return HttpResponse(body, content_type="text/plain; version=0.0.4")
+
+
+def server_timing(metrics, total):
+    return ", ".join([
+        'db;dur={:.1f};desc="{} queries"'.format(metrics.durations["db"] * 1000, metrics.queries),
+        'cache;dur={:.1f};desc="{} hits, {} misses"'.format(
+            metrics.durations["cache"] * 1000, metrics.cache_hits, metrics.cache_misses),
+        "serialize;dur={:.1f}".format(metrics.durations["serialize"] * 1000),
+        "total;dur={:.1f}".format(total * 1000),
+    ])
+
+
+class MetricsMiddleware:
+    """
+    Measures every request and adds a Server-Timing header, feeds the
+    /metrics aggregates and logs a sample of requests plus every slow one.
+    Goes first in MIDDLEWARE so the total covers the whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total = metrics.total()
+        match = getattr(request, "resolver_match", None)
+        endpoint = (match.url_name or match.view_name) if match else "unmatched"
+        if endpoint == "metrics":
+            return response
+
+        registry.observe(endpoint, request.method, response.status_code, metrics, total)
+        flush_snapshot()
+        response["Server-Timing"] = server_timing(metrics, total)
+
+        slow = total * 1000 >= settings.METRICS_SLOW_REQUEST_MS
+        if slow or random.random() < settings.METRICS_LOG_SAMPLE_RATE:
+            logger.log(
+                logging.WARNING if slow else logging.INFO,
+                "endpoint=%s method=%s status=%s total_ms=%.1f db_ms=%.1f queries=%d cache_ms=%.1f "
+                "cache_hits=%d cache_misses=%d serialize_ms=%.1f",
+                endpoint, request.method, response.status_code, total * 1000, metrics.durations["db"] * 1000,
+                metrics.queries, metrics.durations["cache"] * 1000, metrics.cache_hits, metrics.cache_misses,
+                metrics.durations["serialize"] * 1000,
+            )
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-17 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_sales_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_id', '-created_at', '-order_id'], name='order_user_history_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.2 on 2026-10-17 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesFlush',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(max_length=64, unique=True)),
+                ('flushed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
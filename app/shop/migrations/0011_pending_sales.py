@@ -0,0 +1,22 @@
+# Generated by Django 4.2.2 on 2026-10-17 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_sales_flush'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingSale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.IntegerField()),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField()),
+            ],
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 import uuid
 from datetime import datetime
 
@@ -7,6 +9,8 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     image = models.ImageField(upload_to='categories/')
+    # Resized and WebP copies of image, see shop.renditions
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -23,6 +27,13 @@ class Product(models.Model):
     quantity = models.IntegerField(default=10)
     seller = models.CharField(max_length=100)
     image = models.ImageField(upload_to='products/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-rating', '-id'], name='product_rating_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -34,6 +45,9 @@ class ProductCategory(models.Model):
 
     class Meta:
         unique_together = ['product', 'category']
+        indexes = [
+            models.Index(fields=['category', 'product'], name='productcategory_category_idx'),
+        ]
 
     def __str__(self):
         return f"{self.category.id}_{self.product.slug}"
@@ -45,6 +59,59 @@ class TopCategory(models.Model):
     def __str__(self):
         return str(self.category.id)
     
+class ProductSales(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='sales')
+    total_purchases = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-total_purchases'], name='productsales_total_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.product_id)
+
+class DailyProductSales(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    date = models.DateField()
+    total_purchases = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['product', 'date']
+
+    def __str__(self):
+        return f"{self.product_id}_{self.date}"
+
+class DailyCategorySales(models.Model):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    date = models.DateField()
+    total_purchases = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['category', 'date']
+
+    def __str__(self):
+        return f"{self.category_id}_{self.date}"
+
+class SalesFlush(models.Model):
+    # Buffered sales batches already folded into the counters, so a batch
+    # retried after a crash or picked up by two flushers is applied once
+    batch_id = models.CharField(max_length=64, unique=True)
+    flushed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.batch_id
+
+class PendingSale(models.Model):
+    # Purchase counts buffered in the database when the cache is not redis,
+    # folded into the counters by flush_sales() like the redis buffer
+    product_id = models.IntegerField()
+    date = models.DateField()
+    quantity = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.product_id}_{self.date}"
+    
 class Cart(models.Model):
     user_id = models.IntegerField(unique=True)
     cart_items = models.ManyToManyField(Product, through='CartItem', related_name='cart_items')
@@ -75,6 +142,11 @@ class Order(models.Model):
     shipping_address = models.TextField()
     payment_method = models.CharField(max_length=50)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', '-created_at', '-order_id'], name='order_user_history_idx'),
+        ]
+
     def __str__(self):
         return str(self.order_id)
 
@@ -90,6 +162,31 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{str(self.order_id)}_{self.product.id}"
 
+class OutboxMessage(models.Model):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    topic = models.CharField(max_length=50)
+    transport = models.CharField(max_length=50)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id'], condition=models.Q(status='pending'),
+                         name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic}_{self.transport}_{self.id}"
+
 class ShippingAddress(models.Model):
     user_id = models.IntegerField()
     full_name = models.CharField(max_length=150, blank=True)
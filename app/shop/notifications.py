@@ -0,0 +1,93 @@
+import json
+import threading
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+
+# A transport delivers one outbox message and raises on failure so the
+# worker can retry it later. Delivery is at least once: a message may be
+# sent again if the worker dies before recording the result.
+
+
+class UndeliverableError(Exception):
+    """Raised for a message that no retry can deliver; it is failed at once."""
+
+
+class SMTPTransport:
+    def __init__(self):
+        self.sender = settings.SENDER_EMAIL
+        self.password = settings.GMAIL_APP_PASSWORD
+
+    def send(self, topic, payload):
+        recipient = payload.get("email")
+        if not recipient:
+            raise UndeliverableError("the order has no email address")
+        subject, body = render_email(topic, payload)
+        # One connection per send: connections are not shared across threads
+        connection = get_connection("django.core.mail.backends.smtp.EmailBackend",
+                                    username=self.sender, password=self.password)
+        EmailMessage(subject, body, self.sender, [recipient], connection=connection).send()
+
+
+class SNSTransport:
+    def __init__(self):
+        import boto3
+
+        self.topic_arn = settings.SNS_TOPIC_ARN
+        self.client = boto3.client("sns", region_name=settings.AWS_S3_REGION_NAME,
+                                   aws_access_key_id=settings.AWS_ACCESS_KEY_ID or None,
+                                   aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY or None)
+
+    def send(self, topic, payload):
+        self.client.publish(
+            TopicArn=self.topic_arn,
+            Message=json.dumps(payload, cls=DjangoJSONEncoder),
+            MessageAttributes={"topic": {"DataType": "String", "StringValue": topic}},
+        )
+
+
+class FileTransport:
+    # Appends messages as JSON lines, for local development
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.path = settings.NOTIFICATION_FILE_PATH
+
+    def send(self, topic, payload):
+        line = json.dumps({"topic": topic, "payload": payload}, cls=DjangoJSONEncoder)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class InMemoryTransport:
+    # Collects messages in InMemoryTransport.outbox, for tests
+    outbox = []
+
+    def send(self, topic, payload):
+        self.outbox.append({"topic": topic, "payload": payload})
+
+
+TRANSPORTS = {
+    "smtp": SMTPTransport,
+    "sns": SNSTransport,
+    "file": FileTransport,
+    "memory": InMemoryTransport,
+}
+
+
+def get_transport(name):
+    transport_class = TRANSPORTS.get(name) or import_string(name)
+    return transport_class()
+
+
+def render_email(topic, payload):
+    if topic == "order_placed":
+        lines = ["Thank you for shopping with us!", "", "Order {}".format(payload["order_id"]), ""]
+        for item in payload["items"]:
+            lines.append("{} x {} @ {}".format(item["quantity"], item["product_name"], item["price"]))
+        lines += ["", "Total: {}".format(payload["total_amount"]),
+                  "Shipping to: {}".format(payload["shipping_address"])]
+        return "Your order {} is confirmed".format(payload["order_id"]), "\n".join(lines)
+    return topic, json.dumps(payload, cls=DjangoJSONEncoder, indent=2)
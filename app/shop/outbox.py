@@ -0,0 +1,98 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from shop.models import OutboxMessage
+from shop.notifications import UndeliverableError, get_transport
+
+
+def enqueue(topic, payload):
+    """
+    Adds a message for every configured transport. Call it inside the
+    transaction that makes the change, so messages exist only for committed
+    changes and nothing is sent on the request path.
+    """
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(topic=topic, transport=transport, payload=payload)
+        for transport in settings.NOTIFICATION_TRANSPORTS
+    ])
+
+
+def _backoff(attempts):
+    delay = min(settings.OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1), settings.OUTBOX_MAX_BACKOFF)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_batch(limit):
+    """
+    Leases up to ``limit`` due messages to this worker by pushing their
+    available_at past the lease timeout. Rows locked by another worker are
+    skipped, and a worker that dies mid-batch only delays its messages until
+    the lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(OutboxMessage.objects.select_for_update(skip_locked=True)
+                        .filter(status=OutboxMessage.PENDING, available_at__lte=now)
+                        .order_by("available_at", "id")[:limit])
+        if messages:
+            OutboxMessage.objects.filter(id__in=[message.id for message in messages]).update(
+                available_at=now + timedelta(seconds=settings.OUTBOX_LEASE_TIMEOUT))
+    return messages
+
+
+def _deliver(transport, message):
+    # The exception a failed send raised, or None once delivered
+    try:
+        if isinstance(transport, Exception):
+            raise transport
+        transport.send(message.topic, message.payload)
+    except Exception as e:
+        return e
+    return None
+
+
+def drain(batch_size=None, concurrency=None, transports=None):
+    """
+    Delivers one batch of due messages with up to ``concurrency`` sends in
+    flight and returns (sent, failed) counts. Failed messages are retried
+    with exponential backoff until OUTBOX_MAX_ATTEMPTS; undeliverable ones
+    are failed right away.
+    """
+    messages = claim_batch(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if not messages:
+        return 0, 0
+
+    # Transports are reused across batches; one that cannot be set up fails
+    # its messages and is tried again with the next batch
+    transports = {} if transports is None else transports
+    available = dict(transports)
+    for name in {message.transport for message in messages} - set(available):
+        try:
+            available[name] = transports[name] = get_transport(name)
+        except Exception as e:
+            available[name] = e
+
+    with ThreadPoolExecutor(max_workers=concurrency or settings.OUTBOX_CONCURRENCY) as executor:
+        errors = list(executor.map(lambda message: _deliver(available[message.transport], message), messages))
+
+    now = timezone.now()
+    failed = 0
+    for message, error in zip(messages, errors):
+        message.attempts += 1
+        if error is None:
+            message.status = OutboxMessage.SENT
+            message.sent_at = now
+            message.last_error = ""
+        else:
+            failed += 1
+            message.last_error = "{}: {}".format(type(error).__name__, error)
+            if isinstance(error, UndeliverableError) or message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                message.status = OutboxMessage.FAILED
+            else:
+                message.available_at = now + _backoff(message.attempts)
+    OutboxMessage.objects.bulk_update(
+        messages, ["status", "attempts", "available_at", "last_error", "sent_at"])
+    return len(messages) - failed, failed
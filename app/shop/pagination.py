@@ -0,0 +1,83 @@
+import base64
+import json
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValidationError({"cursor": "Invalid cursor"})
+
+
+def get_page_size(request):
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValidationError({"limit": "Must be an integer"})
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def page_key(request):
+    # The cursor and page size part of a cache key; the cursor is opaque
+    return "{}:{}".format(request.GET.get("cursor", ""), get_page_size(request))
+
+
+def keyset_filter(ordering, values):
+    # Build "row > cursor" for a mixed asc/desc ordering, e.g.
+    # ("-rating", "-id") -> rating < r OR (rating = r AND id < i)
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{name}__{lookup}": value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def _page_queryset(queryset, ordering, cursor, limit):
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValidationError({"cursor": "Invalid cursor"})
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    # One extra row tells whether there is a next page
+    return queryset[:limit + 1]
+
+
+def _split_page(rows, ordering, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            [getattr(last, field.lstrip("-")) for field in ordering])
+    return rows, next_cursor
+
+
+def keyset_paginate(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Returns one page of ``queryset`` ordered by ``ordering`` (which must end
+    in a unique field) and the cursor for the next page, or None on the last
+    page. Every page is a single indexed range scan, however deep.
+    """
+    rows = list(_page_queryset(queryset, ordering, cursor, limit))
+    return _split_page(rows, ordering, limit)
+
+
+async def akeyset_paginate(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    rows = [row async for row in _page_queryset(queryset, ordering, cursor, limit)]
+    return _split_page(rows, ordering, limit)
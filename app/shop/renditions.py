@@ -0,0 +1,145 @@
+import logging
+import multiprocessing
+import os
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connections, transaction
+from shop.imaging import render_renditions
+
+
+logger = logging.getLogger(__name__)
+
+# image_renditions holds storage names, not URLs, so they follow MEDIA_URL
+# and storage changes:
+#   {"source": "products/shoe.jpg",
+#    "formats": {"jpeg": {"320": "products/renditions/shoe-320w.jpg", ...},
+#                "webp": {"320": "products/renditions/shoe-320w.webp", ...}}}
+
+
+def rendition_name(source_name, width, fmt):
+    directory, filename = posixpath.split(source_name)
+    stem = posixpath.splitext(filename)[0]
+    extension = "jpg" if fmt == "jpeg" else fmt
+    return posixpath.join(directory, "renditions", "{}-{}w.{}".format(stem, width, extension))
+
+
+def needs_renditions(instance):
+    return bool(instance.image) and instance.image_renditions.get("source") != instance.image.name
+
+
+def srcset(instance):
+    """``{format: "url 160w, url 320w, ..."}`` for the image's renditions."""
+    renditions = instance.image_renditions or {}
+    if not instance.image or renditions.get("source") != instance.image.name:
+        return {}
+    storage = instance.image.storage
+    return {
+        fmt: ", ".join("{} {}w".format(storage.url(name), width)
+                       for width, name in sorted(names.items(), key=lambda pair: int(pair[0])))
+        for fmt, names in renditions.get("formats", {}).items()
+    }
+
+
+_executor = None
+_executor_pid = None
+_jobs = None
+_jobs_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process pool for resizing, or None to render in the calling thread."""
+    global _executor, _executor_pid
+    if not settings.IMAGE_RENDITION_WORKERS:
+        return None
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            # Forking a threaded web worker is unsafe; the workers only need
+            # shop.imaging, which does not touch Django
+            _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_RENDITION_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _read(instance):
+    with instance.image.storage.open(instance.image.name, "rb") as f:
+        return f.read()
+
+
+def render_args(instance):
+    return _read(instance), settings.IMAGE_RENDITION_WIDTHS, settings.IMAGE_RENDITION_QUALITY
+
+
+def render(instance):
+    executor = get_executor()
+    if executor is None:
+        return render_renditions(*render_args(instance))
+    return executor.submit(render_renditions, *render_args(instance)).result()
+
+
+def store(instance, rendered):
+    """Saves rendered images next to the source and returns the new map."""
+    storage = instance.image.storage
+    source = instance.image.name
+    previous = instance.image_renditions.get("formats", {})
+    formats = {}
+    for width, fmt, data in rendered:
+        name = rendition_name(source, width, fmt)
+        if storage.exists(name):
+            storage.delete(name)
+        formats.setdefault(fmt, {})[str(width)] = storage.save(name, ContentFile(data))
+
+    current = {name for names in formats.values() for name in names.values()}
+    for name in {name for names in previous.values() for name in names.values()} - current:
+        storage.delete(name)
+    return {"source": source, "formats": formats}
+
+
+def generate_renditions(instance):
+    instance.image_renditions = store(instance, render(instance))
+    # Goes through the save signals, which invalidate every cached body
+    # embedding this product or category
+    instance.save(update_fields=["image_renditions"])
+
+
+def get_jobs():
+    # Rendition jobs run off the request thread, one at a time per process
+    global _jobs, _jobs_pid
+    with _executor_lock:
+        if _jobs is None or _jobs_pid != os.getpid():
+            _jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix="renditions")
+            _jobs_pid = os.getpid()
+        return _jobs
+
+
+def _generate(model, pk):
+    # A broken upload must not fail the save that triggered it
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is not None and needs_renditions(instance):
+            generate_renditions(instance)
+    except Exception:
+        logger.exception("Generating renditions for %s %s failed", model.__name__, pk)
+
+
+def _run_job(model, pk):
+    close_old_connections()
+    try:
+        _generate(model, pk)
+    finally:
+        connections.close_all()
+
+
+def schedule_renditions(instance):
+    """Generates renditions for a newly uploaded image once the save commits."""
+    if not needs_renditions(instance):
+        return
+    model, pk = type(instance), instance.pk
+    if settings.IMAGE_RENDITIONS_BACKGROUND:
+        transaction.on_commit(lambda: get_jobs().submit(_run_job, model, pk))
+    else:
+        transaction.on_commit(lambda: _generate(model, pk))
@@ -0,0 +1,186 @@
+from collections import defaultdict
+import uuid
+from datetime import date, timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from redis.exceptions import ResponseError
+from shop.models import (Product, ProductCategory, ProductSales, DailyProductSales, DailyCategorySales, TopCategory,
+                         SalesFlush, PendingSale)
+from shop.snapshots import rebuild_top_categories_on_commit
+from shop.utils import get_redis
+
+
+PENDING_SALES_KEY = "sales:pending"
+BATCH_SALES_KEY = "sales:batch:{}"
+SALES_BATCHES_KEY = "sales:batches"
+FLUSH_RECORD_RETENTION = timedelta(days=7)
+UPDATE_CHUNK_SIZE = 500
+
+
+def record_sales(items, day=None):
+    """
+    Buffers purchase counts for ``items`` (product_id, quantity pairs) in a
+    redis hash so the order path only pays for a pipelined HINCRBY per line.
+    flush_sales() folds the buffer into the counter tables. Without redis the
+    counts are buffered as PendingSale rows with a single INSERT.
+    """
+    day = day or timezone.localdate()
+    redis = get_redis()
+    if redis is None:
+        PendingSale.objects.bulk_create([PendingSale(product_id=product_id, date=day, quantity=quantity)
+                                         for product_id, quantity in items])
+        return
+
+    pipe = redis.pipeline(transaction=False)
+    for product_id, quantity in items:
+        pipe.hincrby(PENDING_SALES_KEY, f"{day.isoformat()}:{product_id}", quantity)
+    pipe.execute()
+
+
+def _claim_pending(redis):
+    # Moves the buffer to a per-flush key and registers it in one
+    # transaction, so a batch is never lost between the two
+    if not redis.exists(PENDING_SALES_KEY):
+        return
+    batch_key = BATCH_SALES_KEY.format(uuid.uuid4().hex)
+    pipe = redis.pipeline()
+    pipe.rename(PENDING_SALES_KEY, batch_key)
+    pipe.sadd(SALES_BATCHES_KEY, batch_key)
+    try:
+        pipe.execute()
+    except ResponseError:
+        # Claimed by another flusher in the meantime
+        redis.srem(SALES_BATCHES_KEY, batch_key)
+
+
+def _apply_batch(redis, batch_key):
+    deltas = defaultdict(int)
+    for field, quantity in redis.hgetall(batch_key).items():
+        day, product_id = field.decode().split(":")
+        deltas[(int(product_id), date.fromisoformat(day))] += int(quantity)
+
+    # The batch is recorded in the same transaction as its increments: a
+    # concurrent flusher blocks on the unique batch id and then skips it,
+    # and a batch whose increments fail is retried by the next flush
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                SalesFlush.objects.create(batch_id=batch_key)
+        except IntegrityError:
+            deltas = {}
+        else:
+            apply_sales(deltas)
+    redis.delete(batch_key)
+    redis.srem(SALES_BATCHES_KEY, batch_key)
+    return sum(deltas.values())
+
+
+def _flush_pending_rows():
+    with transaction.atomic():
+        rows = list(PendingSale.objects.select_for_update(skip_locked=True)
+                    .values_list("id", "product_id", "date", "quantity"))
+        deltas = defaultdict(int)
+        for _, product_id, day, quantity in rows:
+            deltas[(product_id, day)] += quantity
+        apply_sales(deltas)
+        PendingSale.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return sum(deltas.values())
+
+
+def flush_sales():
+    """
+    Applies buffered purchase counts and returns the number of units applied.
+    The buffer is swapped out with RENAME to a key unique to this flush, so
+    orders placed while flushing start a fresh hash. Batches left over by a
+    failed flush (or still being applied by another flusher) are retried
+    too; each batch id is recorded with its increments so none is counted
+    twice.
+    """
+    redis = get_redis()
+    if redis is None:
+        return _flush_pending_rows()
+
+    _claim_pending(redis)
+
+    units = 0
+    for batch_key in redis.smembers(SALES_BATCHES_KEY):
+        units += _apply_batch(redis, batch_key.decode())
+
+    SalesFlush.objects.filter(flushed_at__lt=timezone.now() - FLUSH_RECORD_RETENTION).delete()
+    return units
+
+
+def discard_pending_sales():
+    redis = get_redis()
+    if redis is None:
+        PendingSale.objects.all().delete()
+    else:
+        batch_keys = [key.decode() for key in redis.smembers(SALES_BATCHES_KEY)]
+        redis.delete(PENDING_SALES_KEY, SALES_BATCHES_KEY, *batch_keys)
+
+
+def _increment(queryset, key, deltas):
+    # One UPDATE ... SET total_purchases = total_purchases + CASE ... per chunk
+    keys = list(deltas)
+    for start in range(0, len(keys), UPDATE_CHUNK_SIZE):
+        chunk = keys[start:start + UPDATE_CHUNK_SIZE]
+        increment = Case(*[When(**{key: k}, then=Value(deltas[k])) for k in chunk],
+                         default=Value(0), output_field=IntegerField())
+        queryset.filter(**{f"{key}__in": chunk}).update(
+            total_purchases=F("total_purchases") + increment)
+
+
+def _increment_daily(model, key, deltas):
+    by_day = defaultdict(dict)
+    for (obj_id, day), quantity in deltas.items():
+        by_day[day][obj_id] = quantity
+
+    for day, day_deltas in by_day.items():
+        model.objects.bulk_create([model(**{key: obj_id, "date": day}) for obj_id in day_deltas],
+                                  ignore_conflicts=True)
+        _increment(model.objects.filter(date=day), key, day_deltas)
+
+
+def apply_sales(deltas):
+    """
+    Adds ``deltas``, a mapping of (product_id, date) to units sold, to the
+    per product and per category totals and their daily rollups.
+    """
+    if not deltas:
+        return
+
+    # Drop counts for products deleted since the order was placed
+    product_ids = set(Product.objects.filter(
+        id__in={product_id for product_id, _ in deltas}).values_list("id", flat=True))
+    deltas = {key: quantity for key, quantity in deltas.items() if key[0] in product_ids}
+
+    product_totals = defaultdict(int)
+    for (product_id, _), quantity in deltas.items():
+        product_totals[product_id] += quantity
+
+    categories = defaultdict(list)
+    for product_id, category_id in ProductCategory.objects.filter(
+            product_id__in=product_totals).values_list("product_id", "category_id"):
+        categories[product_id].append(category_id)
+
+    category_deltas = defaultdict(int)
+    category_totals = defaultdict(int)
+    for (product_id, day), quantity in deltas.items():
+        for category_id in categories[product_id]:
+            category_deltas[(category_id, day)] += quantity
+            category_totals[category_id] += quantity
+
+    with transaction.atomic():
+        ProductSales.objects.bulk_create([ProductSales(product_id=product_id) for product_id in product_totals],
+                                         ignore_conflicts=True)
+        _increment(ProductSales.objects.all(), "product_id", product_totals)
+        _increment_daily(DailyProductSales, "product_id", deltas)
+
+        TopCategory.objects.bulk_create([TopCategory(category_id=category_id) for category_id in category_totals],
+                                        ignore_conflicts=True)
+        _increment(TopCategory.objects.all(), "category_id", category_totals)
+        _increment_daily(DailyCategorySales, "category_id", category_deltas)
+
+        # Queryset updates bypass the model signals that refresh the snapshot
+        rebuild_top_categories_on_commit()
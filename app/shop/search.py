@@ -0,0 +1,313 @@
+import bisect
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from shop.models import Product
+from shop.serializers import CartProductSerializer
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "search_index:version"
+CHANGES_KEY = "search_index:changes:{}"
+CHANGES_TTL = 24 * 60 * 60
+MAX_CHANGE_VERSIONS = 500
+MAX_CHANGED_PRODUCTS = 5000
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "seller": 1.5, "description": 1.0}
+MAX_PREFIX_EXPANSIONS = 50
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def _flatten(value):
+    # Description is free form JSON: a string, a list of bullet points or
+    # nested objects. Index every string in it.
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from _flatten(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _flatten(item)
+    elif value is not None:
+        yield str(value)
+
+
+def product_fields(product):
+    return {
+        "name": product.name,
+        "seller": product.seller,
+        "category": " ".join(c.name for c in product.category.all()),
+        "description": " ".join(_flatten(product.description)),
+    }
+
+
+class SearchIndex:
+    """
+    In-memory inverted index of products. Postings map each token to
+    {product_id: weight} and a sorted term list serves prefix lookups, so a
+    query costs a few dict lookups and a bisect, independent of catalog size.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.doc_tokens = {}
+        self.terms = []
+        self.lock = threading.RLock()
+
+    def add(self, product):
+        weights = defaultdict(float)
+        for field, text in product_fields(product).items():
+            for token in tokenize(text):
+                weights[token] += FIELD_WEIGHTS[field]
+
+        document = dict(CartProductSerializer(product).data)
+        document["rating"] = str(product.rating)
+        with self.lock:
+            self._remove(product.id)
+            for token, weight in weights.items():
+                if token not in self.postings:
+                    bisect.insort(self.terms, token)
+                self.postings[token][product.id] = weight
+            self.documents[product.id] = document
+            self.doc_tokens[product.id] = list(weights)
+
+    def remove(self, product_id):
+        with self.lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        for token in self.doc_tokens.pop(product_id, []):
+            posting = self.postings[token]
+            posting.pop(product_id, None)
+            if not posting:
+                del self.postings[token]
+                index = bisect.bisect_left(self.terms, token)
+                if index < len(self.terms) and self.terms[index] == token:
+                    del self.terms[index]
+        self.documents.pop(product_id, None)
+
+    def _expand(self, prefix):
+        start = bisect.bisect_left(self.terms, prefix)
+        expansions = []
+        for term in self.terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            expansions.append(term)
+        return expansions
+
+    def _match(self, query):
+        # Every token must match; the last one may be incomplete, so it also
+        # matches as a prefix of indexed terms
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+
+        scores = None
+        for position, token in enumerate(tokens):
+            if position == len(tokens) - 1:
+                terms = self._expand(token)
+            else:
+                terms = [token] if token in self.postings else []
+
+            token_scores = defaultdict(float)
+            for term in terms:
+                # Exact matches outrank completions
+                boost = 1.0 if term == token else 0.5
+                for product_id, weight in self.postings[term].items():
+                    token_scores[product_id] = max(token_scores[product_id], weight * boost)
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {pid: score + token_scores[pid] for pid, score in scores.items()
+                          if pid in token_scores}
+            if not scores:
+                return {}
+        return scores
+
+    def search(self, query, limit=20):
+        with self.lock:
+            scores = self._match(query)
+            ranked = sorted(scores, key=lambda pid: (-scores[pid], self.documents[pid]["name"]))
+            return [self.documents[pid] for pid in ranked[:limit]]
+
+    def autocomplete(self, query, limit=8):
+        return [{"slug": doc["slug"], "name": doc["name"]} for doc in self.search(query, limit)]
+
+    def save(self, path):
+        with self.lock, open(path, "wb") as f:
+            pickle.dump((self.version, dict(self.postings), self.documents, self.doc_tokens), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            version, postings, documents, doc_tokens = pickle.load(f)
+        index = cls(version)
+        index.postings.update(postings)
+        index.documents = documents
+        index.doc_tokens = doc_tokens
+        index.terms = sorted(postings)
+        return index
+
+    @classmethod
+    def build(cls):
+        index = cls(cache.get(VERSION_KEY, 0))
+        for product in Product.objects.prefetch_related("category").iterator(chunk_size=2000):
+            index.add(product)
+        return index
+
+
+_index = None
+_last_check = 0
+_index_lock = threading.Lock()
+_rebuilding = False
+
+
+def _rebuild():
+    global _index, _rebuilding
+    try:
+        index = SearchIndex.build()
+        with _index_lock:
+            _index = index
+    except Exception:
+        logger.exception("Rebuilding the search index failed")
+    finally:
+        _rebuilding = False
+        connections.close_all()
+
+
+def _rebuild_in_background():
+    # The current index keeps serving searches until the new one is swapped in
+    global _rebuilding
+    if not _rebuilding:
+        _rebuilding = True
+        threading.Thread(target=_rebuild, name="search-index", daemon=True).start()
+
+
+def _apply_changes(index, product_ids):
+    found = set()
+    for product in Product.objects.filter(id__in=product_ids).prefetch_related("category"):
+        index.add(product)
+        found.add(product.id)
+    for product_id in set(product_ids) - found:
+        index.remove(product_id)
+
+
+def _catch_up(index, version):
+    """
+    Applies the products changed by other workers since ``index.version``.
+    Returns False when the changes cannot be replayed: bulk invalidations,
+    expired change records or too large a gap need a full rebuild.
+    """
+    if index.version is None or version < index.version or version - index.version > MAX_CHANGE_VERSIONS:
+        return False
+    keys = [CHANGES_KEY.format(v) for v in range(index.version + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return False
+    product_ids = set().union(*changes.values())
+    if len(product_ids) > MAX_CHANGED_PRODUCTS:
+        return False
+    _apply_changes(index, product_ids)
+    index.version = version
+    return True
+
+
+def load_index():
+    """
+    Loads this worker's index from SEARCH_INDEX_PATH, or builds it from the
+    database when there is no such file. Blocking: for startup and
+    management commands, never the request path.
+    """
+    global _index, _last_check
+    path = settings.SEARCH_INDEX_PATH
+    index = SearchIndex.load(path) if path and os.path.exists(path) else SearchIndex.build()
+    with _index_lock:
+        _index = index
+        _last_check = time.monotonic()
+    return index
+
+
+def get_index():
+    """
+    Returns this worker's index, loaded from SEARCH_INDEX_PATH (written by
+    build_search_index when the container starts) on first use. Without the
+    file the index is built in a background thread and searches find
+    nothing until it is ready. Other workers signal catalog edits by bumping
+    a version in the shared cache and recording the product ids each
+    version changed; it is compared every SEARCH_INDEX_CHECK_INTERVAL
+    seconds and only those products are re-indexed. When the changes cannot
+    be replayed the index is rebuilt in a background thread while the stale
+    one keeps serving.
+    """
+    global _index, _last_check
+    with _index_lock:
+        now = time.monotonic()
+        if _index is None:
+            path = settings.SEARCH_INDEX_PATH
+            if path and os.path.exists(path):
+                _index = SearchIndex.load(path)
+            else:
+                # No version: replaced by the build, or rebuilt again on the
+                # next check if that fails
+                _index = SearchIndex()
+                _rebuild_in_background()
+            _last_check = now
+        elif now - _last_check > settings.SEARCH_INDEX_CHECK_INTERVAL:
+            _last_check = now
+            version = cache.get(VERSION_KEY, 0)
+            if version != _index.version and not _rebuilding and not _catch_up(_index, version):
+                _rebuild_in_background()
+        return _index
+
+
+def _bump_version(product_ids=None):
+    """
+    Publishes a catalog change to the other workers. ``product_ids`` are
+    recorded under the new version so they can re-index just those; None
+    makes them rebuild.
+    """
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+        version = 1
+    if product_ids is not None:
+        cache.set(CHANGES_KEY.format(version), list(product_ids), timeout=CHANGES_TTL)
+    # Only adopt the new version when no other worker changed the catalog in
+    # between, otherwise the next check replays their edits
+    if _index is not None and _index.version is not None and version == _index.version + 1:
+        _index.version = version
+
+
+def index_products(product_ids):
+    if _index is not None:
+        _apply_changes(_index, product_ids)
+    _bump_version(product_ids)
+
+
+def remove_product(product_id):
+    if _index is not None:
+        _index.remove(product_id)
+    _bump_version([product_id])
+
+
+def invalidate_index():
+    # After bulk catalog changes: every worker, this one included, rebuilds
+    # on its next version check
+    if _index is not None:
+        _index.version = None
+    _bump_version()
@@ -1,25 +1,46 @@
 from rest_framework.serializers import ModelSerializer
 from shop.models import Category, Product, Cart, CartItem, Order, OrderItem, ShippingAddress
 from rest_framework import serializers
+from shop.renditions import srcset
 
 
+class ImageSrcsetField(serializers.Field):
+    """Rendition URLs of the image per format, as srcset strings."""
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, instance):
+        return srcset(instance)
+
 class CategorySerializer(ModelSerializer):
+    image_srcset = ImageSrcsetField()
+
     class Meta:
         model = Category
-        fields = '__all__'
+        exclude = ['image_renditions']
 
 class ProductSerializer(ModelSerializer):
+    image_srcset = ImageSrcsetField()
+
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['image_renditions']
 
 class CartSerializer(ModelSerializer):
     class Meta:
         model = Cart
         fields = '__all__'
 
+class CartProductSerializer(ModelSerializer):
+    image_srcset = ImageSrcsetField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'slug', 'name', 'price', 'image', 'image_srcset', 'in_stock']
+
 class CartItemSerializer(ModelSerializer):
-    product = ProductSerializer()
+    product = CartProductSerializer()
 
     class Meta:
         model = CartItem
@@ -74,6 +95,13 @@ class OrderSerializer(ModelSerializer):
         model = Order
         fields = ['order_id', 'total_amount', 'created_at', 'shipping_address', 'payment_method']
 
+class OrderHistorySerializer(OrderSerializer):
+    # Expects orderitem_set prefetched with select_related('product')
+    order_items = OrderItemSerializer(source='orderitem_set', many=True, read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = OrderSerializer.Meta.fields + ['order_items']
+
 class ShippingAddressSerializer(ModelSerializer):
     class Meta:
         model = ShippingAddress
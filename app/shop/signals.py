@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from shop.models import Category, Product, ProductCategory, TopCategory
+from shop.cache import CATEGORIES_TAG, category_tag, invalidate_tags, product_tag
+from shop.snapshots import rebuild_top_categories_on_commit
+from shop import search
+from shop.renditions import schedule_renditions
+
+
+def invalidate_on_commit(*tags):
+    transaction.on_commit(lambda: invalidate_tags(*tags))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=TopCategory)
+@receiver(post_delete, sender=TopCategory)
+def refresh_top_categories(sender, **kwargs):
+    rebuild_top_categories_on_commit()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    category_slugs = instance.category.values_list("slug", flat=True)
+    invalidate_on_commit(product_tag(instance.id), *[category_tag(slug) for slug in category_slugs])
+    transaction.on_commit(lambda: search.index_products([instance.id]))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    # Category links are deleted (and invalidated) first by the cascade
+    product_id = instance.id
+    invalidate_on_commit(product_tag(product_id))
+    transaction.on_commit(lambda: search.remove_product(product_id))
+
+
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def product_category_changed(sender, instance, **kwargs):
+    product_id = instance.product_id
+    category_slug = Category.objects.filter(id=instance.category_id).values_list("slug", flat=True).first()
+    invalidate_on_commit(product_tag(product_id), *([category_tag(category_slug)] if category_slug else []))
+    transaction.on_commit(lambda: search.index_products([product_id]))
+
+
+@receiver(m2m_changed, sender=ProductCategory)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # product.category.add()/remove()/clear() write the through rows in bulk
+    # without sending post_save/post_delete for them
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if action == "pre_clear":
+        related = instance.products if reverse else instance.category
+        pk_set = set(related.values_list("id", flat=True))
+    if reverse:
+        category_slugs = [instance.slug]
+        product_ids = list(pk_set)
+    else:
+        category_slugs = list(Category.objects.filter(id__in=pk_set).values_list("slug", flat=True))
+        product_ids = [instance.id]
+
+    invalidate_on_commit(*[product_tag(product_id) for product_id in product_ids],
+                         *[category_tag(slug) for slug in category_slugs])
+    transaction.on_commit(lambda: search.index_products(product_ids))
+    rebuild_top_categories_on_commit()
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    invalidate_on_commit(CATEGORIES_TAG, category_tag(instance.slug))
+
+    def reindex():
+        search.index_products(list(instance.products.values_list("id", flat=True)))
+    transaction.on_commit(reindex)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    invalidate_on_commit(CATEGORIES_TAG, category_tag(instance.slug))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def image_saved(sender, instance, **kwargs):
+    schedule_renditions(instance)
@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from shop.cache import CATALOG_TAG, get_or_set_entry, invalidate_tags, set_cached, tag_versions
+from shop.models import ProductCategory, TopCategory
+from shop.serializers import CategorySerializer, ProductSerializer
+from shop.utils import render_json
+
+
+TOP_CATEGORIES_KEY = "top_categories"
+TOP_CATEGORIES_TAG = "top_categories"
+TOP_CATEGORY_COUNT = 3
+TOP_PRODUCT_COUNT = 10
+
+
+def build_top_categories():
+    top_categories = [tc.category for tc in TopCategory.objects.select_related("category")
+                      .order_by("-total_purchases")[:TOP_CATEGORY_COUNT]]
+
+    # Best rated products of every top category in one windowed query
+    ranked = ProductCategory.objects.filter(category__in=top_categories) \
+        .select_related("product") \
+        .prefetch_related("product__category") \
+        .annotate(rank=Window(RowNumber(), partition_by=F("category_id"),
+                              order_by=[F("product__rating").desc(), F("product__id").desc()])) \
+        .filter(rank__lte=TOP_PRODUCT_COUNT) \
+        .order_by("category_id", "rank")
+    top_products = {category.id: [] for category in top_categories}
+    for link in ranked:
+        top_products[link.category_id].append(link.product)
+
+    category_list = CategorySerializer(top_categories, many=True).data
+    for cat in category_list:
+        cat["products"] = ProductSerializer(top_products[cat["id"]], many=True).data
+    return category_list
+
+
+def rebuild_top_categories():
+    category_list = build_top_categories()
+    # Bumping the tag makes workers drop their local copy of the old snapshot
+    invalidate_tags(TOP_CATEGORIES_TAG)
+    set_cached(TOP_CATEGORIES_KEY, render_json(category_list), timeout=None,
+               versions=tag_versions([CATALOG_TAG, TOP_CATEGORIES_TAG]), compress=True)
+    return category_list
+
+
+def rebuild_top_categories_on_commit():
+    """
+    Schedules rebuild_top_categories() once per transaction, however many of
+    its writes touch the ranking.
+    """
+    connection = transaction.get_connection()
+    if not any(entry[1] is rebuild_top_categories for entry in connection.run_on_commit):
+        transaction.on_commit(rebuild_top_categories)
+
+
+def get_top_categories_entry():
+    def build():
+        versions = tag_versions([CATALOG_TAG, TOP_CATEGORIES_TAG])
+        return render_json(build_top_categories()), versions
+
+    return get_or_set_entry(TOP_CATEGORIES_KEY, build, timeout=None, local=True, compress=True)
@@ -1,3 +1,1025 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+import psycopg2
+from PIL import Image
+from asgiref.sync import sync_to_async
+from psycopg2 import extensions as psycopg2_extensions
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from redis.exceptions import ResponseError
+from shop import async_views, cdn, metrics, outbox, sales, search
+from shop.cache import (CATALOG_TAG, LOCK_KEY, LOCK_POLL_INTERVAL, TAG_KEY, LocalCache, get_many_entries,
+                        get_or_set_entry, invalidate_tags, local_cache, product_tag, tag_versions)
+from shop.cart import get_cart_store
+from shop.catalog import PRODUCT_KEY
+from shop.models import (Category, Product, ProductCategory, ProductSales, TopCategory, Cart, CartItem, Order, OrderItem,
+                         OutboxMessage, PendingSale, SalesFlush, ShippingAddress)
+from shop.pagination import decode_cursor, encode_cursor
+from shop.sales import SALES_BATCHES_KEY, flush_sales, record_sales
+from shop.serializers import CartProductSerializer, ProductSerializer
+from shop.snapshots import rebuild_top_categories
+from shop.urls import urlpatterns
+from shop.views import PRODUCT_SORTS
+from shop_surfer_data.db_backends.postgresql_pool import base as pool_backend
 
-# Create your tests here.
+
+# Media URLs are built without S3 credentials
+FILESYSTEM_STORAGE = {"DEFAULT_FILE_STORAGE": "django.core.files.storage.FileSystemStorage", "MEDIA_URL": "/media/"}
+
+# Data sizes every route is measured at: cart items, order lines, products
+# per category and so on all grow together.
+SIZES = (1, 10, 100)
+
+# Most queries a route may run on a cold cache at any size. Counts must also
+# be the same at every size, so an N+1 fails even within its budget.
+QUERY_BUDGETS = {
+    "health_check": 0,
+    "metrics": 0,
+    "get_categories": 1,
+    "get_top_categories": 3,
+    "get_products": 2,
+    "product_detail": 3,
+    "product_batch": 2,
+    "search_products": 0,
+    "autocomplete_products": 0,
+    "get_cart_list": 3,
+    "add_cart_item": 6,
+    "merge_cart": 6,
+    "merge_cart_new_cart": 7,
+    "update_cart_item": 4,
+    "delete_cart_item": 2,
+    # Includes the PendingSale insert that buffers sales without redis
+    "place_order": 7,
+    "get_order_history": 2,
+    "get_address_list": 1,
+    "add_address": 3,
+    "edit_address": 3,
+}
+
+
+# Extra cases measured on the route they name, for paths a route's main
+# request does not take
+ROUTE_VARIANTS = {
+    "merge_cart_new_cart": "merge_cart",
+}
+
+
+class CatalogData:
+    """Catalog, cart, order and addresses of one user, ``size`` of each."""
+
+    def __init__(self, size):
+        self.size = size
+        self.user_id = size
+        self.categories = Category.objects.bulk_create(
+            [Category(name="Category {}".format(i), slug="c{}-{}".format(size, i), image="c.jpg")
+             for i in range(size)])
+        self.category = self.categories[0]
+        TopCategory.objects.bulk_create([TopCategory(category=category, total_purchases=size - i)
+                                         for i, category in enumerate(self.categories)])
+        self.products = Product.objects.bulk_create(
+            [Product(name="Product {} {}".format(size, i), slug="p{}-{}".format(size, i),
+                     description=["Point one", "Point two"], price=Decimal("9.99"), rating=Decimal("4.5"),
+                     seller="seller", image="p.jpg") for i in range(size)])
+        ProductCategory.objects.bulk_create([ProductCategory(product=product, category=category)
+                                             for product in self.products for category in self.categories[:3]])
+        self.cart = Cart.objects.create(user_id=self.user_id)
+        CartItem.objects.bulk_create([CartItem(cart=self.cart, product=product) for product in self.products])
+        self.order = Order.objects.create(user_id=self.user_id, total_amount=Decimal("9.99") * size,
+                                          shipping_address="1 Main Street", payment_method="cod")
+        OrderItem.objects.bulk_create([OrderItem(order=self.order, product=product, price=product.price)
+                                       for product in self.products])
+        self.addresses = ShippingAddress.objects.bulk_create(
+            [ShippingAddress(user_id=self.user_id, full_name="User", mobile_number="9000000000",
+                             pin_code="560001", address1="1 Main Street", address2="Block {}".format(i),
+                             is_default=i == 0) for i in range(size)])
+
+    @property
+    def product_ids(self):
+        return [product.id for product in self.products]
+
+
+class Requests:
+    """The request each route is measured with, one method per route name."""
+
+    def health_check(self, data):
+        return "get", "/health_check/", None
+
+    def metrics(self, data):
+        return "get", "/metrics", None
+
+    def get_categories(self, data):
+        return "get", "/categories/", None
+
+    def get_top_categories(self, data):
+        return "get", "/top_categories/", None
+
+    def get_products(self, data):
+        return "get", "/products/{}/?limit=100".format(data.category.slug), None
+
+    def product_detail(self, data):
+        return "get", "/product/{}/".format(data.products[-1].slug), None
+
+    def product_batch(self, data):
+        return "get", "/product_batch/?ids={}".format(",".join(map(str, data.product_ids))), None
+
+    def search_products(self, data):
+        return "get", "/search/?q=product", None
+
+    def autocomplete_products(self, data):
+        return "get", "/search/autocomplete/?q=prod", None
+
+    def get_cart_list(self, data):
+        return "get", "/cart/?user_id={}".format(data.user_id), None
+
+    def add_cart_item(self, data):
+        product = Product.objects.create(name="New", slug="new-{}".format(data.size), price=1, rating=1,
+                                         seller="seller", image="p.jpg")
+        return "post", "/cart/add/", {"user_id": data.user_id, "cart_item": {"product_id": product.id}}
+
+    def merge_cart(self, data):
+        return "post", "/cart/merge/", {"user_id": data.user_id, "cart_items": [
+            {"product": {"id": product_id}, "quantity": 2, "is_selected": True} for product_id in data.product_ids]}
+
+    def merge_cart_new_cart(self, data):
+        # A user without a cart yet
+        method, path, payload = self.merge_cart(data)
+        return method, path, dict(payload, user_id=1000 + data.user_id)
+
+    def update_cart_item(self, data):
+        return "patch", "/cart/update/", {"user_id": data.user_id, "cart_item": {"is_selected": False}}
+
+    def delete_cart_item(self, data):
+        return "delete", "/cart/delete/?user_id={}&product_ids={}".format(
+            data.user_id, ",".join(map(str, data.product_ids))), None
+
+    def place_order(self, data):
+        return "post", "/order/place/", {
+            "user_id": data.user_id,
+            "order": {"shipping_address": "1 Main Street", "payment_method": "cod"},
+            "order_items": [{"product_id": product_id, "quantity": 1} for product_id in data.product_ids],
+        }
+
+    def get_order_history(self, data):
+        return "get", "/order/history/?user_id={}".format(data.user_id), None
+
+    def get_address_list(self, data):
+        return "get", "/address/?user_id={}".format(data.user_id), None
+
+    def add_address(self, data):
+        return "post", "/address/add/", {"user_id": data.user_id, "new_address": {
+            "full_name": "User", "mobile_number": "9000000000", "pin_code": "560001",
+            "address1": "2 Main Street", "address2": "Block 2"}}
+
+    def edit_address(self, data):
+        return "patch", "/address/edit/", {"user_id": data.user_id, "updated_address": {
+            "id": data.addresses[-1].id, "city": "City", "is_selected": True}}
+
+
+def format_queries(captured):
+    return "\n".join("{}. {}".format(i, query["sql"]) for i, query in enumerate(captured.captured_queries, 1))
+
+
+@override_settings(**FILESYSTEM_STORAGE)
+class QueryBudgetTests(TestCase):
+    requests = Requests()
+
+    def setUp(self):
+        self.data = {size: CatalogData(size) for size in SIZES}
+        self.addCleanup(setattr, search, "_index", None)
+
+    def measure(self, name, data):
+        method, path, payload = getattr(self.requests, name)(data)
+        # Always the cold path: entries are built from the database
+        cache.clear()
+        local_cache.clear()
+        # Loaded at startup, before any search is served
+        search.load_index()
+        # Work deferred to on_commit still runs on the request path
+        with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+            if payload is None:
+                response = getattr(self.client, method)(path)
+            else:
+                response = getattr(self.client, method)(path, payload, content_type="application/json")
+        self.assertLess(response.status_code, 400, "{} {} returned {}".format(
+            method.upper(), path, response.status_code))
+        return captured
+
+    def assertWithinBudget(self, name):
+        budget = QUERY_BUDGETS[name]
+        counts = {}
+        for size in SIZES:
+            captured = self.measure(name, self.data[size])
+            counts[size] = len(captured)
+            self.assertLessEqual(len(captured), budget, "{} ran {} queries at size {}, budget is {}:\n{}".format(
+                name, len(captured), size, budget, format_queries(captured)))
+        self.assertEqual(len(set(counts.values())), 1, "{} query count grows with data size {}:\n{}".format(
+            name, counts, format_queries(captured)))
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in urlpatterns if pattern.name}
+        self.assertEqual(names - set(QUERY_BUDGETS), set())
+        self.assertEqual(set(QUERY_BUDGETS) - names, set(ROUTE_VARIANTS))
+        self.assertLessEqual(set(ROUTE_VARIANTS.values()), names)
+
+
+def add_budget_test(name):
+    def test(self):
+        self.assertWithinBudget(name)
+    test.__name__ = "test_{}_query_budget".format(name)
+    setattr(QueryBudgetTests, test.__name__, test)
+
+
+for route_name in QUERY_BUDGETS:
+    add_budget_test(route_name)
+
+
+@override_settings(**FILESYSTEM_STORAGE)
+class TaggedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.data = CatalogData(1)
+        self.product = self.data.products[0]
+
+    def test_values_from_before_tagged_entries_are_misses(self):
+        cache.set(PRODUCT_KEY.format(self.product.slug), json.dumps({"slug": self.product.slug}))
+        self.assertEqual(self.client.get("/product/{}/".format(self.product.slug)).status_code, 200)
+        cache.set(PRODUCT_KEY.format(self.product.slug), json.dumps({"slug": self.product.slug}))
+        response = self.client.get("/product_batch/?slugs={}".format(self.product.slug))
+        self.assertEqual([product["id"] for product in response.json()], [self.product.id])
+
+    def test_tag_versions_never_overwrite_a_bumped_version(self):
+        tag = product_tag(self.product.id)
+        invalidate_tags(tag)
+        bumped = cache.get(TAG_KEY.format(tag))
+        get_many = cache.get_many
+        # Simulates a reader that missed the tag just before the bump
+        reads = iter([lambda keys: {}, get_many])
+        with mock.patch.object(cache, "get_many", side_effect=lambda keys: next(reads)(keys)):
+            self.assertEqual(tag_versions([tag]), {tag: bumped})
+        self.assertEqual(cache.get(TAG_KEY.format(tag)), bumped)
+
+    @override_settings(CDN_PURGE_URL="https://cdn.test/purge", CDN_PURGE_TOKEN="token")
+    def test_invalidation_purges_surrogate_keys(self):
+        with mock.patch("urllib.request.urlopen") as urlopen:
+            invalidate_tags(product_tag(self.product.id), CATALOG_TAG)
+            # The single purge thread runs jobs in order
+            cdn._get_executor().submit(lambda: None).result()
+        request = urlopen.call_args[0][0]
+        self.assertEqual((request.full_url, request.get_method()), ("https://cdn.test/purge", "POST"))
+        self.assertEqual(request.get_header("Surrogate-key"), "catalog product:{}".format(self.product.id))
+        self.assertEqual(request.get_header("Fastly-key"), "token")
+
+
+class TopCategoriesTests(TestCase):
+    def test_snapshot_is_rebuilt_once_per_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            category = Category.objects.create(name="Shoes", slug="shoes", image="c.jpg")
+            TopCategory.objects.create(category=category, total_purchases=1)
+            for i in range(3):
+                product = Product.objects.create(name="P{}".format(i), slug="p{}".format(i), price=1, rating=1,
+                                                 seller="s", image="p.jpg")
+                product.category.add(category)
+        self.assertEqual([callback for callback in callbacks if callback is rebuild_top_categories],
+                         [rebuild_top_categories])
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.builds = 0
+
+    def build(self, data=b"built"):
+        def build():
+            self.builds += 1
+            return data, tag_versions(["t"])
+        return build
+
+    def test_only_the_lock_holder_builds(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_build():
+            started.set()
+            release.wait(5)
+            return self.build()()
+
+        results = []
+        holder = threading.Thread(target=lambda: results.append(get_or_set_entry("k", slow_build, 60)))
+        holder.start()
+        started.wait(5)
+        waiters = [threading.Thread(target=lambda: results.append(get_or_set_entry("k", self.build(b"x"), 60)))
+                   for _ in range(3)]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(LOCK_POLL_INTERVAL * 3)
+        release.set()
+        for thread in [holder, *waiters]:
+            thread.join(5)
+        self.assertEqual(self.builds, 1)
+        self.assertEqual([entry["data"] for entry in results], [b"built"] * 4)
+        self.assertIsNone(cache.get(LOCK_KEY.format("k")))
+
+    @override_settings(CACHE_LOCK_WAIT=0.05)
+    def test_waiters_build_when_the_holder_never_fills(self):
+        # A holder that died (or cached nothing) leaves no entry behind
+        cache.add(LOCK_KEY.format("k"), "other", timeout=60)
+        self.assertEqual(get_or_set_entry("k", self.build(), 60)["data"], b"built")
+        self.assertEqual(self.builds, 1)
+
+    def test_stale_entries_are_served_while_one_request_refreshes(self):
+        get_or_set_entry("k", self.build(b"old"), 60, soft_ttl=0)
+        # Another request holds the refresh lock: the stale copy is served
+        cache.add(LOCK_KEY.format("k"), "other", timeout=60)
+        self.assertEqual(get_or_set_entry("k", self.build(b"new"), 60)["data"], b"old")
+        self.assertEqual(self.builds, 1)
+
+        cache.delete(LOCK_KEY.format("k"))
+        self.assertEqual(get_or_set_entry("k", self.build(b"new"), 60)["data"], b"new")
+        self.assertEqual(get_or_set_entry("k", self.build(b"newer"), 60)["data"], b"new")
+        self.assertEqual(self.builds, 2)
+
+    @override_settings(CACHE_LOCK_WAIT=0.05)
+    def test_invalidated_entries_are_never_served_stale(self):
+        get_or_set_entry("k", self.build(b"old"), 60, soft_ttl=0)
+        invalidate_tags("t")
+        cache.add(LOCK_KEY.format("k"), "other", timeout=60)
+        self.assertEqual(get_or_set_entry("k", self.build(b"new"), 60)["data"], b"new")
+
+class LocalCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+
+    def test_least_recently_used_entries_are_evicted(self):
+        local = LocalCache(max_entries=2, max_bytes=10, ttl=60)
+
+        def put(key, size):
+            local.set(key, {"tags": {}, "data": b"x" * size, "fresh_until": 0}, None)
+        put("a", 2)
+        put("b", 2)
+        local.lookup("a")
+        put("c", 2)
+        self.assertEqual(list(local._entries), ["a", "c"])
+        # Over the byte budget: older entries make room even below max_entries
+        put("d", 8)
+        put("e", 9)
+        self.assertEqual(list(local._entries), ["e"])
+        self.assertEqual((local.stats()["bytes"], local.stats()["evictions"]), (9, 4))
+        # Larger than the whole budget: never stored
+        put("f", 11)
+        self.assertIsNone(local.lookup("f"))
+        self.assertEqual(list(local._entries), ["e"])
+
+    def test_entries_are_revalidated_after_an_invalidation(self):
+        def build(tag):
+            return lambda: (tag.encode(), tag_versions([tag]))
+        for tag in ("t1", "t2"):
+            get_or_set_entry(tag, build(tag), 60, local=True)
+
+        invalidate_tags("t1")
+        self.assertIsNone(local_cache.get("t1"))
+        self.assertEqual(local_cache.get("t2")["data"], b"t2")
+        # Revalidated once against the new generation, not on every read
+        revalidations = local_cache.revalidations
+        self.assertEqual(local_cache.get("t2")["data"], b"t2")
+        self.assertEqual(local_cache.revalidations, revalidations)
+        self.assertEqual(get_or_set_entry("t1", lambda: (b"rebuilt", tag_versions(["t1"])), 60,
+                                          local=True)["data"], b"rebuilt")
+
+@override_settings(**FILESYSTEM_STORAGE)
+class CartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.data = CatalogData(1)
+        self.product = self.data.products[0]
+
+    def test_invalid_product_ids_are_rejected(self):
+        response = self.client.patch("/cart/update/", {"user_id": self.data.user_id, "cart_item": {
+            "product_id": "x", "quantity": 2}}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.delete("/cart/delete/?user_id={}&product_ids=x".format(self.data.user_id))
+        self.assertEqual(response.status_code, 400)
+
+    def test_updates_are_cached_with_model_types(self):
+        self.client.get("/cart/?user_id={}".format(self.data.user_id))
+        response = self.client.patch("/cart/update/", {"user_id": self.data.user_id, "cart_item": {
+            "product_id": str(self.product.id), "quantity": "3", "is_selected": "false"}},
+            content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        item = get_cart_store().load(self.data.user_id)[self.product.id]
+        self.assertEqual((item["quantity"], item["is_selected"]), (3, False))
+        self.assertEqual(response.json()[0]["quantity"], 3)
+
+        response = self.client.patch("/cart/update/", {"user_id": self.data.user_id, "cart_item": {
+            "product_id": self.product.id, "quantity": "many"}}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+    def merge(self, user_id, cart_items):
+        return self.client.post("/cart/merge/", {"user_id": user_id, "cart_items": cart_items},
+                                content_type="application/json")
+
+    def test_merge_validates_guest_lines(self):
+        for line in ({"product": {"id": self.product.id}, "quantity": "many"},
+                     {"product": {"id": "x"}, "quantity": 1},
+                     {"product": {"id": self.product.id}, "is_selected": "maybe"}):
+            response = self.merge(self.data.user_id, [line])
+            self.assertEqual(response.status_code, 400, line)
+            self.assertIn("0", response.json()["cart_items"])
+
+        # String ids and values are parsed, missing values take the defaults
+        response = self.merge(self.data.user_id, [{"product": {"id": str(self.product.id)}, "quantity": "4"}])
+        self.assertEqual(response.status_code, 200)
+        item = CartItem.objects.get(cart=self.data.cart, product=self.product)
+        self.assertEqual((item.quantity, item.is_selected), (4, True))
+
+    def test_merge_only_touches_own_cart(self):
+        other = Cart.objects.create(user_id=1000)
+        CartItem.objects.create(cart=other, product=self.product, quantity=7, is_selected=False)
+
+        response = self.merge(self.data.user_id, [{"product": {"id": self.product.id}, "quantity": 2,
+                                                   "is_selected": False}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item["product"]["id"], item["quantity"]) for item in response.json()],
+                         [(self.product.id, 2)])
+        self.assertEqual(list(CartItem.objects.filter(cart=other).values_list("quantity", "is_selected")),
+                         [(7, False)])
+        self.assertEqual(CartItem.objects.filter(cart=self.data.cart).get().quantity, 2)
+
+class OrderHistoryTests(TestCase):
+    def test_user_id_must_be_an_integer(self):
+        self.assertEqual(self.client.get("/order/history/?user_id=abc").status_code, 400)
+        self.assertEqual(self.client.get("/order/history/").status_code, 400)
+        self.assertEqual(self.client.get("/order/history/?user_id=1").json()["results"], [])
+
+    def test_unknown_parameters_share_a_cache_entry(self):
+        self.client.get("/order/history/?user_id=1&limit=5")
+        with self.assertNumQueries(0):
+            response = self.client.get("/order/history/?limit=5&user_id=1&_=123")
+        self.assertEqual(response.json()["results"], [])
+        self.assertEqual(self.client.get("/order/history/?user_id=1&limit=x").status_code, 400)
+
+
+@override_settings(NOTIFICATION_TRANSPORTS=["smtp"])
+class OutboxTests(TestCase):
+    def test_message_without_recipient_fails_without_retries(self):
+        outbox.enqueue("order_placed", {"order_id": "1", "email": None})
+        self.assertEqual(outbox.drain(), (0, 1))
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.FAILED, 1))
+        self.assertIn("UndeliverableError", message.last_error)
+
+
+@override_settings(**FILESYSTEM_STORAGE)
+class ProductListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.category = Category.objects.create(name="Shoes", slug="shoes", image="c.jpg")
+        # Few distinct prices and ratings, so most sort keys are tied
+        self.products = Product.objects.bulk_create(
+            [Product(name="P{}".format(i), slug="p{}".format(i), price=Decimal((5, 7, 9)[i % 3]),
+                     rating=Decimal(("4.5", "3.0")[i % 2]), in_stock=i % 4 != 0, fast_delivery=i % 3 == 0,
+                     seller=("acme", "other")[i % 2], image="p.jpg") for i in range(11)])
+        self.category.products.add(*self.products)
+        self.other = Category.objects.create(name="Hats", slug="hats", image="c.jpg")
+        Product.objects.create(name="Hat", slug="hat", price=1, rating=5, seller="acme", image="p.jpg") \
+            .category.add(self.other)
+
+    def get(self, query=""):
+        return self.client.get("/products/shoes/?" + query)
+
+    def walk(self, query):
+        ids, cursor = [], None
+        while True:
+            response = self.get(query + ("&cursor=" + cursor if cursor else ""))
+            self.assertEqual(response.status_code, 200)
+            ids += [product["id"] for product in response.json()["results"]]
+            cursor = response.json()["next_cursor"]
+            if cursor is None:
+                return ids
+
+    def expected(self, ordering, products=None):
+        def key(product):
+            return tuple(-getattr(product, field[1:]) if field.startswith("-") else getattr(product, field)
+                         for field in ordering)
+        return [product.id for product in sorted(products or self.products, key=key)]
+
+    def test_cursor_round_trip(self):
+        values = [Decimal("4.50"), 17]
+        self.assertEqual(decode_cursor(encode_cursor(values)), ["4.50", 17])
+        self.assertNotIn("=", encode_cursor(values))
+
+    def test_pages_follow_every_sort_across_tied_keys(self):
+        for sort, ordering in PRODUCT_SORTS.items():
+            with self.subTest(sort=sort):
+                self.assertEqual(self.walk("sort={}&limit=2".format(sort)), self.expected(ordering))
+        # rating is the default
+        self.assertEqual(self.walk("limit=3"), self.expected(PRODUCT_SORTS["rating"]))
+
+    def test_filters(self):
+        def matching(condition):
+            return self.expected(PRODUCT_SORTS["price"], [p for p in self.products if condition(p)])
+
+        cases = {
+            "in_stock=true": lambda p: p.in_stock,
+            "in_stock=false&fast_delivery=true": lambda p: not p.in_stock and p.fast_delivery,
+            "seller=acme": lambda p: p.seller == "acme",
+            "min_price=6&max_price=9": lambda p: 6 <= p.price <= 9,
+        }
+        for query, condition in cases.items():
+            with self.subTest(query=query):
+                self.assertEqual(self.walk("sort=price&limit=2&" + query), matching(condition))
+
+    def test_equivalent_queries_share_a_cache_entry(self):
+        self.assertEqual(self.get("sort=price&min_price=6&limit=2").status_code, 200)
+        with self.assertNumQueries(0):
+            for query in ("min_price=6.00&limit=2&sort=price", "limit=2&utm_source=mail&sort=price&min_price=6",
+                          "sort=price&min_price=6&limit=2&seller="):
+                self.assertEqual(self.get(query).status_code, 200)
+
+    def test_invalid_parameters(self):
+        for query in ("sort=bogus", "limit=x", "cursor=garbage", "cursor=" + encode_cursor([1]),
+                      "cursor=" + encode_cursor({"id": 1}), "min_price=cheap"):
+            with self.subTest(query=query):
+                self.assertEqual(self.get(query).status_code, 400)
+        # Out of range limits are clamped
+        self.assertEqual(len(self.get("limit=0").json()["results"]), 1)
+        self.assertEqual(len(self.get("limit=1000").json()["results"]), len(self.products))
+
+class AsyncReadUrls:
+    # The sync routes, plus the async read views under /async/
+    urlpatterns = [
+        path("", include(urlpatterns)),
+        path("async/", include([path(str(pattern.pattern), getattr(async_views, pattern.name))
+                                for pattern in urlpatterns if hasattr(async_views, pattern.name)])),
+    ]
+
+
+@override_settings(**FILESYSTEM_STORAGE, ROOT_URLCONF=AsyncReadUrls)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.data = CatalogData(10)
+
+    async def assertSameResponse(self, path):
+        # Cold on both sides, then the async view served from the sync view's entry
+        await sync_to_async(cache.clear)()
+        local_cache.clear()
+        expected = await sync_to_async(self.client.get)(path)
+        await sync_to_async(cache.clear)()
+        local_cache.clear()
+        responses = [await self.async_client.get("/async" + path)]
+        await sync_to_async(self.client.get)(path)
+        local_cache.clear()
+        responses.append(await self.async_client.get("/async" + path))
+        for response in responses:
+            self.assertEqual(response.status_code, expected.status_code, path)
+            self.assertEqual(response.json(), expected.json(), path)
+            self.assertEqual(response.get("ETag"), expected.get("ETag"), path)
+        return expected
+
+    async def test_async_read_views_match_sync_views(self):
+        slug = self.data.category.slug
+        first_page = await self.assertSameResponse("/products/{}/?limit=3&sort=price".format(slug))
+        self.assertEqual(len(first_page.json()["results"]), 3)
+        for path in ("/categories/",
+                     "/products/{}/?limit=3&sort=price&cursor={}".format(slug, first_page.json()["next_cursor"]),
+                     "/products/{}/?in_stock=true&min_price=1".format(slug),
+                     "/product/{}/".format(self.data.products[0].slug),
+                     "/cart/?user_id={}".format(self.data.user_id),
+                     "/address/?user_id={}".format(self.data.user_id)):
+            self.assertEqual((await self.assertSameResponse(path)).status_code, 200, path)
+
+    async def test_async_read_views_match_sync_errors(self):
+        slug = self.data.category.slug
+        self.assertEqual((await self.assertSameResponse("/product/missing/")).status_code, 404)
+        for path in ("/products/{}/?sort=bogus".format(slug),
+                     "/products/{}/?limit=x".format(slug),
+                     "/products/{}/?cursor=garbage".format(slug),
+                     "/products/{}/?min_price=cheap".format(slug)):
+            self.assertEqual((await self.assertSameResponse(path)).status_code, 400, path)
+        response = await self.async_client.post("/async/categories/")
+        self.assertEqual(response.status_code, 405)
+
+class FakeRedis:
+    """The few redis hash and set commands the sales buffer uses."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def exists(self, key):
+        return key in self.data
+
+    def rename(self, key, new_key):
+        if key not in self.data:
+            raise ResponseError("no such key")
+        self.data[new_key] = self.data.pop(key)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def hincrby(self, key, field, amount):
+        fields = self.data.setdefault(key, {})
+        fields[field.encode()] = fields.get(field.encode(), 0) + amount
+
+    def hgetall(self, key):
+        return {field: str(value).encode() for field, value in self.data.get(key, {}).items()}
+
+    def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(member.encode())
+
+    def srem(self, key, member):
+        self.data.get(key, set()).discard(member.encode())
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args) for name, args in self.calls]
+
+
+@override_settings(**FILESYSTEM_STORAGE)
+class SalesTests(TestCase):
+    def setUp(self):
+        self.data = CatalogData(1)
+        self.product = self.data.products[0]
+        self.redis = FakeRedis()
+        patcher = mock.patch("shop.sales.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def total(self):
+        return ProductSales.objects.get(product=self.product).total_purchases
+
+    def test_batches_are_applied_once(self):
+        record_sales([(self.product.id, 2)])
+        self.assertEqual(flush_sales(), 2)
+        self.assertEqual(flush_sales(), 0)
+        self.assertEqual(self.total(), 2)
+
+        # Another flusher applied this batch but died before deleting it
+        record_sales([(self.product.id, 3)])
+        sales._claim_pending(self.redis)
+        batch_key = self.redis.smembers(SALES_BATCHES_KEY).pop().decode()
+        SalesFlush.objects.create(batch_id=batch_key)
+        self.assertEqual(flush_sales(), 0)
+        self.assertEqual(self.total(), 2)
+        self.assertEqual(self.redis.data[SALES_BATCHES_KEY], set())
+
+    def test_failed_batches_are_retried(self):
+        record_sales([(self.product.id, 2)])
+        with mock.patch("shop.sales.apply_sales", side_effect=DatabaseError("down")):
+            with self.assertRaises(DatabaseError):
+                flush_sales()
+        self.assertFalse(SalesFlush.objects.exists())
+        self.assertEqual(flush_sales(), 2)
+
+        # Crashed after committing the increments, before cleaning up redis
+        record_sales([(self.product.id, 3)])
+        with mock.patch.object(self.redis, "delete", side_effect=ConnectionError("down")):
+            with self.assertRaises(ConnectionError):
+                flush_sales()
+        self.assertEqual(flush_sales(), 0)
+        self.assertEqual(self.total(), 5)
+
+    def test_without_redis_sales_are_buffered_in_the_database(self):
+        with mock.patch("shop.sales.get_redis", return_value=None):
+            with self.assertNumQueries(1):
+                record_sales([(self.product.id, 2), (self.product.id, 1)])
+            self.assertEqual(flush_sales(), 3)
+            self.assertEqual(flush_sales(), 0)
+        self.assertEqual(self.total(), 3)
+        self.assertFalse(PendingSale.objects.exists())
+
+
+class MetricsTests(TestCase):
+    def test_metrics_sum_all_workers(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        # Another worker that has exited since
+        other = metrics.Registry()
+        other.requests[("health_check", "GET", "200")] = 5
+        with open(os.path.join(metrics_dir, "999999-dead.pickle"), "wb") as f:
+            pickle.dump({"pid": 999999, "registry": other.snapshot(),
+                         "gauges": [("shop_local_cache", {"stat": "entries"}, 7)]}, f)
+
+        with self.settings(METRICS_DIR=metrics_dir):
+            self.client.get("/health_check/")
+            body = self.client.get("/metrics").content.decode()
+        own = metrics.registry.requests[("health_check", "GET", "200")]
+        self.assertIn('shop_requests_total{{endpoint="health_check",method="GET",status="200"}} {}'.format(
+            own + 5), body)
+        self.assertIn('shop_local_cache{{stat="entries",worker="{}"}}'.format(os.getpid()), body)
+        self.assertNotIn('worker="999999"', body)
+
+
+@override_settings(**FILESYSTEM_STORAGE)
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.data = CatalogData(10)
+        self.index = search.load_index()
+        self.addCleanup(setattr, search, "_index", None)
+
+    def change_elsewhere(self, product_ids=None):
+        # Another worker's edit: only published through the shared cache
+        search._index = None
+        search._bump_version(product_ids)
+        search._index = self.index
+        search._last_check = 0
+
+    def test_replays_changes_from_other_workers(self):
+        product = self.data.products[0]
+        Product.objects.filter(id=product.id).update(name="Zebra")
+        self.change_elsewhere([product.id])
+
+        with self.assertNumQueries(2):
+            index = search.get_index()
+        self.assertIs(index, self.index)
+        self.assertEqual([doc["slug"] for doc in index.search("zebra")], [product.slug])
+
+    def test_first_use_never_builds_on_the_request_path(self):
+        snapshot = os.path.join(tempfile.mkdtemp(), "index.pickle")
+        self.addCleanup(shutil.rmtree, os.path.dirname(snapshot))
+        self.index.save(snapshot)
+
+        search._index = None
+        with self.settings(SEARCH_INDEX_PATH=snapshot), self.assertNumQueries(0):
+            self.assertEqual(len(search.get_index().search("product")), 10)
+
+        search._index = None
+        with mock.patch.object(search, "_rebuild_in_background") as rebuild, self.assertNumQueries(0):
+            self.assertEqual(search.get_index().search("product"), [])
+        rebuild.assert_called_once_with()
+
+    def test_rebuilds_in_background_when_changes_cannot_be_replayed(self):
+        self.change_elsewhere()
+        with mock.patch.object(search, "_rebuild_in_background") as rebuild, self.assertNumQueries(0):
+            self.assertIs(search.get_index(), self.index)
+        rebuild.assert_called_once_with()
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=psycopg2_extensions.TRANSACTION_STATUS_IDLE)
+        self.cursor = mock.MagicMock()
+
+    def rollback(self):
+        self.info.transaction_status = psycopg2_extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, **options):
+        return pool_backend.ConnectionPool({**pool_backend.POOL_DEFAULTS, "MAX_SIZE": 2, **options})
+
+    def test_checked_in_connections_are_reused(self):
+        pool = self.make_pool()
+        first = pool.checkout(FakeConnection)
+        first.info.transaction_status = psycopg2_extensions.TRANSACTION_STATUS_INTRANS
+        pool.checkin(first)
+        # Returned rolled back, then handed out again
+        self.assertEqual(first.info.transaction_status, psycopg2_extensions.TRANSACTION_STATUS_IDLE)
+        self.assertIs(pool.checkout(FakeConnection), first)
+        self.assertEqual({key: pool.stats()[key] for key in ("open", "idle", "in_use", "created", "checkouts")},
+                         {"open": 1, "idle": 0, "in_use": 1, "created": 1, "checkouts": 2})
+
+    def test_broken_connections_are_discarded(self):
+        pool = self.make_pool(HEALTH_CHECK_INTERVAL=0)
+        unknown = pool.checkout(FakeConnection)
+        closed = pool.checkout(FakeConnection)
+        unknown.info.transaction_status = psycopg2_extensions.TRANSACTION_STATUS_UNKNOWN
+        closed.closed = 1
+        pool.checkin(unknown)
+        pool.checkin(closed)
+        self.assertEqual((pool.stats()["idle"], pool.stats()["discarded"]), (0, 2))
+        self.assertTrue(unknown.closed)
+
+        # Fails its ping after being idle past the health check interval
+        dead = pool.checkout(FakeConnection)
+        dead.cursor.side_effect = psycopg2.OperationalError("server closed the connection")
+        pool.checkin(dead)
+        self.assertIsNot(pool.checkout(FakeConnection), dead)
+        self.assertEqual({key: pool.stats()[key] for key in ("open", "created", "discarded")},
+                         {"open": 1, "created": 4, "discarded": 3})
+
+        # A connection closed inside atomic() is never reused
+        inside_atomic = pool.checkout(FakeConnection)
+        pool.checkin(inside_atomic, discard=True)
+        self.assertEqual(pool.stats()["idle"], 0)
+
+    def test_checkout_times_out_when_exhausted(self):
+        pool = self.make_pool(MAX_SIZE=1, TIMEOUT=0.05)
+        connection = pool.checkout(FakeConnection)
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.checkout(FakeConnection)
+        self.assertEqual((pool.stats()["waits"], pool.stats()["timeouts"]), (1, 1))
+
+        # A failed connect gives its slot back
+        pool.checkin(connection)
+        pool.close_idle()
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.checkout(mock.Mock(side_effect=psycopg2.OperationalError("refused")))
+        self.assertIsInstance(pool.checkout(FakeConnection), FakeConnection)
+
+    def test_forked_workers_get_their_own_pool(self):
+        params = {"dbname": "shop", "host": "db"}
+        with mock.patch.dict(pool_backend._pools, clear=True):
+            parent = pool_backend.get_pool("default", params, pool_backend.POOL_DEFAULTS)
+            connection = parent.checkout(FakeConnection)
+            parent.checkin(connection)
+            self.assertIs(pool_backend.get_pool("default", params, pool_backend.POOL_DEFAULTS), parent)
+
+            with mock.patch("os.getpid", return_value=parent.pid + 1):
+                child = pool_backend.get_pool("default", params, pool_backend.POOL_DEFAULTS)
+                self.assertIsNot(child, parent)
+                self.assertEqual(pool_backend.pool_stats()["default"]["created"], 0)
+                self.assertIsNot(child.checkout(FakeConnection), connection)
+            # The parent's sockets are left open for the parent
+            self.assertFalse(connection.closed)
+
+def jpeg_upload(name, width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, "JPEG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+
+@override_settings(**FILESYSTEM_STORAGE, IMAGE_RENDITION_WIDTHS=[160, 320, 1024], IMAGE_RENDITION_WORKERS=0,
+                   IMAGE_RENDITIONS_BACKGROUND=False)
+class RenditionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.addCleanup(self.settings_override.disable)
+
+    def create_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name="Shoe", slug="shoe", price=1, rating=1, seller="seller",
+                                             image=jpeg_upload("shoe.jpg", 800, 600))
+        product.refresh_from_db()
+        return product
+
+    def test_upload_generates_renditions(self):
+        product = self.create_product()
+        formats = product.image_renditions["formats"]
+        self.assertEqual(product.image_renditions["source"], product.image.name)
+        self.assertEqual(set(formats), {"jpeg", "webp"})
+        # Never upscaled: 1024 is capped at the source width
+        self.assertEqual(set(formats["webp"]), {"160", "320", "800"})
+        with product.image.storage.open(formats["webp"]["320"]) as f, Image.open(f) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (320, 240)))
+
+        srcset = ProductSerializer(product).data["image_srcset"]
+        self.assertEqual(srcset["webp"].split(", ")[0], "/media/products/renditions/shoe-160w.webp 160w")
+        self.assertEqual(CartProductSerializer(product).data["image_srcset"], srcset)
+
+    def test_command_regenerates_missing_renditions(self):
+        product = self.create_product()
+        Product.objects.filter(id=product.id).update(image_renditions={})
+        self.assertEqual(ProductSerializer(Product.objects.get(id=product.id)).data["image_srcset"], {})
+
+        call_command("generate_renditions", "--model", "product", stdout=io.StringIO())
+        self.assertEqual(Product.objects.get(id=product.id).image_renditions, product.image_renditions)
+
+
+class ImportCatalogTests(TestCase):
+    def import_file(self, suffix, content, *args):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        call_command("import_catalog", f.name, *args, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_upserts_by_slug_and_links_categories(self):
+        Category.objects.create(name="Shoes", slug="shoes", image="c.jpg")
+        self.import_file(".csv", "slug,name,price,rating,seller,description,categories\n"
+                                 "shoe,Shoe,10.00,4.5,acme,\"[\"\"Light\"\"]\",shoes|unknown\n"
+                                 "bad,Bad,free,4.5,acme,,\n")
+        product = Product.objects.get(slug="shoe")
+        self.assertEqual((product.price, product.description), (Decimal("10.00"), ["Light"]))
+        self.assertEqual(list(product.category.values_list("slug", flat=True)), ["shoes"])
+        self.assertFalse(Product.objects.filter(slug="bad").exists())
+
+        # Columns missing from a row keep their stored values
+        self.import_file(".jsonl", '{"slug": "shoe", "name": "Shoe 2", "price": 12, "rating": 4, "seller": "acme"}\n')
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.price, product.description), ("Shoe 2", Decimal("12.00"), ["Light"]))
+        self.assertEqual(Product.objects.count(), 1)
+
+    @override_settings(**FILESYSTEM_STORAGE)
+    def test_listings_are_invalidated_batch_by_batch(self):
+        cache.clear()
+        local_cache.clear()
+        category = Category.objects.create(name="Shoes", slug="shoes", image="c.jpg")
+        product = Product.objects.create(name="Shoe", slug="shoe", price=10, rating=4, seller="acme", image="p.jpg")
+        product.category.add(category)
+        self.assertEqual(self.client.get("/products/shoes/").json()["results"][0]["price"], "10.00")
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.write('{"slug": "shoe", "name": "Shoe", "price": 12, "rating": 4, "seller": "acme"}\n')
+        self.addCleanup(os.remove, f.name)
+        # The import fails on the second file after the first one committed
+        with self.assertRaises(FileNotFoundError):
+            call_command("import_catalog", f.name, f.name + ".missing.jsonl", stdout=io.StringIO())
+        self.assertEqual(self.client.get("/products/shoes/").json()["results"][0]["price"], "12.00")
+
+
+@override_settings(**FILESYSTEM_STORAGE)
+class WarmCacheTests(TestCase):
+    def test_warms_best_sellers_first(self):
+        cache.clear()
+        local_cache.clear()
+        products = Product.objects.bulk_create(
+            [Product(name="P{}".format(i), slug="p{}".format(i), price=1, rating=Decimal("4.0"), seller="s",
+                     image="p.jpg") for i in range(3)])
+        ProductSales.objects.create(product=products[2], total_purchases=5)
+
+        out = io.StringIO()
+        call_command("warm_cache", "--products", "2", "--rate", "0", stdout=out)
+        warmed = get_many_entries([PRODUCT_KEY.format(product.slug) for product in products])
+        self.assertEqual(set(warmed), {PRODUCT_KEY.format("p2"), PRODUCT_KEY.format("p1")})
+        with self.assertNumQueries(0):
+            self.client.get("/product/p2/")
+
+        call_command("warm_cache", "--products", "2", stdout=out)
+        self.assertIn("Warmed 0 of the top 2 products (2 already cached)", out.getvalue())
+
+
+@override_settings(**FILESYSTEM_STORAGE, COMPRESSION_MIN_SIZE=200)
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.data = CatalogData(10)
+
+    def test_cached_responses_use_precompressed_variants(self):
+        plain = self.client.get("/categories/")
+        self.assertNotIn("Content-Encoding", plain)
+
+        response = self.client.get("/categories/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(response["ETag"], plain["ETag"][:-1] + '-gzip"')
+
+        not_modified = self.client.get("/categories/", HTTP_ACCEPT_ENCODING="gzip",
+                                       HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        refused = self.client.get("/categories/", HTTP_ACCEPT_ENCODING="gzip;q=0, identity")
+        self.assertEqual(refused.content, plain.content)
+
+    def test_only_served_entries_are_precompressed(self):
+        batch_slug, detail_slug = self.data.products[0].slug, self.data.products[1].slug
+        self.client.get("/product_batch/?slugs={}".format(batch_slug))
+        self.client.get("/product/{}/".format(detail_slug))
+        entries = get_many_entries([PRODUCT_KEY.format(batch_slug), PRODUCT_KEY.format(detail_slug)])
+        self.assertNotIn("encodings", entries[PRODUCT_KEY.format(batch_slug)])
+        self.assertIn("gzip", entries[PRODUCT_KEY.format(detail_slug)]["encodings"])
+
+        # Filled without variants: compressed per request instead
+        response = self.client.get("/product/{}/".format(batch_slug), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(response.content))["slug"], batch_slug)
+
+    def test_middleware_compresses_large_responses(self):
+        path = "/product_batch/?ids={}".format(",".join(map(str, self.data.product_ids)))
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), self.client.get(path).content)
+
+        small = self.client.get("/health_check/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", small)
@@ -1,19 +1,29 @@
+from django.conf import settings
 from django.urls import path
-from shop import views
+from shop import async_views, metrics, views
+
+# Hot read endpoints are served by their native async versions under ASGI
+read_views = async_views if settings.ASYNC_READ_VIEWS else views
 
 urlpatterns = [
     path('health_check/', views.health_check, name='health_check'),
-    path('categories/', views.get_categories, name='get_categories'),
+    # No trailing slash: the default Prometheus scrape path
+    path('metrics', metrics.metrics_view, name='metrics'),
+    path('categories/', read_views.get_categories, name='get_categories'),
     path('top_categories/', views.get_top_categories, name='get_top_categories'),
-    path('products/<str:slug>/', views.get_products, name='get_products'),
-    path('product/<str:slug>/', views.product_detail, name='product_detail'),
-    path('cart/', views.get_cart_list, name='get_cart_list'),
+    path('products/<str:slug>/', read_views.get_products, name='get_products'),
+    path('product/<str:slug>/', read_views.product_detail, name='product_detail'),
+    path('product_batch/', views.product_batch, name='product_batch'),
+    path('search/', views.search_products, name='search_products'),
+    path('search/autocomplete/', views.autocomplete_products, name='autocomplete_products'),
+    path('cart/', read_views.get_cart_list, name='get_cart_list'),
     path('cart/add/', views.add_cart_item, name='add_cart_item'),
     path('cart/merge/', views.merge_cart, name='merge_cart'),
     path('cart/update/', views.update_cart_item, name='update_cart_item'),
     path('cart/delete/', views.delete_cart_item, name='delete_cart_item'),
     path('order/place/', views.place_order, name='place_order'),
-    path('address/', views.get_address_list, name='get_address_list'),
+    path('order/history/', views.get_order_history, name='get_order_history'),
+    path('address/', read_views.get_address_list, name='get_address_list'),
     path('address/add/', views.add_address, name='add_address'),
     path('address/edit/', views.edit_address, name='edit_address'),
     # path('cart/<int:pk>/', views.CartItemRetrieveUpdateDelete.as_view(), name='cartitemupdatedelete'),
@@ -1,6 +1,67 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django_redis import get_redis_connection
+from rest_framework.renderers import JSONRenderer
+from shop import metrics
+from shop.compression import choose_encoding
+
+
+def get_redis():
+    # Raw redis client behind the default cache, or None when the cache
+    # backend is not redis (CACHE_BACKEND=locmem in tests and local benchmarks)
+    try:
+        return get_redis_connection("default")
+    except NotImplementedError:
+        return None
+
 
 def get_object_or_none(model, *args, **kwargs):
     try:
         return model.objects.get(*args, **kwargs)
     except model.DoesNotExist:
         return None
+
+
+def parse_bool(value):
+    if value is None:
+        return None
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+def render_json(data):
+    with metrics.timer("serialize"):
+        return JSONRenderer().render(data)
+
+
+def json_response(body, status=200):
+    # Sends an already rendered JSON body as is, bypassing DRF rendering
+    return HttpResponse(body, status=status, content_type="application/json")
+
+
+def cached_json_response(request, entry):
+    """
+    Response for a cached catalog entry, with its ETag and CDN headers.
+    Matching If-None-Match requests get a bodyless 304. Surrogate-Key lists
+    the entry's cache tags, which invalidate_tags() purges from the CDN when
+    CDN_PURGE_URL is set.
+    The body is the entry's precompressed variant the client prefers, if any.
+    """
+    variants = entry.get("encodings", {})
+    encoding = choose_encoding(request, variants)
+    # Each encoding is a different representation, so it needs its own ETag
+    etag = entry["etag"] if encoding is None else '{}-{}"'.format(entry["etag"][:-1], encoding)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = json_response(variants[encoding] if encoding else entry["data"])
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    if variants:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    response["Cache-Control"] = settings.CATALOG_CACHE_CONTROL
+    if settings.CATALOG_SURROGATE_CONTROL:
+        response["Surrogate-Control"] = settings.CATALOG_SURROGATE_CONTROL
+    if entry["tags"]:
+        response["Surrogate-Key"] = " ".join(sorted(entry["tags"]))
+    return response
@@ -4,18 +4,27 @@ from rest_framework.views import APIView
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework.exceptions import AuthenticationFailed
-from .serializers import CategorySerializer, ProductSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer, ShippingAddressSerializer
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from .serializers import CartItemSerializer, CategorySerializer, ProductSerializer, OrderSerializer, OrderItemSerializer, OrderHistorySerializer, ShippingAddressSerializer
 from shop.models import Product, Category, TopCategory, Cart, CartItem, Order, OrderItem, ShippingAddress
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.generics import ListAPIView, RetrieveUpdateDestroyAPIView, ListCreateAPIView
-from django.db import IntegrityError
-from shop.utils import get_object_or_none
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.views.decorators.http import require_GET
+from shop.utils import get_object_or_none, parse_bool, render_json, json_response, cached_json_response
+from shop.pagination import keyset_paginate, get_page_size, page_key
+from shop.cart import cart_item, get_cart_store, serialize_cart
+from shop.snapshots import get_top_categories_entry
+from shop.catalog import PRODUCT_KEY, get_categories_entry, get_product_entries, render_product
+from shop.sales import record_sales
+from shop import outbox, search
+from shop.cache import (CATALOG_TAG, category_tag, orders_tag, product_tag, get_or_set, get_or_set_entry,
+                        invalidate_tags, set_cached, tag_versions)
 import time
 from django.conf import settings
-from django.core.cache import cache
-import json
+from decimal import Decimal, InvalidOperation
 
 @api_view(['GET'])
 def health_check(request):
@@ -24,78 +33,165 @@ def health_check(request):
 
 @api_view(['GET'])
 def get_categories(request):
-    categories = Category.objects.all()
-    serializer = CategorySerializer(categories, many=True)
-    return Response(serializer.data)
+    return cached_json_response(request, get_categories_entry())
+
+
+PRODUCT_SORTS = {
+    "rating": ("-rating", "-id"),
+    "price": ("price", "id"),
+    "price_desc": ("-price", "-id"),
+    "newest": ("-id",),
+}
+
+
+def product_listing(request, slug):
+    """
+    The filtered queryset, keyset ordering, cache key and an error message
+    for invalid parameters for a category listing. Shared with the async
+    view. The key is built from the parsed parameters in a fixed order, so
+    reordered, repeated or unknown query parameters share one entry.
+    """
+    sort = request.GET.get("sort", "rating")
+    if sort not in PRODUCT_SORTS:
+        return None, None, None, "Invalid sort, expected one of: {}".format(", ".join(PRODUCT_SORTS))
+
+    products = Product.objects.filter(category__slug=slug).prefetch_related("category")
+
+    in_stock = parse_bool(request.GET.get("in_stock"))
+    if in_stock is not None:
+        products = products.filter(in_stock=in_stock)
+    fast_delivery = parse_bool(request.GET.get("fast_delivery"))
+    if fast_delivery is not None:
+        products = products.filter(fast_delivery=fast_delivery)
+    seller = request.GET.get("seller") or None
+    if seller:
+        products = products.filter(seller=seller)
+    min_price = max_price = None
+    try:
+        if request.GET.get("min_price"):
+            min_price = Decimal(request.GET["min_price"]).normalize()
+            products = products.filter(price__gte=min_price)
+        if request.GET.get("max_price"):
+            max_price = Decimal(request.GET["max_price"]).normalize()
+            products = products.filter(price__lte=max_price)
+    except InvalidOperation:
+        return None, None, None, "Invalid price range"
+
+    params = (sort, in_stock, fast_delivery, seller, min_price, max_price)
+    cache_key = "products:{}:{}:{}".format(slug, ":".join("" if value is None else str(value) for value in params),
+                                          page_key(request))
+    return products, PRODUCT_SORTS[sort], cache_key, None
 
 
 @api_view(['GET'])
 def get_products(request, slug):
-    products = Product.objects.filter(category__slug=slug)
-    serializer = ProductSerializer(products, many=True)
-    return Response(serializer.data)
+    products, ordering, cache_key, error = product_listing(request, slug)
+    if error:
+        return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
+    def build():
+        versions = tag_versions([CATALOG_TAG, category_tag(slug)])
+        page, next_cursor = keyset_paginate(
+            products, ordering, cursor=request.GET.get("cursor"), limit=get_page_size(request))
+        serializer = ProductSerializer(page, many=True)
+        return render_json({"results": serializer.data, "next_cursor": next_cursor}), versions
 
-@api_view(['GET'])
+    entry = get_or_set_entry(cache_key, build, timeout=settings.CATALOG_CACHE_TTL, local=True, compress=True)
+    return cached_json_response(request, entry)
+
+
+@require_GET
 def product_detail(request, slug):
-    cache_key = f"product:{slug}"
-    cached_product = cache.get(cache_key)
-    if not cached_product:
-        product = get_object_or_none(Product, slug=slug)
-        if product:
-            serializer = ProductSerializer(product)
-            product_data = serializer.data
-            if product_data["description"]:
-                product_data["description"] = product_data["description"] if isinstance(product_data["description"], list) else [product_data["description"]]
-            
-            cache.set(cache_key, json.dumps(product_data), timeout=settings.CACHE_TTL)
-        else:
-            return Response(
-                    {"error": "Product not found"},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-    else:
-        print("USING CACHED PRODUCT")
-        product_data = json.loads(cached_product)
-    return Response(product_data)
+    def build():
+        product_id = Product.objects.filter(slug=slug).values_list("id", flat=True).first()
+        if product_id is None:
+            return None
+        # Versions come first, so an edit committed while the product is
+        # loaded leaves the new entry already stale
+        versions = tag_versions([CATALOG_TAG, product_tag(product_id)])
+        product = Product.objects.filter(id=product_id).prefetch_related("category").first()
+        if not product:
+            return None
+        return render_product(product), versions
+
+    entry = get_or_set_entry(PRODUCT_KEY.format(slug), build, timeout=settings.CATALOG_CACHE_TTL, local=True,
+                             compress=True)
+    if entry is None:
+        return json_response(
+                render_json({"error": "Product not found"}),
+                status=status.HTTP_404_NOT_FOUND
+            )
+    return cached_json_response(request, entry)
+
+
+MAX_BATCH_SIZE = 100
+
+
+@require_GET
+def product_batch(request):
+    slugs = [slug for slug in request.GET.get("slugs", "").split(",") if slug]
+    try:
+        ids = [int(product_id) for product_id in request.GET.get("ids", "").split(",") if product_id]
+    except ValueError:
+        return json_response(render_json({"error": "ids must be integers"}), status=status.HTTP_400_BAD_REQUEST)
+    if len(slugs) + len(ids) > MAX_BATCH_SIZE:
+        return json_response(
+            render_json({"error": "At most {} products per request".format(MAX_BATCH_SIZE)}),
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
+    # Cached bodies are already rendered, so the list is just joined together
+    entries = get_product_entries(slugs, ids)
+    return json_response(b"[" + b",".join(entry["data"] for entry in entries) + b"]")
 
 
 @api_view(['GET'])
-def get_top_categories(request):
-    top_categories = [tc.category for tc in TopCategory.objects.all().order_by("-total_purchases")[:3]]
-    serializer = CategorySerializer(top_categories, many=True)
-    category_list = serializer.data
-    top_product_dict = {cat.id: dict() for cat in top_categories}
-    for category in top_categories:
-        top_products = category.products.all().order_by("-rating")[:10]
-        product_serializer = ProductSerializer(top_products, many=True)
-        top_product_dict[category.id]["products"] = product_serializer.data
-    for cat in category_list:
-        cat["products"] = top_product_dict[cat["id"]]["products"]
+def search_products(request):
+    query = request.GET.get("q", "")
+    limit = get_page_size(request)
+    return Response(search.get_index().search(query, limit))
+
 
-    return Response(category_list)
+@api_view(['GET'])
+def autocomplete_products(request):
+    query = request.GET.get("q", "")
+    return Response(search.get_index().autocomplete(query))
 
 
 @api_view(['GET'])
+def get_top_categories(request):
+    return cached_json_response(request, get_top_categories_entry())
+
+
+@require_GET
 def get_cart_list(request):
     user_id = request.GET.get("user_id", None)
-    cart_list = []
-    cache_key = f"cart:{user_id}"
-    cached_cart = cache.get(cache_key)
-    if not cached_cart:
-        cart = get_object_or_none(Cart, user_id=user_id)
-        if cart:
-            latest_cart = CartItem.objects.filter(
-                cart__user_id=user_id).order_by("created_at")
-            serializer = CartItemSerializer(latest_cart, many=True)
-            cart_list = serializer.data
-            cache.set(cache_key, json.dumps(cart_list), timeout=settings.CACHE_TTL)
-    else:
-        print("USING CACHED CART")
-        cart_list = json.loads(cached_cart)
+    return json_response(render_json(serialize_cart(user_id)))
+
+
+CART_ITEM_FIELDS = ("quantity", "is_selected")
+
+
+def cart_item_fields(data):
+    """
+    Validates the quantity and is_selected values present in ``data``, so
+    they are stored and cached with the model's types ("3" -> 3,
+    "false" -> False). Returns (fields, errors).
+    """
+    # Field by field: the serializer's unique_together check needs cart and product
+    serializer_fields = CartItemSerializer().fields
+    fields, errors = {}, {}
+    for name in CART_ITEM_FIELDS:
+        if name in data:
+            try:
+                fields[name] = serializer_fields[name].run_validation(data[name])
+            except ValidationError as e:
+                errors[name] = e.detail
+    return (None, errors) if errors else (fields, None)
 
-    return Response(cart_list, status=status.HTTP_200_OK)
+
+def parse_product_id(value):
+    return int(value) if value not in (None, "") else None
 
 
 @api_view(['POST'])
@@ -103,30 +199,31 @@ def add_cart_item(request):
 
     user_id = request.data.get("user_id", None)
     cart_item_dict = dict(request.data.get("cart_item", {}))
+    try:
+        product_id = parse_product_id(cart_item_dict.get("product_id"))
+    except (TypeError, ValueError):
+        return Response({"error": "product_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    fields, errors = cart_item_fields(cart_item_dict)
+    if errors:
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
     cart = get_object_or_none(Cart, user_id=user_id)
     if not cart:
         cart = Cart.objects.create(user_id=user_id)
 
-    cart_item_dict["cart_id"] = cart.id
-
     # Check if the product exists
-    product = get_object_or_none(Product, id=cart_item_dict.get("product_id"))
+    product = get_object_or_none(Product, id=product_id) if product_id is not None else None
 
+    store = get_cart_store()
     try:
         if cart and product:
-            CartItem.objects.create(**cart_item_dict)
+            item_obj = CartItem.objects.create(cart_id=cart.id, product_id=product.id, **fields)
+            store.put(user_id, product.id, cart_item(item_obj))
     except IntegrityError:
         pass
 
-    latest_cart = CartItem.objects.filter(
-        cart__user_id=user_id).order_by("created_at")
-    serializer = CartItemSerializer(latest_cart, many=True)
-
-    cache_key = f"cart:{user_id}"
-    cache.set(cache_key, json.dumps(serializer.data), timeout=settings.CACHE_TTL)
-
     # return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return json_response(render_json(serialize_cart(user_id, store)))
 
 
 @api_view(['POST'])
@@ -134,59 +231,50 @@ def merge_cart(request):
 
     user_id = request.data.get("user_id", None)
     cart_items = request.data.get("cart_items", [])
+    if not isinstance(cart_items, list):
+        return Response({"error": "cart_items must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Guest cart lines by product, the last one winning for duplicates
+    merged_items = {}
+    errors = {}
+    for index, item in enumerate(cart_items):
+        product = item.get("product") if isinstance(item, dict) else None
+        if not product:
+            continue
+        try:
+            product_id = parse_product_id(product.get("id") if isinstance(product, dict) else None)
+        except (TypeError, ValueError):
+            errors[index] = {"product": ["id must be an integer"]}
+            continue
+        fields, field_errors = cart_item_fields(item)
+        if field_errors:
+            errors[index] = field_errors
+        elif product_id is not None:
+            merged_items[product_id] = fields
+    if errors:
+        return Response({"cart_items": errors}, status=status.HTTP_400_BAD_REQUEST)
+
     cart = get_object_or_none(Cart, user_id=user_id)
     if not cart:
         cart = Cart.objects.create(user_id=user_id)
 
-    item_objects = []
-    for item in cart_items:
-        if item.get("product", None):
-            item_obj = CartItem(cart=cart, product_id=item["product"]["id"],
-                                quantity=item["quantity"], is_selected=item["is_selected"])
-            # print(item_obj.product_id)
-            item_objects.append(item_obj)
-
-    if len(item_objects) > 0:
-
-        item_objects_old = CartItem.objects.filter(
-            cart__user_id=user_id).order_by("created_at")
-        if len(item_objects_old) > 0:
-            # Check for duplicates
-            existing_ids = set(
-                item_objects_old.values_list('product_id', flat=True))
-            duplicate_items = [
-                obj for obj in item_objects if obj.product_id in existing_ids]
-
-            # Filter out duplicates from the original list
-            unique_cart_items = [
-                obj for obj in item_objects if obj not in duplicate_items]
-
-            for obj in duplicate_items:
-                CartItem.objects.filter(product_id=obj.product_id).update(quantity=obj.quantity,
-                                                                          is_selected=obj.is_selected)
-        else:
-            unique_cart_items = item_objects
-
-        valid_products = Product.objects.filter(
-            id__in=[obj.product_id for obj in unique_cart_items]).values_list("id", flat=True)
-        print(valid_products)
-
-        valid_cart_items = [
-            obj for obj in unique_cart_items if obj.product_id in valid_products]
-        try:
-            CartItem.objects.bulk_create(
-                valid_cart_items, ignore_conflicts=True)
-        except IntegrityError:
-            pass
+    if len(merged_items) > 0:
 
-        latest_cart = CartItem.objects.filter(
-            cart__user_id=user_id).order_by("created_at")
-        serializer = CartItemSerializer(latest_cart, many=True)
+        valid_products = set(Product.objects.filter(
+            id__in=merged_items).values_list("id", flat=True))
 
-        cache_key = f"cart:{user_id}"
-        cache.set(cache_key, json.dumps(serializer.data), timeout=settings.CACHE_TTL)
+        # Insert new lines and overwrite quantity/selection of lines already
+        # in this user's cart in a single upsert
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product_id=product_id, **fields)
+             for product_id, fields in merged_items.items() if product_id in valid_products],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity', 'is_selected'])
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        store = get_cart_store()
+        store.invalidate(user_id)
+        return json_response(render_json(serialize_cart(user_id, store)))
 
     return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -196,26 +284,29 @@ def update_cart_item(request):
     user_id = request.data.get("user_id", None)
     # item_id = request.data.pop("item_id", None)
     cart_item_dict = dict(request.data.get("cart_item", {}))
-    product_id = cart_item_dict.pop("product_id", None)
+    try:
+        product_id = parse_product_id(cart_item_dict.pop("product_id", None))
+    except (TypeError, ValueError):
+        return Response({"error": "product_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    fields, errors = cart_item_fields(cart_item_dict)
+    if errors:
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+    store = get_cart_store()
     updated = True
-    if product_id and ("quantity" in cart_item_dict or "is_selected" in cart_item_dict):
-        latest_cart = CartItem.objects.filter(
-            cart__user_id=user_id).order_by("created_at")
-        latest_cart.filter(product_id=product_id).update(**cart_item_dict)
-    elif not product_id and "is_selected" in cart_item_dict:
-        latest_cart = CartItem.objects.filter(
-            cart__user_id=user_id).order_by("created_at")
-        latest_cart.update(is_selected=cart_item_dict["is_selected"])
+    if product_id and fields:
+        CartItem.objects.filter(cart__user_id=user_id, product_id=product_id).update(**fields)
+        store.patch(user_id, [product_id], fields)
+    elif not product_id and "is_selected" in fields:
+        CartItem.objects.filter(cart__user_id=user_id).update(is_selected=fields["is_selected"])
+        items = store.load(user_id)
+        if items is not None:
+            store.patch(user_id, list(items), {"is_selected": fields["is_selected"]})
     else:
         updated = False
 
     if updated:
-        serializer = CartItemSerializer(latest_cart, many=True)
-
-        cache_key = f"cart:{user_id}"
-        cache.set(cache_key, json.dumps(serializer.data), timeout=settings.CACHE_TTL)
-
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return json_response(render_json(serialize_cart(user_id, store)))
 
     return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -224,18 +315,18 @@ def update_cart_item(request):
 def delete_cart_item(request):
     user_id = request.GET.get("user_id", None)
     # item_id = request.data.pop("item_id", None)
-    product_ids = request.GET.get("product_ids", None)
+    # Accepts product_ids=1,2 as well as repeated product_ids parameters
+    try:
+        product_ids = [int(product_id) for value in request.GET.getlist("product_ids")
+                       for product_id in value.split(",") if product_id.strip()]
+    except ValueError:
+        return Response({"error": "product_ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
 
     if product_ids:
-        latest_cart = CartItem.objects.filter(
-            cart__user_id=user_id).order_by("created_at")
-        latest_cart.filter(product_id__in=product_ids).delete()
-        serializer = CartItemSerializer(latest_cart, many=True)
-
-        cache_key = f"cart:{user_id}"
-        cache.set(cache_key, json.dumps(serializer.data), timeout=settings.CACHE_TTL)
-
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        CartItem.objects.filter(cart__user_id=user_id, product_id__in=product_ids).delete()
+        store = get_cart_store()
+        store.delete(user_id, product_ids)
+        return json_response(render_json(serialize_cart(user_id, store)))
 
     return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -247,65 +338,99 @@ def place_order(request):
     order_data = request.data.pop("order", None)
     order_items = request.data.pop("order_items", None)
 
-    if order_data and order_items:
-        order_data["user_id"] = user_id
-        order_obj = Order(**order_data)
+    if not (order_data and order_items):
+        return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
 
-        item_objects = []
+    # Later lines for the same product are dropped, as the unique constraint did
+    quantities = {}
+    try:
         for item in order_items:
             if item.get("product_id", None):
-                item_obj = OrderItem(order=order_obj, product_id=item["product_id"],
-                                     price=item["price"], quantity=item["quantity"])
-                item_objects.append(item_obj)
-
-        if len(item_objects) > 0:
-
-            valid_products = Product.objects.filter(
-                id__in=[obj.product_id for obj in item_objects]).values_list("id", flat=True)
-            print(valid_products)
-
-            valid_order_items = [
-                obj for obj in item_objects if obj.product_id in valid_products]
-            if len(valid_order_items) > 0:
-                order_obj.save()
-                try:
-                    OrderItem.objects.bulk_create(
-                        valid_order_items, ignore_conflicts=True)
-                except IntegrityError:
-                    pass
-
-                order_serializer = OrderSerializer(order_obj)
-                response_data = order_serializer.data
-                item_objects = OrderItem.objects.filter(order=order_obj)
-                item_serializer = OrderItemSerializer(item_objects, many=True)
-
-                response_data["order_items"] = item_serializer.data
-
-                return Response(response_data, status=status.HTTP_200_OK)
-
-    return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
+                quantities.setdefault(int(item["product_id"]), int(item.get("quantity", 1)))
+    except (TypeError, ValueError):
+        return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+
+    # Prices are taken from the catalog, never from the request
+    products = Product.objects.filter(id__in=quantities).only("id", "name", "slug", "price")
+    item_objects = [OrderItem(product=product, price=product.price, quantity=quantities[product.id])
+                    for product in products]
+    if not item_objects:
+        return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
+
+    order_data = {field: order_data[field] for field in ("shipping_address", "payment_method") if field in order_data}
+    order_obj = Order(user_id=user_id, total_amount=sum(obj.price * obj.quantity for obj in item_objects),
+                      **order_data)
+
+    with transaction.atomic():
+        order_obj.save()
+        for obj in item_objects:
+            obj.order = order_obj
+        OrderItem.objects.bulk_create(item_objects)
+
+        # Items already hold their product, so serializing them needs no queries
+        response_data = OrderSerializer(order_obj).data
+        response_data["order_items"] = OrderItemSerializer(item_objects, many=True).data
+
+        # Confirmation is delivered by the drain_outbox worker, off the request path
+        outbox.enqueue("order_placed", {
+            "order_id": str(order_obj.order_id),
+            "user_id": order_obj.user_id,
+            "email": request.data.get("email", None),
+            "total_amount": response_data["total_amount"],
+            "shipping_address": order_obj.shipping_address,
+            "items": response_data["order_items"],
+        })
+        transaction.on_commit(lambda: record_sales([(obj.product_id, obj.quantity) for obj in item_objects]))
+        transaction.on_commit(lambda: invalidate_tags(orders_tag(user_id)))
+
+    return Response(response_data, status=status.HTTP_200_OK)
+
+
+ORDER_HISTORY_ORDERING = ("-created_at", "-order_id")
 
 
 @api_view(['GET'])
+def get_order_history(request):
+
+    user_id = request.GET.get("user_id", None)
+    if not user_id:
+        return Response({"error": "user_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return Response({"error": "user_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+    def build():
+        versions = tag_versions([orders_tag(user_id)])
+        items = OrderItem.objects.select_related("product") \
+            .only("order", "product", "price", "quantity", "product__name", "product__slug")
+        orders = Order.objects.filter(user_id=user_id).prefetch_related(Prefetch("orderitem_set", queryset=items))
+        page, next_cursor = keyset_paginate(
+            orders, ORDER_HISTORY_ORDERING, cursor=request.GET.get("cursor"), limit=get_page_size(request))
+        serializer = OrderHistorySerializer(page, many=True)
+        return render_json({"results": serializer.data, "next_cursor": next_cursor}), versions
+
+    cache_key = "orders:{}:{}".format(user_id, page_key(request))
+    entry = get_or_set_entry(cache_key, build, timeout=settings.CACHE_TTL)
+    return json_response(entry["data"])
+
+
+@require_GET
 def get_address_list(request):
 
     user_id = request.GET.get("user_id", None)
-    cache_key = f"address:{user_id}"
-    cached_address_list = cache.get(cache_key)
-    if not cached_address_list:
+    def build():
         address_list = ShippingAddress.objects.filter(
             user_id=user_id).order_by("created_at")
         serializer = ShippingAddressSerializer(address_list, many=True)
         for addr in serializer.data:
             addr["is_selected"] = True if addr["is_default"] else False
+        return render_json(serializer.data), None
 
-        cache.set(cache_key, json.dumps(serializer.data), timeout=settings.CACHE_TTL)
-        address_list = serializer.data
-    else:
-        print("Using CACHED ADDRESSES")
-        address_list = json.loads(cached_address_list)
+    address_list = get_or_set(f"address:{user_id}", build, timeout=settings.CACHE_TTL)
 
-    return Response(address_list, status=status.HTTP_200_OK)
+    return json_response(address_list)
 
 
 @api_view(['POST'])
@@ -333,9 +458,10 @@ def add_address(request):
             updated_list.append(addr)
 
         cache_key = f"address:{user_id}"
-        cache.set(cache_key, json.dumps(updated_list), timeout=settings.CACHE_TTL)
+        body = render_json(updated_list)
+        set_cached(cache_key, body, timeout=settings.CACHE_TTL)
 
-        return Response(updated_list, status=status.HTTP_200_OK)
+        return json_response(body)
 
     return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -368,9 +494,10 @@ def edit_address(request):
             updated_list.append(addr)
 
         cache_key = f"address:{user_id}"
-        cache.set(cache_key, json.dumps(updated_list), timeout=settings.CACHE_TTL)
+        body = render_json(updated_list)
+        set_cached(cache_key, body, timeout=settings.CACHE_TTL)
 
-        return Response(updated_list, status=status.HTTP_200_OK)
+        return json_response(body)
 
     return Response({"error": "Bad Request"}, status=status.HTTP_400_BAD_REQUEST)
 
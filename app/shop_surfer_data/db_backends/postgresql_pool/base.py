@@ -0,0 +1,205 @@
+"""
+PostgreSQL backend that checks connections out of a bounded per-process
+pool instead of opening one per request.
+
+Django "closes" the connection at the end of every request (CONN_MAX_AGE
+is 0 with this backend), which returns it to the pool. Threads beyond
+POOL["MAX_SIZE"] wait up to POOL["TIMEOUT"] seconds for a free connection,
+so a process never holds more than MAX_SIZE connections.
+"""
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.db.backends.postgresql.creation import DatabaseCreation as PostgresDatabaseCreation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+
+POOL_DEFAULTS = {
+    "MAX_SIZE": 10,
+    "TIMEOUT": 10.0,
+    # Idle connections older than this are closed instead of reused
+    "MAX_IDLE": 300.0,
+    # Connections idle for longer than this are pinged before reuse
+    "HEALTH_CHECK_INTERVAL": 30.0,
+}
+
+
+class ConnectionPool:
+    def __init__(self, options):
+        self.max_size = options["MAX_SIZE"]
+        self.timeout = options["TIMEOUT"]
+        self.max_idle = options["MAX_IDLE"]
+        self.health_check_interval = options["HEALTH_CHECK_INTERVAL"]
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self.open = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+
+    def checkout(self, connect):
+        if not self._slots.acquire(blocking=False):
+            start = time.monotonic()
+            with self._lock:
+                self.waits += 1
+            acquired = self._slots.acquire(timeout=self.timeout)
+            with self._lock:
+                self.wait_seconds += time.monotonic() - start
+                if not acquired:
+                    self.timeouts += 1
+            if not acquired:
+                raise psycopg2.OperationalError(
+                    "No database connection available within {}s (pool size {})".format(self.timeout, self.max_size))
+        try:
+            connection = self._take_idle()
+            if connection is None:
+                connection = connect()
+                with self._lock:
+                    self.open += 1
+                    self.created += 1
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.checkouts += 1
+        return connection
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                # Most recently used first, so surplus connections age out
+                connection, returned_at = self._idle.pop()
+            idle_for = time.monotonic() - returned_at
+            if connection.closed or idle_for > self.max_idle or \
+                    (idle_for > self.health_check_interval and not self._ping(connection)):
+                self._discard(connection)
+                continue
+            return connection
+
+    @staticmethod
+    def _ping(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def checkin(self, connection, discard=False):
+        try:
+            if not discard and not connection.closed:
+                status = connection.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+        except psycopg2.Error:
+            discard = True
+        try:
+            if discard or connection.closed:
+                self._discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append((connection, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _discard(self, connection):
+        with self._lock:
+            self.open -= 1
+            self.discarded += 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "open": self.open,
+                "idle": len(self._idle),
+                "in_use": self.open - len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "discarded": self.discarded,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options):
+    key = (alias, tuple(sorted((k, str(v)) for k, v in conn_params.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        # A forked worker must not share the parent's sockets; drop them
+        # without closing, which would end the parent's sessions
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[key] = ConnectionPool(options)
+        return pool
+
+
+def pool_stats():
+    """Counters of every pool in this process, keyed by database alias."""
+    stats = {}
+    with _pools_lock:
+        pools = [(alias, pool) for (alias, _), pool in _pools.items() if pool.pid == os.getpid()]
+    for alias, pool in pools:
+        stats[alias] = pool.stats()
+    return stats
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_idle()
+
+
+class DatabaseCreation(PostgresDatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled sessions would block DROP DATABASE
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        options = {**POOL_DEFAULTS, **self.settings_dict.get("POOL", {})}
+        self.connection_pool = get_pool(self.alias, conn_params, options)
+        # Normally set while connecting; pooled connections were all opened
+        # with the same OPTIONS
+        self.isolation_level = IsolationLevel(
+            self.settings_dict["OPTIONS"].get("isolation_level", IsolationLevel.READ_COMMITTED))
+        return self.connection_pool.checkout(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            # A connection closed inside atomic() stays referenced by this
+            # wrapper until the block exits, so it cannot go back to the pool
+            with self.wrap_database_errors:
+                self.connection_pool.checkin(self.connection, discard=self.in_atomic_block)
@@ -13,7 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from datetime import timedelta
 import dj_database_url
-from decouple import config
+from django.core.exceptions import ImproperlyConfigured
+from decouple import config, Csv
 
 from pathlib import Path
 
@@ -56,6 +57,14 @@ INSTALLED_APPS = [
 #     )
 # }
 
+REST_FRAMEWORK = {
+    # JSON rendering is timed as the serialize phase of the request metrics
+    'DEFAULT_RENDERER_CLASSES': (
+        'shop.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
+
 # SIMPLE_JWT = {
 #     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
 #     'REFRESH_TOKEN_LIFETIME': timedelta(hours=1),
@@ -87,6 +96,8 @@ INSTALLED_APPS = [
 # }
 
 MIDDLEWARE = [
+    'shop.metrics.MetricsMiddleware',
+    'shop.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -141,24 +152,124 @@ WSGI_APPLICATION = 'shop_surfer_data.wsgi.application'
 # }
 
 
+# start.sh runs gunicorn with sync workers (wsgi) or uvicorn workers (asgi)
+SERVER_MODE = config("SERVER_MODE", default="wsgi")
+GUNICORN_WORKERS = config("GUNICORN_WORKERS", default=2, cast=int)
+GUNICORN_THREADS = config("GUNICORN_THREADS", default=4, cast=int)
+
 DATABASES = {
-    'default': dj_database_url.config("DATABASE_URL", default=config("DATABASE_URL", default=""))
+    'default': dj_database_url.config(
+        "DATABASE_URL", default=config("DATABASE_URL", default=""),
+        # Persistent connections are per thread, which ASGI does not reuse
+        conn_max_age=config("DB_CONN_MAX_AGE", default=0 if SERVER_MODE == "asgi" else 600, cast=int),
+        conn_health_checks=True,
+    )
 }
 
-REDIS_URL = config("REDIS_URL", default="redis_url")
-
-CACHES = {
-    'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
-        'LOCATION': REDIS_URL,
-        'OPTIONS': {
-            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+# With DB_POOL, Postgres connections come from a bounded per-process pool
+# and go back to it at the end of each request. A process needs at most one
+# connection per request thread, plus one for the ASGI sync thread or
+# management code, and the whole deployment must fit in DB_MAX_CONNECTIONS:
+#   APP_INSTANCES * GUNICORN_WORKERS * DB_POOL_MAX_SIZE + DB_RESERVED_CONNECTIONS
+DB_POOL = config("DB_POOL", default=True, cast=bool)
+DB_MAX_CONNECTIONS = config("DB_MAX_CONNECTIONS", default=100, cast=int)
+DB_RESERVED_CONNECTIONS = config("DB_RESERVED_CONNECTIONS", default=10, cast=int)
+APP_INSTANCES = config("APP_INSTANCES", default=1, cast=int)
+DB_POOL_MAX_SIZE = config("DB_POOL_MAX_SIZE", cast=int, default=max(1, min(
+    GUNICORN_THREADS + 1,
+    (DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS) // (APP_INSTANCES * GUNICORN_WORKERS),
+)))
+
+if DB_POOL and DATABASES['default'].get('ENGINE') == 'django.db.backends.postgresql':
+    DATABASES['default'].update({
+        'ENGINE': 'shop_surfer_data.db_backends.postgresql_pool',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': DB_POOL_MAX_SIZE,
+            'TIMEOUT': config("DB_POOL_TIMEOUT", default=10.0, cast=float),
+            'MAX_IDLE': config("DB_POOL_MAX_IDLE", default=300.0, cast=float),
+        },
+    })
+
+REDIS_URL = config("REDIS_URL", default="")
+
+# Every worker shares the redis cache. A per-process locmem cache is only
+# meant for tests and local benchmarks and has to be asked for explicitly
+# with CACHE_BACKEND=locmem (see test_settings.py).
+CACHE_BACKEND = config("CACHE_BACKEND", default="redis")
+
+if CACHE_BACKEND == "redis":
+    if not REDIS_URL:
+        raise ImproperlyConfigured("REDIS_URL is not set (use CACHE_BACKEND=locmem for a local cache)")
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            }
         }
     }
-}
+elif CACHE_BACKEND == "locmem":
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    raise ImproperlyConfigured("Unknown CACHE_BACKEND {!r}".format(CACHE_BACKEND))
 
 CACHE_TTL = 3600
 
+# Catalog entries are invalidated through tags when products or categories
+# change, so they can live much longer than per-user data
+CATALOG_CACHE_TTL = config("CATALOG_CACHE_TTL", default=86400, cast=int)
+
+# Only one request rebuilds a missing cache entry; the rest wait for it
+CACHE_LOCK_TIMEOUT = 10
+CACHE_LOCK_WAIT = 2.0
+
+# Per-worker LRU in front of redis for catalog reads. Workers notice
+# invalidations within LOCAL_CACHE_CHECK_INTERVAL seconds.
+LOCAL_CACHE_MAX_ENTRIES = config("LOCAL_CACHE_MAX_ENTRIES", default=5000, cast=int)
+LOCAL_CACHE_MAX_BYTES = config("LOCAL_CACHE_MAX_BYTES", default=64 * 1024 * 1024, cast=int)
+LOCAL_CACHE_TTL = config("LOCAL_CACHE_TTL", default=300, cast=int)
+LOCAL_CACHE_CHECK_INTERVAL = config("LOCAL_CACHE_CHECK_INTERVAL", default=1.0, cast=float)
+
+# manage.py warm_cache, run by start.sh before (WARM_CACHE=sync) or next to
+# (background) the web server: how many best selling products to render, at
+# most WARM_CACHE_RATE per second so warming does not starve live traffic
+WARM_CACHE_PRODUCTS = config("WARM_CACHE_PRODUCTS", default=5000, cast=int)
+WARM_CACHE_RATE = config("WARM_CACHE_RATE", default=1000, cast=float)
+
+# Responses of at least COMPRESSION_MIN_SIZE bytes are sent with brotli (if
+# the Brotli package is installed) or gzip. Cached catalog bodies are
+# compressed once when filled, so they can use slower, smaller settings.
+COMPRESSION_MIN_SIZE = config("COMPRESSION_MIN_SIZE", default=1024, cast=int)
+GZIP_LEVEL = config("GZIP_LEVEL", default=6, cast=int)
+GZIP_CACHED_LEVEL = config("GZIP_CACHED_LEVEL", default=9, cast=int)
+BROTLI_QUALITY = config("BROTLI_QUALITY", default=4, cast=int)
+BROTLI_CACHED_QUALITY = config("BROTLI_CACHED_QUALITY", default=11, cast=int)
+
+# HTTP caching of catalog responses. Browsers revalidate with the ETag. A CDN
+# may keep responses for longer (CATALOG_SURROGATE_CONTROL, e.g.
+# "max-age=86400") only together with CDN_PURGE_URL, so that invalidated tags
+# are purged by their Surrogate-Key, e.g.
+# https://api.fastly.com/service/<service id>/purge
+CATALOG_CACHE_CONTROL = config("CATALOG_CACHE_CONTROL", default="public, max-age=60, stale-while-revalidate=300")
+CATALOG_SURROGATE_CONTROL = config("CATALOG_SURROGATE_CONTROL", default="")
+CDN_PURGE_URL = config("CDN_PURGE_URL", default="")
+CDN_PURGE_TOKEN = config("CDN_PURGE_TOKEN", default="")
+CDN_PURGE_TIMEOUT = config("CDN_PURGE_TIMEOUT", default=5, cast=float)
+
+# Prebuilt product search index (manage.py build_search_index, run by
+# start.sh), built in the background by each worker when missing
+SEARCH_INDEX_PATH = config("SEARCH_INDEX_PATH", default="")
+SEARCH_INDEX_CHECK_INTERVAL = config("SEARCH_INDEX_CHECK_INTERVAL", default=30, cast=int)
+
+# Under ASGI the hot read endpoints are routed to shop.async_views
+ASYNC_READ_VIEWS = config("ASYNC_READ_VIEWS", default=SERVER_MODE == "asgi", cast=bool)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -211,9 +322,15 @@ GMAIL_APP_PASSWORD = config("GMAIL_APP_PASSWORD", default="")
 # Set the URL scheme to HTTPS if needed
 AWS_S3_SECURE_URLS = True
 
-# Configure static and media file storage classes
-STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# Configure static and media file storage classes. "filesystem" keeps
+# uploads under MEDIA_ROOT for local runs and benchmarks.
+MEDIA_STORAGE = config("MEDIA_STORAGE", default="s3")
+if MEDIA_STORAGE == "filesystem":
+    STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+else:
+    STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
 AWS_ACCESS_KEY_ID = config("AWS_ACCESS_KEY_ID", default="")
 AWS_SECRET_ACCESS_KEY = config("AWS_SECRET_ACCESS_KEY", default="")
@@ -225,11 +342,49 @@ AWS_S3_FILE_OVERWRITE = False
 AWS_QUERYSTRING_AUTH = False
 AWS_DEFAULT_ACL = "public-read"
 AWS_S3_OBJECT_PARAMETERS = {"CacheControl": "max-age=86400"}
-MEDIA_URL = 'https://%s/' % AWS_STORAGE_BUCKET_NAME
+if MEDIA_STORAGE == "filesystem":
+    MEDIA_ROOT = config("MEDIA_ROOT", default=os.path.join(BASE_DIR, 'media'))
+    MEDIA_URL = '/media/'
+else:
+    MEDIA_URL = 'https://%s/' % AWS_STORAGE_BUCKET_NAME
+
+# Product and category images get resized JPEG/PNG and WebP copies at these
+# widths, rendered in a pool of IMAGE_RENDITION_WORKERS processes (0 renders
+# in the calling thread). Uploads are processed in a background thread
+# unless IMAGE_RENDITIONS_BACKGROUND is off.
+IMAGE_RENDITION_WIDTHS = config("IMAGE_RENDITION_WIDTHS", default="160,320,640,1024", cast=Csv(int))
+IMAGE_RENDITION_QUALITY = config("IMAGE_RENDITION_QUALITY", default=80, cast=int)
+IMAGE_RENDITION_WORKERS = config("IMAGE_RENDITION_WORKERS", default=2, cast=int)
+IMAGE_RENDITIONS_BACKGROUND = config("IMAGE_RENDITIONS_BACKGROUND", default=True, cast=bool)
 SNS_TOPIC_ARN = config("SNS_TOPIC_ARN", default="")
 
+# Notifications are written to the outbox with the order and delivered by
+# `manage.py drain_outbox`. Transports: smtp, sns, file, memory or a dotted
+# path to a class.
+NOTIFICATION_TRANSPORTS = config("NOTIFICATION_TRANSPORTS", default="file", cast=Csv())
+NOTIFICATION_FILE_PATH = config("NOTIFICATION_FILE_PATH", default=os.path.join(BASE_DIR, "notifications.jsonl"))
+EMAIL_HOST = config("EMAIL_HOST", default="smtp.gmail.com")
+EMAIL_PORT = config("EMAIL_PORT", default=587, cast=int)
+EMAIL_USE_TLS = True
+EMAIL_TIMEOUT = 10
+OUTBOX_BATCH_SIZE = config("OUTBOX_BATCH_SIZE", default=100, cast=int)
+OUTBOX_CONCURRENCY = config("OUTBOX_CONCURRENCY", default=4, cast=int)
+OUTBOX_MAX_ATTEMPTS = config("OUTBOX_MAX_ATTEMPTS", default=8, cast=int)
+OUTBOX_RETRY_BACKOFF = config("OUTBOX_RETRY_BACKOFF", default=30, cast=int)
+OUTBOX_MAX_BACKOFF = config("OUTBOX_MAX_BACKOFF", default=3600, cast=int)
+OUTBOX_LEASE_TIMEOUT = config("OUTBOX_LEASE_TIMEOUT", default=300, cast=int)
+
 REACT_APP_URL = config("REACT_APP_URL", "http://localhost:3000")
 
+# Request metrics: every request feeds /metrics and gets a Server-Timing
+# header; this fraction of requests, and all slow ones, are also logged
+METRICS_LOG_SAMPLE_RATE = config("METRICS_LOG_SAMPLE_RATE", default=0.01, cast=float)
+METRICS_SLOW_REQUEST_MS = config("METRICS_SLOW_REQUEST_MS", default=500, cast=float)
+# Directory where each worker publishes its metrics so /metrics reports the
+# sum over all workers (start.sh sets it); empty for per-process metrics
+METRICS_DIR = config("METRICS_DIR", default="")
+METRICS_FLUSH_INTERVAL = config("METRICS_FLUSH_INTERVAL", default=1, cast=float)
+
 
 LOGGING = {
     'version': 1,
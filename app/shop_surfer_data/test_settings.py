@@ -0,0 +1,10 @@
+"""
+Settings for ``manage.py test``: the regular settings with a per-process
+locmem cache, so the suite runs without a redis server.
+"""
+
+import os
+
+os.environ.setdefault("CACHE_BACKEND", "locmem")
+
+from shop_surfer_data.settings import *  # noqa: E402,F401,F403
@@ -1,3 +1,34 @@
 #!/bin/sh
 
-gunicorn shop_surfer_data.wsgi:application -b 0.0.0.0:80
\ No newline at end of file
+# Workers publish their request metrics here so /metrics sums all of them;
+# start every container with empty counters
+export METRICS_DIR="${METRICS_DIR:-/tmp/shop-metrics}"
+rm -rf "$METRICS_DIR"
+mkdir -p "$METRICS_DIR"
+
+# Workers load the search index from this file instead of building it
+# from the database while serving searches
+export SEARCH_INDEX_PATH="${SEARCH_INDEX_PATH:-/tmp/shop-search-index.pickle}"
+python manage.py build_search_index || true
+
+python manage.py flush_sales --interval "${SALES_FLUSH_INTERVAL:-60}" &
+python manage.py drain_outbox --interval "${OUTBOX_POLL_INTERVAL:-5}" &
+
+# Fill the catalog caches before taking traffic (sync) or while already
+# serving it (background); a failed warm-up never blocks the start
+case "${WARM_CACHE:-background}" in
+    sync)
+        python manage.py warm_cache --time-limit "${WARM_CACHE_TIME_LIMIT:-120}" || true
+        ;;
+    background)
+        python manage.py warm_cache &
+        ;;
+esac
+
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    gunicorn shop_surfer_data.asgi:application -k uvicorn.workers.UvicornWorker -b 0.0.0.0:80 \
+        --workers "${GUNICORN_WORKERS:-2}"
+else
+    gunicorn shop_surfer_data.wsgi:application -b 0.0.0.0:80 \
+        --workers "${GUNICORN_WORKERS:-2}" --threads "${GUNICORN_THREADS:-4}"
+fi